@@ -0,0 +1,89 @@
+"""
+Benchmark of the history written by debit transitions
+
+Moves debits from pending to loaded in a revision (as a request would) with
+each history backend and reports the rows and bytes written to the events,
+reversion and debit change tables. Runs against MAGUIRE_DATABASE and rolls
+everything back. Run from the backend directory:
+
+    python benchmarks/debit_history.py [transitions]
+
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "maguire.testsettings")
+
+import django  # noqa: E402
+django.setup()
+
+import reversion  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from debits.bulk import create_debits  # noqa: E402
+from debits.history import BACKENDS, history_backend  # noqa: E402
+from debits.transitions import transition_debits  # noqa: E402
+
+
+TABLES = ("events_event", "reversion_version", "reversion_revision", "debits_debitchange")
+CHUNK_SIZE = 1000
+
+
+def table_sizes():
+    """
+    Returns (rows, bytes) of each table, bytes being the size of the rows
+    """
+    sizes = {}
+    with connection.cursor() as cursor:
+        for table in TABLES:
+            cursor.execute(
+                "SELECT count(*), coalesce(sum(pg_column_size(t.*)), 0) FROM %s t" % (table, ))
+            sizes[table] = cursor.fetchone()
+    return sizes
+
+
+def make_debits(count):
+    debits = []
+    with history_backend("events"):
+        for start in range(0, count, CHUNK_SIZE):
+            debits.extend(debit for debit, _ in create_debits([{
+                "account_name": "Bobby Ninetoes",
+                "account_number": "123412341234",
+                "branch_code": "632005",
+                "amount": "100.00",
+                "scheduled_at": timezone.now(),
+            } for _ in range(min(CHUNK_SIZE, count - start))]))
+    return debits
+
+
+def measure(backend, count):
+    with transaction.atomic():
+        debits = make_debits(count)
+        before = table_sizes()
+        with history_backend(backend), reversion.create_revision():
+            for start in range(0, count, CHUNK_SIZE):
+                transition_debits(
+                    debits[start:start + CHUNK_SIZE], "loaded",
+                    provider="easydebit", loaded_at=timezone.now())
+        after = table_sizes()
+        transaction.set_rollback(True)
+    return {table: (after[table][0] - before[table][0], after[table][1] - before[table][1])
+            for table in TABLES}
+
+
+def main(count):
+    print("%-10s %-20s %10s %12s" % ("backend", "table", "rows", "KiB"))
+    for backend in BACKENDS:
+        written = measure(backend, count)
+        for table in TABLES:
+            rows, size = written[table]
+            print("%-10s %-20s %10s %12.1f" % (backend, table, rows, size / 1024))
+        print("%-10s %-20s %10s %12.1f" % (
+            backend, "total", sum(rows for rows, _ in written.values()),
+            sum(size for _, size in written.values()) / 1024))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,97 @@
+"""
+Benchmark of the queries made saving debits
+
+Counts the queries of the EasyDebit load path (load_debits with the
+provider's response mocked) and of saving a debit whose status changed,
+validated in full, validated for update_fields only and not validated.
+Runs against MAGUIRE_DATABASE and rolls everything back. Run from the
+backend directory:
+
+    python benchmarks/debit_save_queries.py [debits]
+
+"""
+import itertools
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "maguire.testsettings")
+
+import django  # noqa: E402
+django.setup()
+
+import responses  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from debits.models import Debit  # noqa: E402
+from debits.providers.easydebit.provider import EasyDebitProvider  # noqa: E402
+
+
+REFERENCES = itertools.count()
+
+SAVES = (
+    ("save()", {}),
+    ("save(update_fields)", {"update_fields": ["status", "updated_at"]}),
+    ("save(validate=False)", {"validate": False}),
+)
+
+
+def make_debits(count, user):
+    return [Debit.objects.create(
+        downstream_reference="benchmark-%s" % (next(REFERENCES), ),
+        account_name="Bobby Ninetoes",
+        account_number="123412341234",
+        branch_code="632005",
+        amount="100.00",
+        scheduled_at=timezone.now(),
+        created_by=user,
+    ) for _ in range(count)]
+
+
+def count_queries(func):
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    return len(queries)
+
+
+def load_path(count, user):
+    provider = EasyDebitProvider()
+    provider.config = settings.DEBIT_CONFIG
+    provider.setup_provider()
+    ids = [str(debit.id) for debit in make_debits(count, user)]
+    with responses.RequestsMock() as mock:
+        mock.add(
+            responses.POST, provider.config["base_url"] + "SaveOnceOffPayments",
+            body="<SRP><EL/></SRP>", status=200, content_type="application/xml")
+        return count_queries(lambda: provider.load_debits(ids))
+
+
+def status_saves(count, user, kwargs):
+    debits = list(Debit.objects.filter(id__in=[
+        debit.id for debit in make_debits(count, user)]))
+
+    def save():
+        for debit in debits:
+            debit.status = "loaded"
+            debit.save(**kwargs)
+    return count_queries(save)
+
+
+def main(count):
+    print("%-24s %8s %10s %12s" % ("path", "debits", "queries", "per debit"))
+    with transaction.atomic():
+        user = User.objects.create_user("debit_save_queries")
+        rows = [("load_debits", load_path(count, user))]
+        for name, kwargs in SAVES:
+            rows.append((name, status_saves(count, user, kwargs)))
+        transaction.set_rollback(True)
+    for name, queries in rows:
+        print("%-24s %8s %10s %12.1f" % (name, count, queries, queries / count))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
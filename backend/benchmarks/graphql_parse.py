@@ -0,0 +1,87 @@
+"""
+Benchmark of GraphQL document parsing and validation
+
+Compares parsing and validating a typical integration query on every
+request with looking it up in the document cache of maguire.persisted. Run
+from the backend directory:
+
+    python benchmarks/graphql_parse.py [requests]
+
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "maguire.testsettings")
+
+import django  # noqa: E402
+django.setup()
+
+from graphql import parse, validate  # noqa: E402
+
+from maguire.persisted import document_cache, get_document, query_hash  # noqa: E402
+from maguire.schema import schema  # noqa: E402
+
+
+QUERY = """
+query Debits($first: Int, $after: String, $status: String) {
+    debits(first: $first, after: $after, status: $status, orderBy: "created_at") {
+        totalCount
+        pageInfo { hasNextPage endCursor }
+        edges {
+            node {
+                id
+                client
+                downstreamReference
+                accountName
+                accountNumber
+                branchCode
+                accountType
+                status
+                amount
+                reference
+                providerStatus
+                scheduledAt
+                loadedAt
+                lastError
+                createdAt
+                updatedAt
+            }
+        }
+    }
+}
+"""
+
+
+def uncached(graphql_schema, query):
+    document = parse(query)
+    assert not validate(graphql_schema, document)
+    return document
+
+
+def cached(graphql_schema, query):
+    # the hash is computed on every request, like the view does
+    document, errors = get_document(graphql_schema, query_hash(query), query)
+    assert not errors
+    return document
+
+
+def measure(func, graphql_schema, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        func(graphql_schema, QUERY)
+    return time.perf_counter() - start
+
+
+def main(requests):
+    graphql_schema = schema.graphql_schema
+    document_cache.clear()
+    print("%8s  %-8s %10s %14s" % ("requests", "path", "seconds", "us/request"))
+    for name, func in (("parse", uncached), ("cached", cached)):
+        elapsed = measure(func, graphql_schema, requests)
+        print("%8s  %-8s %10.3f %14.1f" % (requests, name, elapsed, elapsed / requests * 1e6))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,101 @@
+"""
+Benchmark of EasyDebit SRQ payload serialization
+
+Compares the single-pass SRQWriter with the previous ElementTree + minidom
+pretty-printing path. Run from the backend directory:
+
+    python benchmarks/srq_payload.py [sizes...]
+
+"""
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from xml.dom import minidom
+from xml.etree.ElementTree import Element, SubElement, tostring
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "maguire.testsettings")
+
+import django  # noqa: E402
+django.setup()
+
+from debits.providers.easydebit.payload import SRQWriter  # noqa: E402
+from debits.providers.easydebit.provider import EasyDebitProvider  # noqa: E402
+
+
+CONFIG = {
+    "base_url": "",
+    "authentication": {"service_reference": "37H2-F00Z-735Q-1B11", "username": "uname"},
+    "bank_ref": "PICSA",
+    "group_code": "PICSA",
+}
+
+
+def make_debits(count):
+    return [SimpleNamespace(
+        reference="%09d" % i,
+        client="client-%s" % i,
+        amount="13500.00",
+        scheduled_at=datetime(2018, 2, 13, tzinfo=timezone.utc),
+        account_type="current",
+        branch_code="632005",
+        account_number="123412341234",
+        account_name="Bobby Ninetoes & Sons",
+    ) for i in range(count)]
+
+
+def minidom_payload(provider, debits):
+    e_root = Element('SRQ')
+    e_credentials = SubElement(e_root, 'CR')
+    SubElement(e_credentials, 'U').text = provider.config["authentication"]["username"]
+    SubElement(e_credentials, 'P').text = provider.config["authentication"]["hash"]
+    se_paymentlist = SubElement(e_root, 'PL')
+    for debit in debits:
+        e_paymentitem = SubElement(se_paymentlist, 'PI')
+        for tag, text in provider._format_debit(debit):
+            SubElement(e_paymentitem, tag).text = text
+    reparsed = minidom.parseString(tostring(e_root, encoding='utf-8'))
+    return reparsed.toprettyxml(indent="  ", encoding="utf-8")
+
+
+def writer_payload(provider, debits):
+    writer = SRQWriter(
+        provider.config["authentication"]["username"],
+        provider.config["authentication"]["hash"])
+    for debit in debits:
+        writer.write_payment(provider._format_debit(debit))
+    return writer.getvalue()
+
+
+def measure(func, provider, debits):
+    start = time.perf_counter()
+    payload = func(provider, debits)
+    elapsed = time.perf_counter() - start
+    # memory is measured on a second run, tracing skews the timings
+    tracemalloc.start()
+    func(provider, debits)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return payload, elapsed, peak
+
+
+def main(sizes):
+    provider = EasyDebitProvider()
+    provider.config = CONFIG
+    provider.setup_provider()
+
+    print("%8s  %-8s %10s %12s" % ("debits", "path", "seconds", "peak MiB"))
+    for size in sizes:
+        debits = make_debits(size)
+        old, old_time, old_peak = measure(minidom_payload, provider, debits)
+        new, new_time, new_peak = measure(writer_payload, provider, debits)
+        assert old == new, "payloads differ"
+        print("%8s  %-8s %10.3f %12.1f" % (size, "minidom", old_time, old_peak / 2**20))
+        print("%8s  %-8s %10.3f %12.1f" % (size, "writer", new_time, new_peak / 2**20))
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [1000, 10000, 100000])
@@ -1,11 +1,38 @@
+import tablib
 from django.contrib import admin
+from import_export import resources
 from import_export.admin import ExportMixin
 
-from debits.models import Debit
+from debits.models import Debit, DebitCallback
+from debits.serialization import DEBIT_FIELDS, debit_serializer
+from maguire.admin import AppModelAdmin
+
+
+class DebitResource(resources.ModelResource):
+    """
+    Exports debits as their JSON representation, from values() rows
+    """
+
+    class Meta:
+        model = Debit
+        fields = DEBIT_FIELDS
+
+    def export(self, queryset=None, **kwargs):
+        self.before_export(queryset, **kwargs)
+        if queryset is None:
+            queryset = self.get_queryset()
+        queryset = self.filter_export(queryset, **kwargs)
+        headers = self.get_export_headers(selected_fields=kwargs.get("export_fields"))
+        dataset = tablib.Dataset(headers=headers)
+        for data in debit_serializer.iter_data(queryset):
+            dataset.append([data[name] for name in headers])
+        self.after_export(queryset, dataset, **kwargs)
+        return dataset
 
 
 @admin.register(Debit)
-class DebitAdmin(ExportMixin, admin.ModelAdmin):
+class DebitAdmin(ExportMixin, AppModelAdmin):
+    resource_classes = [DebitResource]
     list_display = [
         "id", "client", "status", "downstream_reference", "reference", "load_attempts",
         "scheduled_at", "loaded_at", "created_at", "updated_at",
@@ -23,3 +50,20 @@ class DebitAdmin(ExportMixin, admin.ModelAdmin):
     ordering = [
         "-created_at"
     ]
+
+
+@admin.register(DebitCallback)
+class DebitCallbackAdmin(AppModelAdmin):
+    list_display = [
+        "id", "debit", "debit_status", "url", "status", "attempts",
+        "next_attempt_at", "delivered_at", "created_at", "updated_at",
+    ]
+    list_filter = [
+        "status", "debit_status", "attempts", "next_attempt_at", "delivered_at",
+    ]
+    search_fields = [
+        "debit__id", "url",
+    ]
+    ordering = [
+        "-created_at"
+    ]
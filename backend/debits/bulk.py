@@ -0,0 +1,97 @@
+"""
+Bulk creation of debits
+
+Validates a whole batch of debits in memory, checks downstream references
+with one query, allocates references from the sequence in one round trip and
+inserts the debits and their model.created Events with bulk_create, instead
+of a save() (and its queries and post_save Event) per debit.
+
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from events.models import Event
+from events.writer import write_events
+
+from .history import record_history
+from .models import Debit, allocate_debit_references
+
+
+BULK_BATCH_SIZE = 1000
+
+# Fields that may be set when creating a debit through the API or an import
+CREATE_FIELDS = [
+    "client", "downstream_reference", "callback_url", "account_name",
+    "account_number", "branch_code", "account_type", "amount", "scheduled_at",
+]
+
+
+def validate_debits(items, user=None):
+    """
+    Builds an unsaved Debit from each item (a dict of CREATE_FIELDS values)
+    and validates it. Returns a (debit, errors) pair per item, errors is a
+    dict of field name to messages and empty when the debit is valid.
+    """
+    results = []
+    for item in items:
+        debit = Debit(created_by=user, **{
+            field: value for field, value in item.items() if field in CREATE_FIELDS})
+        try:
+            # references are allocated on insert, users were looked up by the
+            # caller and uniqueness is checked for the whole batch below
+            debit.full_clean(
+                exclude=["reference", "created_by", "updated_by"], validate_unique=False)
+        except ValidationError as e:
+            results.append((debit, e.message_dict))
+        else:
+            results.append((debit, {}))
+
+    downstream_references = [
+        debit.downstream_reference for debit, errors in results
+        if not errors and debit.downstream_reference]
+    taken = set(Debit.objects.filter(
+        downstream_reference__in=downstream_references
+    ).values_list("downstream_reference", flat=True)) if downstream_references else set()
+    for debit, errors in results:
+        if errors or not debit.downstream_reference:
+            continue
+        if debit.downstream_reference in taken:
+            error = debit.unique_error_message(Debit, ["downstream_reference"])
+            errors["downstream_reference"] = [str(message) for message in error.messages]
+        taken.add(debit.downstream_reference)
+    return results
+
+
+def create_debits(items, user=None):
+    """
+    Validates items and creates the valid ones, with their model.created
+    Events, in a single transaction. Returns a (debit, errors) pair per
+    item, debit is saved when errors is empty.
+    """
+    results = validate_debits(items, user)
+    debits = [debit for debit, errors in results if not errors]
+    if not debits:
+        return results
+
+    with transaction.atomic():
+        for debit, reference in zip(debits, allocate_debit_references(len(debits))):
+            debit.reference = reference
+        Debit.objects.bulk_create(debits, batch_size=BULK_BATCH_SIZE)
+
+        source_model = ContentType.objects.get_for_model(Debit)
+        event_at = timezone.now()
+        write_events([
+            Event(
+                source_model=source_model,
+                source_id=debit.id,
+                event_at=event_at,
+                event_type="model.created",
+                event_data=debit.as_json(),
+                created_by=user,
+            ) for debit in debits
+        ])
+
+        record_history(debits, user_id=getattr(user, "pk", None))
+    return results
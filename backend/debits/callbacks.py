@@ -0,0 +1,155 @@
+"""
+Delivery of debit outcomes to debit callback URLs
+
+When a debit reaches "successful" or "failed" a DebitCallback is queued for
+it. t_deliver_callbacks leases due callbacks, groups them by host and delivers
+each host's callbacks over its own keep-alive session, with the hosts served
+concurrently. Failed deliveries are retried with exponential backoff.
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from celery.utils.log import get_task_logger
+
+from maguire.serialization import dumps
+
+from .models import DebitCallback
+from .serialization import debit_serializer
+
+
+tl = get_task_logger(__name__)
+
+FINAL_STATUSES = ("successful", "failed")
+
+
+def queue_callbacks(debits):
+    """
+    Queues a callback for every debit with a callback_url that has reached a
+    final status. An outcome that was already queued is not queued again.
+    """
+    callbacks = [
+        DebitCallback(debit=debit, debit_status=debit.status, url=debit.callback_url)
+        for debit in debits
+        if debit.status in FINAL_STATUSES and debit.callback_url
+    ]
+    if not callbacks:
+        return 0
+    DebitCallback.objects.bulk_create(callbacks, ignore_conflicts=True)
+
+    def run_task_deliver_callbacks():
+        from .tasks import t_deliver_callbacks
+        try:
+            t_deliver_callbacks.apply_async()
+        except Exception:
+            # the periodic run will pick them up
+            tl.exception("Could not dispatch t_deliver_callbacks")
+    transaction.on_commit(run_task_deliver_callbacks)
+    return len(callbacks)
+
+
+def _headers(callback):
+    headers = {
+        "Content-Type": "application/json",
+        # lets receivers recognise a redelivery of the same outcome
+        "Idempotency-Key": str(callback.id),
+    }
+    if settings.CALLBACK_TOKEN_DEBITS:
+        headers["Authorization"] = "Token %s" % (settings.CALLBACK_TOKEN_DEBITS,)
+    return headers
+
+
+def _deliver_host(deliveries, timeout):
+    """
+    Delivers (callback, JSON payload) pairs for one host in turn over a
+    single session. Returns (callback, error) pairs, error is None when delivered.
+    """
+    results = []
+    with requests.Session() as session:
+        for callback, payload in deliveries:
+            try:
+                response = session.post(
+                    callback.url, data=payload, headers=_headers(callback), timeout=timeout)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                results.append((callback, str(e)))
+            else:
+                results.append((callback, None))
+    return results
+
+
+def deliver_callbacks(limit=None):
+    """
+    Leases up to limit due callbacks and delivers them. The claim pushes
+    their next_attempt_at past the time the delivery can take and commits
+    before anything is sent, so overlapping runs skip them without a
+    transaction (and row locks) held open over the HTTP calls. The outcomes
+    are then written in a short transaction of their own. If the run dies
+    in between, the callbacks are delivered again once the lease has passed.
+    Returns the number delivered and the number that failed.
+    """
+    limit = limit or int(settings.DEBIT_CALLBACK_BATCH_SIZE)
+    max_attempts = int(settings.DEBIT_CALLBACK_ATTEMPTS)
+    backoff = int(settings.DEBIT_CALLBACK_BACKOFF)
+    timeout = float(settings.DEBIT_CALLBACK_TIMEOUT)
+
+    with transaction.atomic():
+        callbacks = list(DebitCallback.objects.select_for_update(
+            skip_locked=True, of=("self",)
+        ).select_related("debit").filter(
+            status="pending", next_attempt_at__lte=timezone.now()
+        ).order_by("next_attempt_at")[:limit])
+        if not callbacks:
+            return 0, 0
+
+        # payloads are built here, the delivery threads don't touch the database
+        by_host = {}
+        for callback in callbacks:
+            payload = dumps(dict(
+                debit_serializer.instance_data(callback.debit), status=callback.debit_status))
+            by_host.setdefault(urlsplit(callback.url).netloc, []).append((callback, payload))
+
+        # each host's callbacks are sent in turn, each can take the connect
+        # and the read timeout
+        leased_until = timezone.now() + timedelta(
+            seconds=2 * timeout * max(len(deliveries) for deliveries in by_host.values()))
+        DebitCallback.objects.filter(id__in=[callback.id for callback in callbacks]).update(
+            next_attempt_at=leased_until)
+
+    workers = min(len(by_host), int(settings.DEBIT_CALLBACK_CONCURRENCY))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = [
+            result
+            for host_results in pool.map(
+                lambda deliveries: _deliver_host(deliveries, timeout),
+                by_host.values())
+            for result in host_results
+        ]
+
+    now = timezone.now()
+    delivered = 0
+    for callback, error in results:
+        callback.attempts = callback.attempts + 1
+        callback.last_error = error
+        callback.updated_at = now
+        if error is None:
+            callback.status = "delivered"
+            callback.delivered_at = now
+            delivered += 1
+        elif callback.attempts >= max_attempts:
+            callback.status = "failed"
+        else:
+            callback.next_attempt_at = now + timedelta(
+                seconds=backoff * 2 ** (callback.attempts - 1))
+    with transaction.atomic():
+        DebitCallback.objects.bulk_update(callbacks, [
+            "status", "attempts", "last_error", "next_attempt_at", "delivered_at",
+            "updated_at"])
+
+    return delivered, len(results) - delivered
@@ -0,0 +1,93 @@
+"""
+History of debit changes
+
+Every change to a debit is recorded as an Event (model.created or
+model.updated). The history backend decides what is written on top of it:
+
+- reversion: a full django-reversion snapshot of the debit, when a revision
+  is active (e.g. in a request), as before
+- events: nothing, the Event log is the history
+- diff: a DebitChange row with only the changed fields' new values
+
+DEBIT_HISTORY_BACKEND is the default, history_backend() selects the backend
+for a block of code, so batch jobs can opt into a cheaper one. Bulk creates
+and imports use DEBIT_BULK_HISTORY_BACKEND.
+
+"""
+from contextlib import contextmanager
+import threading
+
+import reversion
+
+from django.conf import settings
+from django.utils import timezone
+
+from maguire.serialization import RowSerializer
+
+from .models import Debit, DebitChange
+
+
+REVERSION = "reversion"
+EVENTS = "events"
+DIFF = "diff"
+BACKENDS = (REVERSION, EVENTS, DIFF)
+BATCH_SIZE = 1000
+
+_local = threading.local()
+
+
+def get_backend():
+    return getattr(_local, "backend", None) or settings.DEBIT_HISTORY_BACKEND
+
+
+@contextmanager
+def history_backend(backend):
+    """
+    Records the history of debits changed in the block with backend
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Unknown history backend %r, expected one of %s" % (
+            backend, ", ".join(BACKENDS)))
+    previous = getattr(_local, "backend", None)
+    _local.backend = backend
+    try:
+        yield
+    finally:
+        _local.backend = previous
+
+
+@contextmanager
+def save_context():
+    """
+    Context of a debit save: unless the backend is reversion, reversion
+    doesn't snapshot the debit in the active revision
+    """
+    if get_backend() != REVERSION and reversion.is_active():
+        with reversion.create_revision(manage_manually=True, atomic=False):
+            yield
+    else:
+        yield
+
+
+def record_history(debits, fields=None, user_id=None):
+    """
+    Records that fields changed on debits, or that they were created when
+    fields is None, with the current backend. user_id is the id of the
+    user who changed them, if any.
+    """
+    backend = get_backend()
+    if backend == REVERSION:
+        if reversion.is_active():
+            for debit in debits:
+                reversion.add_to_revision(debit)
+    elif backend == DIFF and fields:
+        changed_at = timezone.now()
+        serializer = RowSerializer(Debit, fields)
+        DebitChange.objects.bulk_create([
+            DebitChange(
+                debit_id=debit.id,
+                changed_at=changed_at,
+                changes=serializer.instance_data(debit),
+                changed_by_id=user_id,
+            ) for debit in debits
+        ], batch_size=BATCH_SIZE)
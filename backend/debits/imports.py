@@ -0,0 +1,115 @@
+"""
+Streaming import of debit files
+
+Reads CSV (with a header row of debit field names) or NDJSON (one JSON object
+per line) debit files row by row and creates the debits batch by batch
+through create_debits, each batch in its own transaction. Rejected rows are
+written to a rejects stream as they are found, so memory use depends on the
+batch size and not on the size of the file.
+
+"""
+import csv
+import io
+import json
+
+from django.conf import settings
+
+from .bulk import create_debits
+from .history import history_backend
+
+
+FORMATS = ("csv", "ndjson")
+
+
+def guess_format(filename):
+    """
+    Returns the import format matching filename's extension, or None
+    """
+    extension = filename.rsplit(".", 1)[-1].lower()
+    if extension == "csv":
+        return "csv"
+    if extension in ("ndjson", "jsonl"):
+        return "ndjson"
+    return None
+
+
+def read_rows(stream, format):
+    """
+    Yields (line number, row, errors) for each row of a binary stream, row is
+    a dict of field values and errors is set when the row couldn't be read.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if format == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            # empty cells are missing values, not empty strings
+            yield reader.line_num, {
+                field: value.strip() or None for field, value in row.items()
+                if field is not None and value is not None
+            }, {}
+    elif format == "ndjson":
+        for number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, None, {"__all__": ["Invalid JSON: %s" % (e,)]}
+                continue
+            if not isinstance(row, dict):
+                yield number, None, {"__all__": ["Expected a JSON object"]}
+                continue
+            yield number, row, {}
+    else:
+        raise ValueError("Unknown import format %r, expected one of %s" % (
+            format, ", ".join(FORMATS)))
+
+
+def _write_reject(rejects, number, row, errors):
+    if rejects is not None:
+        rejects.write(json.dumps({"line": number, "row": row, "errors": errors}) + "\n")
+
+
+def _import_batch(batch, user, rejects):
+    results = create_debits([row for _, row in batch], user)
+    rejected = 0
+    for (number, row), (debit, errors) in zip(batch, results):
+        if errors:
+            _write_reject(rejects, number, row, errors)
+            rejected += 1
+    return len(batch) - rejected, rejected
+
+
+def import_debits(stream, format, user=None, rejects=None, batch_size=None, history=None):
+    """
+    Imports the debits in a binary stream of the given format. Rejected rows
+    are written to the text stream rejects, if given, as NDJSON objects with
+    the line number, the row and the errors. Their history is recorded with
+    the history backend history, DEBIT_BULK_HISTORY_BACKEND by default.
+    Returns the number of debits imported and the number of rows rejected.
+    """
+    with history_backend(history or settings.DEBIT_BULK_HISTORY_BACKEND):
+        return _import_debits(stream, format, user, rejects, batch_size)
+
+
+def _import_debits(stream, format, user, rejects, batch_size):
+    batch_size = batch_size or int(settings.DEBIT_IMPORT_BATCH_SIZE)
+    imported = 0
+    rejected = 0
+    batch = []
+    for number, row, errors in read_rows(stream, format):
+        if errors:
+            _write_reject(rejects, number, row, errors)
+            rejected += 1
+            continue
+        batch.append((number, row))
+        if len(batch) >= batch_size:
+            batch_imported, batch_rejected = _import_batch(batch, user, rejects)
+            imported += batch_imported
+            rejected += batch_rejected
+            batch = []
+    if batch:
+        batch_imported, batch_rejected = _import_batch(batch, user, rejects)
+        imported += batch_imported
+        rejected += batch_rejected
+    return imported, rejected
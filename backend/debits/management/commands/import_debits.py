@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from debits.history import BACKENDS
+from debits.imports import FORMATS, guess_format, import_debits
+
+
+class Command(BaseCommand):
+    help = ("Imports debits from a CSV (with a header row of field names) or "
+            "NDJSON file, batch by batch")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="The debit file to import")
+        parser.add_argument(
+            "--format", choices=FORMATS,
+            help="File format, by default taken from the file extension")
+        parser.add_argument(
+            "--rejects", help="Write rejected rows, with their errors, to this NDJSON file")
+        parser.add_argument(
+            "--batch-size", type=int, help="Debits per batch, DEBIT_IMPORT_BATCH_SIZE by default")
+        parser.add_argument("--user", help="Username to record as the creator of the debits")
+        parser.add_argument(
+            "--history", choices=BACKENDS,
+            help="History backend, DEBIT_BULK_HISTORY_BACKEND by default")
+
+    def handle(self, *args, **options):
+        format = options["format"] or guess_format(options["path"])
+        if format is None:
+            raise CommandError("Could not tell the format of %s, use --format" % (
+                options["path"], ))
+
+        user = None
+        if options["user"]:
+            try:
+                user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError("No user named %s" % (options["user"], ))
+
+        rejects = open(options["rejects"], "w") if options["rejects"] else None
+        try:
+            with open(options["path"], "rb") as stream:
+                imported, rejected = import_debits(
+                    stream, format, user=user, rejects=rejects,
+                    batch_size=options["batch_size"], history=options["history"])
+        finally:
+            if rejects is not None:
+                rejects.close()
+
+        self.stdout.write("Imported %s debit(s), rejected %s row(s)" % (imported, rejected))
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.21 on 2026-10-17 22:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debits', '0005_auto_20200429_1205'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DebitCallback',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('debit_status', models.CharField(help_text='The debit outcome this callback reports', max_length=30, verbose_name='Debit Status')),
+                ('url', models.CharField(max_length=500, verbose_name='Callback URL')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('delivered', 'Delivered'), ('failed', 'Failed')], default='pending', max_length=30)),
+                ('attempts', models.IntegerField(default=0, help_text='Number of times delivery has been attempted', verbose_name='Attempts')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Date and time after which delivery will be (re)attempted', verbose_name='Next attempt at')),
+                ('delivered_at', models.DateTimeField(blank=True, null=True, verbose_name='Delivered at')),
+                ('last_error', models.TextField(blank=True, help_text='The error received on the last delivery attempt', null=True, verbose_name='Last Error')),
+                ('debit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='callbacks', to='debits.debit')),
+            ],
+            options={
+                'unique_together': {('debit', 'debit_status')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-17 22:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debits', '0006_debitcallback'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='debit',
+            name='reference',
+            field=models.CharField(blank=True, db_index=True, help_text='Unique 9 digit validated debit reference, provider agnostic', max_length=9, null=True, verbose_name='Debit Reference'),
+        ),
+        # One value per 8 digit reference source, see debits.models.allocate_debit_references
+        migrations.RunSQL(
+            "CREATE SEQUENCE debits_debit_reference_seq MINVALUE 0 MAXVALUE 89999999 START 0 NO CYCLE",
+            "DROP SEQUENCE debits_debit_reference_seq",
+        ),
+    ]
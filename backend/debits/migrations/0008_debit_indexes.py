@@ -0,0 +1,42 @@
+# Generated by Django 4.2.21 on 2026-10-17 22:19
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debits', '0007_debit_reference_sequence'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='debit',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['scheduled_at', 'load_attempts'], name='debit_pending_scheduled_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='debit',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.functions.comparison.Cast('account_number', models.TextField())), name='gin_trgm_ops'), name='debit_acc_number_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='debit',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.functions.comparison.Cast('account_name', models.TextField())), name='gin_trgm_ops'), name='debit_acc_name_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='debit',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.functions.comparison.Cast('reference', models.TextField())), name='gin_trgm_ops'), name='debit_reference_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='debit',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.functions.comparison.Cast('provider_reference', models.TextField())), name='gin_trgm_ops'), name='debit_prov_ref_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='debit',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.functions.comparison.Cast('downstream_reference', models.TextField())), name='gin_trgm_ops'), name='debit_down_ref_trgm_idx'),
+        ),
+    ]
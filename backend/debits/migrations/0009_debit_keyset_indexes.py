@@ -0,0 +1,25 @@
+# Generated by Django 4.2.21 on 2026-10-17 22:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debits', '0008_debit_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='debit',
+            index=models.Index(fields=['created_at', 'id'], name='debit_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='debit',
+            index=models.Index(fields=['scheduled_at', 'id'], name='debit_scheduled_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='debit',
+            index=models.Index(fields=['loaded_at', 'id'], name='debit_loaded_id_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.21 on 2026-10-17 22:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('debits', '0009_debit_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DebitChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('changes', models.JSONField(help_text='The new values of the changed fields')),
+                ('changed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('debit', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='debits.debit')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['debit', 'changed_at'], name='debitchange_debit_at_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.21 on 2026-10-17 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debits', '0010_debitchange'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='debit',
+            index=models.Index(condition=models.Q(('status', 'loaded')), fields=['scheduled_at'], name='debit_loaded_scheduled_idx'),
+        ),
+    ]
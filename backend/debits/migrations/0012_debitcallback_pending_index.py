@@ -0,0 +1,17 @@
+# Generated by Django 4.2.21 on 2026-10-17 23:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debits', '0011_debit_loaded_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='debitcallback',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt_at'], name='callback_pending_due_idx'),
+        ),
+    ]
@@ -2,15 +2,37 @@ import reversion
 
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import connection, models
+from django.db.models import Q
+from django.db.models.functions import Cast, Upper
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from maguire.models import AppModel
+from maguire.response_cache import invalidate_models
 
-from events.models import Event
+from events.writer import write_event
+
+
+# Debit references come from this sequence, see allocate_debit_references
+REFERENCE_SEQUENCE = "debits_debit_reference_seq"
+REFERENCE_SOURCE_MIN = 10 ** 7
+REFERENCE_SOURCE_RANGE = 9 * 10 ** 7
+# coprime with REFERENCE_SOURCE_RANGE, so the mapping is a permutation
+REFERENCE_MULTIPLIER = 48271
+REFERENCE_OFFSET = 31415926
+
+
+def trigram_index(field, name):
+    """
+    Trigram index that serves icontains / istartswith lookups on field, which
+    PostgreSQL runs as UPPER(field::text) LIKE ...
+    """
+    return GinIndex(
+        OpClass(Upper(Cast(field, models.TextField())), name="gin_trgm_ops"), name=name)
 
 
 @reversion.register()
@@ -29,6 +51,8 @@ class Debit(AppModel):
         ("savings", "Savings"),
         ("current", "Current"),
     )
+    # saves only write the fields that changed
+    track_dirty_fields = True
     # Optional Identifing information
     client = models.CharField(
         max_length=50,
@@ -71,7 +95,7 @@ class Debit(AppModel):
         max_digits=10, decimal_places=2)
     reference = models.CharField(
         null=True, blank=True,
-        max_length=9,
+        max_length=9, db_index=True,
         verbose_name=_("Debit Reference"),
         help_text=_("Unique 9 digit validated debit reference, provider agnostic"))
     provider = models.CharField(
@@ -115,6 +139,30 @@ class Debit(AppModel):
         User, related_name='debits_updated', null=True, blank=True,
         on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # the pending queue is scanned in due order
+            models.Index(
+                fields=["scheduled_at", "load_attempts"],
+                condition=Q(status="pending"),
+                name="debit_pending_scheduled_idx"),
+            # loaded debits past their action date are polled for status
+            models.Index(
+                fields=["scheduled_at"],
+                condition=Q(status="loaded"),
+                name="debit_loaded_scheduled_idx"),
+            # keyset pagination of the debits connection, see DebitFilter.order_by
+            models.Index(fields=["created_at", "id"], name="debit_created_id_idx"),
+            models.Index(fields=["scheduled_at", "id"], name="debit_scheduled_id_idx"),
+            models.Index(fields=["loaded_at", "id"], name="debit_loaded_id_idx"),
+            # substring filters of DebitFilter
+            trigram_index("account_number", "debit_acc_number_trgm_idx"),
+            trigram_index("account_name", "debit_acc_name_trgm_idx"),
+            trigram_index("reference", "debit_reference_trgm_idx"),
+            trigram_index("provider_reference", "debit_prov_ref_trgm_idx"),
+            trigram_index("downstream_reference", "debit_down_ref_trgm_idx"),
+        ]
+
     @property
     def node_id(self):
         from maguire.utils import b64_from_uuid
@@ -124,35 +172,69 @@ class Debit(AppModel):
         """
         Prepares this Debit for JSON serialization
         """
-        return {
-            'id': str(self.id),
-            'client': self.client,
-            'downstream_reference': self.downstream_reference,
-            'callback_url': self.callback_url,
-            'account_name': self.account_name,
-            'account_number': self.account_number,
-            'branch_code': self.branch_code,
-            'account_type': self.account_type,
-            'status': self.status,
-            'amount': str(self.amount),
-            'reference': self.reference,
-            'provider': self.provider,
-            'provider_reference': self.provider_reference,
-            'provider_status': self.provider_status,
-            'scheduled_at': self.scheduled_at.isoformat() if self.loaded_at else None,
-            'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None,
-            'load_attempts': self.load_attempts,
-            'last_error': self.last_error,
-            'created_at': self.created_at.isoformat(),
-            'created_by': self.created_by.id if self.created_by else None,
-            'updated_at': self.updated_at.isoformat(),
-            'updated_by': self.updated_by.id if self.updated_by else None,
-        }
+        from debits.serialization import debit_serializer
+        return debit_serializer.instance_data(self)
 
     def save(self, *args, **kwargs):
+        from debits.history import save_context
         if self.reference is None:
-            self.reference = generate_unique_debit_reference(length=9)
-        super(Debit, self).save(*args, **kwargs)
+            self.reference = allocate_debit_references(1)[0]
+        with save_context():
+            super(Debit, self).save(*args, **kwargs)
+
+    def __str__(self):
+        return str(self.id)
+
+
+class DebitCallback(AppModel):
+    """
+    Debit Callback Model, tracks delivery of a debit outcome (successful or
+    failed) to the debit's callback_url
+    """
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("delivered", "Delivered"),
+        ("failed", "Failed"),
+    )
+    debit = models.ForeignKey(
+        Debit, related_name='callbacks',
+        on_delete=models.CASCADE)
+    debit_status = models.CharField(
+        max_length=30,
+        verbose_name=_("Debit Status"),
+        help_text=_("The debit outcome this callback reports"))
+    url = models.CharField(
+        max_length=500,
+        verbose_name=_("Callback URL"))
+    status = models.CharField(
+        choices=STATUS_CHOICES, max_length=30,
+        default="pending")
+    attempts = models.IntegerField(
+        default=0,
+        verbose_name=_("Attempts"),
+        help_text=_("Number of times delivery has been attempted"))
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("Next attempt at"),
+        help_text=_("Date and time after which delivery will be (re)attempted"))
+    delivered_at = models.DateTimeField(
+        verbose_name=_("Delivered at"),
+        null=True, blank=True)
+    last_error = models.TextField(
+        verbose_name=_("Last Error"),
+        help_text=_("The error received on the last delivery attempt"),
+        null=True, blank=True)
+
+    class Meta:
+        # each outcome of a debit is only ever queued once
+        unique_together = ("debit", "debit_status")
+        indexes = [
+            # due callbacks are claimed in next_attempt_at order
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=Q(status="pending"),
+                name="callback_pending_due_idx"),
+        ]
 
     def __str__(self):
         return str(self.id)
@@ -163,29 +245,98 @@ def create_event_debit(sender, instance, created, **kwargs):
     """ Post save hook that creates a model.created Event
     """
     if created:
-        source_model = ContentType.objects.get(app_label='debits', model='debit')
-        Event.objects.create(**{
+        source_model = ContentType.objects.get_for_model(Debit)
+        write_event(**{
             "source_model": source_model,
             "source_id": instance.id,
             "event_at": timezone.now(),
             "event_type": "model.created",
             "event_data": instance.as_json(),
-            "created_by": instance.created_by
+            "created_by_id": instance.created_by_id
         })
 
 
-def generate_unique_debit_reference(length=9, attempts=0):
-    from maguire.utils import random_digits, calculate_luhn
+@receiver(post_save, sender=Debit)
+@receiver(post_delete, sender=Debit)
+def invalidate_debit_responses(sender, instance, **kwargs):
+    """ Post save and delete hook that invalidates cached GraphQL results
+    about debits, saves that write no Event (e.g. from the admin) included
+    """
+    invalidate_models([Debit._meta.label_lower])
+
+
+@receiver(post_save, sender=Debit)
+def record_debit_history(sender, instance, created, update_fields=None, **kwargs):
+    """ Post save hook that records the saved fields of a changed debit with
+    the history backend, see debits.history
+    """
+    from debits.history import DIFF, get_backend, record_history
+    # reversion snapshots saves itself, and the events backend has the Events
+    if not created and get_backend() == DIFF:
+        fields = update_fields or [field.name for field in Debit._meta.concrete_fields]
+        record_history([instance], [field for field in fields if field not in (
+            "id", "created_at", "updated_at")], instance.updated_by_id)
+
+
+class DebitChange(models.Model):
+    """
+    Append-only history of the fields changed on a debit, written by the
+    diff history backend (see debits.history). The debit's creation is the
+    model.created Event.
+    """
+    id = models.BigAutoField(primary_key=True)
+    debit = models.ForeignKey(
+        Debit, related_name='changes', db_index=False,
+        on_delete=models.CASCADE)
+    changed_at = models.DateTimeField(default=timezone.now)
+    changes = models.JSONField(
+        help_text=_("The new values of the changed fields"))
+    changed_by = models.ForeignKey(
+        User, related_name='+', null=True, blank=True,
+        on_delete=models.SET_NULL)
+
+    class Meta:
+        indexes = [
+            # a debit's history, in order
+            models.Index(fields=["debit", "changed_at"], name="debitchange_debit_at_idx"),
+        ]
+
+    def __str__(self):
+        return str(self.id)
+
 
-    source = random_digits(length-1)
-    checksum = calculate_luhn(source)
-    unique_reference = str(source) + str(checksum)
+def _reference_from_sequence(value):
+    """
+    Maps a sequence value to a 9 digit reference: an 8 digit source, spread
+    over the whole 8 digit range by an affine permutation so consecutive
+    debits don't get consecutive references, followed by a Luhn check digit.
+    """
+    from maguire.utils import calculate_luhn
+
+    source = REFERENCE_SOURCE_MIN + (
+        value * REFERENCE_MULTIPLIER + REFERENCE_OFFSET) % REFERENCE_SOURCE_RANGE
+    return str(source) + str(calculate_luhn(source))
+
+
+def allocate_debit_references(count):
+    """
+    Allocates count unique, Luhn valid, 9 digit debit references from the
+    reference sequence. Sequence values are never handed out twice, so this
+    is safe with concurrent writers and costs the same however full the
+    reference space is.
+    """
+    if count <= 0:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(%s) FROM generate_series(1, %s)", [REFERENCE_SEQUENCE, count])
+        references = [_reference_from_sequence(value) for (value, ) in cursor.fetchall()]
 
-    try:
-        Debit.objects.get(reference=unique_reference)
-        if attempts < 10:
-            generate_unique_debit_reference(length=length, attempts=attempts+1)
-        else:
-            return "Aborting unique_reference generation after 10 failed attempts"
-    except Debit.DoesNotExist:
-        return unique_reference
+    # References issued before the sequence existed were random, skip any
+    # clashes with those (one indexed lookup per batch)
+    taken = set(Debit.objects.filter(
+        reference__in=references).values_list('reference', flat=True))
+    if taken:
+        references = [reference for reference in references if reference not in taken]
+        references += allocate_debit_references(count - len(references))
+    return references
@@ -2,30 +2,115 @@
 Common setup for direct debit providers
 
 """
+import time
+
+import requests
+from django.db import transaction
+from requests.adapters import HTTPAdapter
+
+from debits.models import Debit
+from debits.transitions import transition_debits
+from events.writer import buffer_events
 
 
 class Provider:
 
     provider_name = None
     config = None
+    session = None
+
+    # HTTP settings, each can be overridden by a key of the same name in config
+    http_defaults = {
+        "connect_timeout": 10,  # seconds
+        "read_timeout": 120,  # seconds
+        "pool_size": 10,  # connections kept alive per host
+        "retries": 3,  # extra attempts for idempotent requests
+        "retry_backoff": 0.5,  # seconds, doubled on each retry
+    }
+    retry_statuses = (500, 502, 503, 504)
+
+    def http_setting(self, name):
+        return (self.config or {}).get(name, self.http_defaults[name])
 
     def setup_provider(self):
         """
         All provider specific setup should happen in here.
-        Subclasses should override this method to perform extra setup.
+        Subclasses should override this method to perform extra setup and
+        call super() to get the pooled HTTP session.
         """
-        pass
+        pool_size = max(
+            int(self.http_setting("pool_size")), int((self.config or {}).get("concurrency", 1)))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
     def teardown_provider(self):
         """
         Clean-up of setup done in setup_provider should happen here.
         """
-        pass
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def request(self, method, url, idempotent=False, **kwargs):
+        """
+        Sends a request over the provider's pooled session with the configured
+        connect and read timeouts. Idempotent requests (e.g. status checks) are
+        retried on connection errors, timeouts and 5xx responses with
+        exponential backoff, others are sent exactly once.
+        """
+        kwargs.setdefault("timeout", (
+            float(self.http_setting("connect_timeout")),
+            float(self.http_setting("read_timeout"))))
+        retries = int(self.http_setting("retries")) if idempotent else 0
+        backoff = float(self.http_setting("retry_backoff"))
+
+        for attempt in range(retries + 1):
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    raise
+            else:
+                if response.status_code not in self.retry_statuses or attempt == retries:
+                    return response
+            time.sleep(backoff * 2 ** attempt)
+
+    def claim_debits(self, ids):
+        """
+        Claims the pending debits among ids for loading: moves them to
+        processing and counts the load attempt. The claim is committed
+        before anything is sent to the provider, so a debit that may have
+        been submitted is never submitted again by a later run. Debits
+        locked by another transaction are skipped. Returns the claimed debits.
+        """
+        with transaction.atomic(), buffer_events():
+            debits = list(Debit.objects.filter(
+                id__in=ids, status="pending").select_for_update(skip_locked=True))
+            transition_debits(debits, "processing", increment_attempts=True)
+        return debits
+
+    def release_debits(self, debits):
+        """
+        Puts claimed debits back to pending, only for when submitting them
+        failed before anything was sent. Their load attempt stays counted, so
+        DEBIT_LOAD_ATTEMPTS still stops debits that always fail.
+        """
+        with transaction.atomic(), buffer_events():
+            transition_debits(debits, "pending")
 
     def load_debits(self, ids):
         """
-        This must be overridden to read debits from system and do the right
-        thing with them.
+        Claims the pending debits among ids and submits them
+        """
+        return self.submit_debits(self.claim_debits(ids))
+
+    def submit_debits(self, debits):
+        """
+        This must be overridden to submit claimed (processing) debits to the
+        provider and record the outcome. It runs outside of any transaction,
+        the outcome should be written in a transaction of its own.
         """
         raise NotImplementedError()
 
@@ -34,3 +119,11 @@ class Provider:
         This must be overridden to check status of debit on provider.
         """
         raise NotImplementedError()
+
+    def check_statuses(self, ids):
+        """
+        Checks the status of many debits. Providers that can look up several
+        debits per request should override this, by default check_status is
+        called for each debit.
+        """
+        return [self.check_status(id) for id in ids]
@@ -0,0 +1,89 @@
+"""
+Single-pass writer for EasyDebit SRQ request payloads
+
+Produces the same document as building an ElementTree and pretty-printing it
+with minidom (XML declaration, two space indent, empty elements as <X/>) but
+writes each payment item straight into a bytes buffer as it is added.
+
+"""
+import io
+
+
+XML_DECLARATION = b'<?xml version="1.0" encoding="utf-8"?>\n'
+
+
+def escape(text):
+    """
+    Escapes element text the same way minidom does
+    """
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(
+        "\"", "&quot;").replace(">", "&gt;")
+
+
+class SRQWriter:
+    """
+    Incrementally writes a SRQ document. Usage:
+
+        writer = SRQWriter(username, password_hash)
+        for debit in debits:
+            writer.write_payment(fields)
+        payload = writer.getvalue()
+
+    where fields is a sequence of (tag, text) pairs, text may be None.
+    list_tag names the list element the items are written to, PL (Payment
+    List) by default.
+    """
+
+    def __init__(self, username, password, list_tag="PL"):
+        self.buffer = io.BytesIO()
+        self.list_tag = list_tag.encode("utf-8")
+        self.items = 0
+        self.buffer.write(XML_DECLARATION)
+        self.buffer.write(b"<SRQ>\n")
+        self._write_element("CR", [("U", username), ("P", password)], depth=1)
+
+    def _write_field(self, tag, text, depth):
+        indent = "  " * depth
+        if text:
+            line = "%s<%s>%s</%s>\n" % (indent, tag, escape(text), tag)
+        else:
+            line = "%s<%s/>\n" % (indent, tag)
+        self.buffer.write(line.encode("utf-8"))
+
+    def _write_element(self, tag, fields, depth):
+        indent = ("  " * depth).encode("utf-8")
+        self.buffer.write(indent + b"<" + tag.encode("utf-8") + b">\n")
+        for field_tag, text in fields:
+            self._write_field(field_tag, text, depth + 1)
+        self.buffer.write(indent + b"</" + tag.encode("utf-8") + b">\n")
+
+    def _open_list(self):
+        if self.items == 0:
+            self.buffer.write(b"  <" + self.list_tag + b">\n")
+        self.items += 1
+
+    def write_payment(self, fields):
+        """
+        Appends a PI (Payment Item) element to the list
+        """
+        self._open_list()
+        self._write_element("PI", fields, depth=2)
+
+    def write_field(self, tag, text):
+        """
+        Appends a single text element, e.g. a CI (Client Identification), to
+        the list
+        """
+        self._open_list()
+        self._write_field(tag, text, depth=2)
+
+    def getvalue(self):
+        """
+        Closes the document and returns it as UTF-8 encoded bytes
+        """
+        if self.items == 0:
+            self.buffer.write(b"  <" + self.list_tag + b"/>\n")
+        else:
+            self.buffer.write(b"  </" + self.list_tag + b">\n")
+        self.buffer.write(b"</SRQ>\n")
+        return self.buffer.getvalue()
@@ -3,12 +3,15 @@ from datetime import timedelta
 import hashlib
 import requests
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
-from xml.etree.ElementTree import Element, SubElement, tostring, fromstring
-from xml.dom import minidom
+from xml.etree.ElementTree import fromstring
 
 from debits.providers.base import Provider
+from debits.providers.easydebit.payload import SRQWriter
 from debits.models import Debit
+from debits.transitions import apply_debit_transitions, transition_debits
+from events.writer import buffer_events
 
 
 class EasyDebitProvider(Provider):
@@ -22,6 +25,10 @@ class EasyDebitProvider(Provider):
     """
 
     provider_name = "EasyDebit"
+    # GetPaymentStatus codes that finalise a debit, any other code leaves it
+    # loaded. Can be overridden with the same keys in config.
+    successful_statuses = ("PAID", "SUCCESSFUL")
+    failed_statuses = ("UNPAID", "FAILED", "REJECTED", "DISPUTED", "CANCELLED")
     config = {
         "base_url": "",
         "authentication": {
@@ -37,23 +44,17 @@ class EasyDebitProvider(Provider):
         All provider specific setup should happen in here.
         Subclasses should override this method to perform extra setup.
         """
+        super().setup_provider()
 
         service_reference = bytes(self.config["authentication"]["service_reference"], "utf-8")
         username = bytes(self.config["authentication"]["username"], "utf-8")
         md5hash = bytes(hashlib.md5(service_reference).hexdigest().upper(), "utf-8")
         self.config["authentication"]["hash"] = hashlib.sha256(username+md5hash).hexdigest()
 
-    def _auth_header(self):
-        e_credentials = Element('CR')
-        se_username = SubElement(e_credentials, 'U')
-        se_username.text = self.config["authentication"]["username"]
-        se_password = SubElement(e_credentials, 'P')
-        se_password.text = self.config["authentication"]["hash"]
-        return e_credentials
-
     def _format_debit(self, debit):
         """
-        Takes a debit model instance and turns it into a XML Payment Item node
+        Takes a debit model instance and turns it into the (tag, text) fields
+        of a XML Payment Item node
         (Client Identification) - VARCHAR(20)
         (Group Code) - VARCHAR (10)
         (NAEDO or Debit Order) - CHAR(1) D or N
@@ -70,42 +71,31 @@ class EasyDebitProvider(Provider):
         (Identification Type) - VARCHAR (5) N/R
         (Identification Number) - VARCHAR (20) N/R
         """
-        e_paymentitem = Element('PI')
-
-        se_client_id = SubElement(e_paymentitem, 'CI')
-        se_client_id.text = debit.reference
-        se_group_code = SubElement(e_paymentitem, 'GC')
-        se_group_code.text = self.config["group_code"]
-        se_service_type = SubElement(e_paymentitem, 'ST')
-        se_service_type.text = "D"
-        se_service_mode = SubElement(e_paymentitem, 'SM')
-        se_service_mode.text = "2"
-        se_amount = SubElement(e_paymentitem, 'A')
-        se_amount.text = str(debit.amount)
-        se_action_date = SubElement(e_paymentitem, 'AD')
-        se_action_date.text = debit.scheduled_at.strftime("%d%m%Y")
-        se_client_reference = SubElement(e_paymentitem, 'CR')
-        se_client_reference.text = debit.reference
-        se_internal_reference = SubElement(e_paymentitem, 'CR')
-        se_internal_reference.text = debit.client
-        se_bank_reference = SubElement(e_paymentitem, 'BR')
-        se_bank_reference.text = self.config["bank_ref"]
-        se_account_type = SubElement(e_paymentitem, 'AT')
         if debit.account_type == "current":
-            se_account_type.text = "1"
+            account_type = "1"
         elif debit.account_type == "savings":
-            se_account_type.text = "2"
-        se_branch_code = SubElement(e_paymentitem, 'BC')
-        se_branch_code.text = debit.branch_code
-        se_account_number = SubElement(e_paymentitem, 'AN')
-        se_account_number.text = debit.account_number
-        se_account_holder = SubElement(e_paymentitem, 'AH')
-        se_account_holder.text = debit.account_name
-        # Not required to have values
-        SubElement(e_paymentitem, 'IT')
-        SubElement(e_paymentitem, 'IN')
-
-        return e_paymentitem
+            account_type = "2"
+        else:
+            account_type = None
+
+        return [
+            ("CI", debit.reference),
+            ("GC", self.config["group_code"]),
+            ("ST", "D"),
+            ("SM", "2"),
+            ("A", str(debit.amount)),
+            ("AD", debit.scheduled_at.strftime("%d%m%Y")),
+            ("CR", debit.reference),
+            ("CR", debit.client),
+            ("BR", self.config["bank_ref"]),
+            ("AT", account_type),
+            ("BC", debit.branch_code),
+            ("AN", debit.account_number),
+            ("AH", debit.account_name),
+            # Not required to have values
+            ("IT", None),
+            ("IN", None),
+        ]
 
     def _process_error_codes(self, debit, error):
         # load error codes
@@ -129,64 +119,125 @@ class EasyDebitProvider(Provider):
 
         return last_error, status, scheduled_at
 
-    def load_debits(self, ids):
+    def submit_debits(self, debits):
         """
-        This must be overridden to read debits from system and do the right
-        thing with them.
+        Submits claimed debits to EasyDebit. The request is sent with no
+        transaction open and the outcome is written in a transaction of its
+        own, with status changes written for the whole batch at once rather
+        than saving each debit.
         """
-        debits = Debit.objects.filter(id__in=ids)
-        if debits.count() != 0:
-            e_root = Element('SRQ')
-            e_root.append(self._auth_header())
-            se_paymentlist = SubElement(e_root, 'PL')
-            for debit in debits:
-                debit.status = "processing"
-                debit.load_attempts = debit.load_attempts + 1
-                debit.save()
-                se_paymentlist.append(self._format_debit(debit))
-
-            # you don't get a proper XML header without minidom, some API's hate that
-            reparsed = minidom.parseString(tostring(e_root, encoding='utf-8'))
-            payload = reparsed.toprettyxml(indent="  ", encoding="utf-8").decode("utf-8")
-            url = self.config["base_url"] + "SaveOnceOffPayments"
-            response = requests.post(
-                url, data=payload, headers={'Content-Type': 'application/xml'})
-
-            # update the debits
-            response_root = fromstring(response.text)
+        if len(debits) == 0:
+            return "No debits to submit"
 
+        try:
+            # written with a proper XML header, some API's hate it missing
+            writer = SRQWriter(
+                self.config["authentication"]["username"],
+                self.config["authentication"]["hash"])
+            for debit in debits:
+                writer.write_payment(self._format_debit(debit))
+            payload = writer.getvalue()
+        except Exception:
+            self.release_debits(debits)
+            raise
+        url = self.config["base_url"] + "SaveOnceOffPayments"
+        try:
+            response = self.request(
+                "POST", url, data=payload, headers={'Content-Type': 'application/xml'})
+        except requests.ConnectTimeout:
+            # no connection was made, so nothing reached EasyDebit
+            self.release_debits(debits)
+            raise
+        # anything failing from here on may follow a submission EasyDebit
+        # accepted, so the debits are left processing rather than resubmitted
+        response.raise_for_status()
+        response_root = fromstring(response.text)
+
+        by_reference = {}
+        for debit in debits:
+            by_reference.setdefault(debit.reference, []).append(debit)
+
+        with transaction.atomic(), buffer_events():
             # process any errors
             error_list = response_root.find('EL')
-            if(len(error_list)) > 0:
-                for error in error_list:
-                    # mark the debits as 'failed' if there are errors
-                    debit = Debit.objects.get(
-                        reference=error.find('CI').text,
-                        id__in=debits.values_list('id')
-                    )
-
-                    debit.last_error, debit.status, debit.scheduled_at = self._process_error_codes(
-                        debit, error)
-
-                    debit.save()
-                    # remove the failed debit from the debits queryset
-                    debits = debits.exclude(id=debit.id)
-
-            for debit in debits:
-                debit.provider = self.provider_name
-                debit.loaded_at = timezone.now()
-                debit.provider_reference = "TBC"
-                debit.status = "loaded"
-                debit.save()
-
-            return "Successfully loaded {} debits. Failed to load {} debits.".format(
-                debits.count(), len(error_list))
-        else:
-            return "No debits to submit"
+            failed = []
+            for error in error_list:
+                # mark the debits as 'failed' if there are errors and remove
+                # them from the debits to be marked as loaded
+                for debit in by_reference.pop(error.find('CI').text, []):
+                    debit.last_error, debit.status, debit.scheduled_at = \
+                        self._process_error_codes(debit, error)
+                    failed.append(debit)
+            apply_debit_transitions(failed, ["last_error", "status", "scheduled_at"])
+
+            loaded = [debit for group in by_reference.values() for debit in group]
+            transition_debits(
+                loaded, "loaded", provider=self.provider_name, loaded_at=timezone.now(),
+                provider_reference="TBC")
+
+        return "Successfully loaded {} debits. Failed to load {} debits.".format(
+            len(loaded), len(error_list))
 
     def check_status(self, id):
         """
-        This must be overridden to check status of debit on EasyDebit.
+        Checks the status of a single debit on EasyDebit.
+        """
+        return self.check_statuses([id])
+
+    def check_statuses(self, ids):
+        """
+        Checks the status of loaded debits on EasyDebit with one request for
+        all of their references and applies the changes in bulk.
         /Services/PaymentService.svc/PartnerServices/GetPaymentStatus
+
+        Request: SRQ with the credentials and a RL (Reference List) of CI
+        (Client Identification) elements.
+        Response: SRP with a SL (Status List) of S elements, each with the
+        CI, ST (Status code) and D (Description) of a payment.
         """
-        raise NotImplementedError()
+        debits = list(Debit.objects.filter(id__in=ids, status="loaded"))
+        if len(debits) == 0:
+            return "No debits to check"
+
+        writer = SRQWriter(
+            self.config["authentication"]["username"],
+            self.config["authentication"]["hash"],
+            list_tag="RL")
+        for debit in debits:
+            writer.write_field("CI", debit.reference)
+        url = self.config["base_url"] + "GetPaymentStatus"
+        response = self.request(
+            "POST", url, idempotent=True, data=writer.getvalue(),
+            headers={'Content-Type': 'application/xml'})
+        response.raise_for_status()
+        response_root = fromstring(response.text)
+
+        by_reference = {}
+        for debit in debits:
+            by_reference.setdefault(debit.reference, []).append(debit)
+
+        successful = self.config.get("successful_statuses", self.successful_statuses)
+        failed = self.config.get("failed_statuses", self.failed_statuses)
+        status_list = response_root.find('SL')
+        changed = []
+        for status in status_list if status_list is not None else []:
+            provider_status = status.find('ST').text
+            for debit in by_reference.get(status.find('CI').text, []):
+                if provider_status in successful:
+                    debit.status = "successful"
+                elif provider_status in failed:
+                    debit.status = "failed"
+                    description = status.find('D')
+                    debit.last_error = description.text if description is not None \
+                        else provider_status
+                elif provider_status == debit.provider_status:
+                    continue
+                debit.provider_status = provider_status
+                changed.append(debit)
+        with transaction.atomic(), buffer_events():
+            apply_debit_transitions(changed, ["status", "provider_status", "last_error"])
+
+        return "Checked {} debits. {} successful, {} failed.".format(
+            len(debits),
+            len([debit for debit in changed if debit.status == "successful"]),
+            len([debit for debit in changed if debit.status == "failed"]))
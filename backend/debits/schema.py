@@ -1,14 +1,24 @@
 from django.contrib.contenttypes.models import ContentType
 import django_filters
-from graphene import relay, String, Field
+from graphene import (
+    relay, String, Field, InputObjectType, Int, List, NonNull, ObjectType
+)
 from graphene.types.datetime import DateTime
 from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField
+from django.conf import settings
+from django.db import transaction
 from django_filters import OrderingFilter
+from graphql import GraphQLError
+
+from events.writer import buffer_events
 
+from .bulk import create_debits
+from .history import history_backend
 from .models import Debit
+from maguire.loaders import select_related_for
+from maguire.pagination import KeysetConnectionField
 from maguire.utils import (
-    TotalCountMixin,
+    CountableConnection,
     get_node_with_permission,
     schema_create_updated_event,
     schema_define_user,
@@ -42,12 +52,13 @@ class DebitFilter(django_filters.FilterSet):
     order_by = OrderingFilter(fields=['created_at', 'scheduled_at', 'loaded_at'])
 
 
-class DebitNode(DjangoObjectType, TotalCountMixin):
+class DebitNode(DjangoObjectType):
 
     class Meta:
         model = Debit
         filterset_class = DebitFilter
         interfaces = (relay.Node, )
+        connection_class = CountableConnection
 
     @classmethod
     def get_node(cls, info, id):
@@ -80,47 +91,118 @@ class DebitMutation(relay.ClientIDMutation):
                          "account_name", "account_number", "branch_code",
                          "account_type", "amount", "scheduled_at"]
 
-        if "id" in input:  # lookup existing
-            id = uuid_from_b64(input.get("id"))
-            try:
-                debit = Debit.objects.get(id=id)
-            except Debit.DoesNotExist:
-                return DebitMutation(debit=None)
-
-            # Gather mutation data
-            mutation_data = schema_get_mutation_data(fk_fields, non_fk_fields, input, info.context,
-                                                     update=True)
-            # Update the model
-            event_data = schema_update_model(debit, mutation_data, fk_fields)
-            # Define the user
-            user = schema_define_user(info.context, "debit_schema")
-            # Create a model.updated Event
-            source_model = ContentType.objects.get(app_label='debits', model='debit')
-            schema_create_updated_event(source_model, id, event_data, user)
-
-        else:  # create new
-            # Gather mutation data
-            mutation_data = schema_get_mutation_data(fk_fields, non_fk_fields, input, info.context,
-                                                     update=False)
-            # Create the model
-            debit = Debit.objects.create(**mutation_data)
+        # the debit and its Event are written together, in one batch
+        with transaction.atomic(), buffer_events():
+            if "id" in input:  # lookup existing
+                id = uuid_from_b64(input.get("id"))
+                try:
+                    debit = Debit.objects.get(id=id)
+                except Debit.DoesNotExist:
+                    return DebitMutation(debit=None)
+
+                # Gather mutation data
+                mutation_data = schema_get_mutation_data(
+                    fk_fields, non_fk_fields, input, info.context, update=True)
+                # Update the model
+                event_data = schema_update_model(debit, mutation_data)
+                # Define the user
+                user = schema_define_user(info.context, "debit_schema")
+                # Create a model.updated Event, with the changes only
+                if event_data:
+                    source_model = ContentType.objects.get_for_model(Debit)
+                    schema_create_updated_event(source_model, id, event_data, user)
+
+            else:  # create new
+                # Gather mutation data
+                mutation_data = schema_get_mutation_data(
+                    fk_fields, non_fk_fields, input, info.context, update=False)
+                # Create the model
+                debit = Debit.objects.create(**mutation_data)
 
         return DebitMutation(debit=debit)
 
 
+class DebitInput(InputObjectType):
+    client = String()
+    downstream_reference = String()
+    callback_url = String()
+    account_name = String()
+    account_number = String()
+    branch_code = String()
+    account_type = String()
+    amount = String()
+    scheduled_at = DateTime()
+
+
+class FieldError(ObjectType):
+    field = String()
+    messages = List(String)
+
+
+class DebitBulkCreateResult(ObjectType):
+    """
+    Outcome of one input of a bulk create, in input order. debit is null
+    when the input had errors.
+    """
+    index = Int()
+    debit = Field(DebitNode)
+    errors = List(FieldError)
+
+
+class DebitBulkCreateMutation(relay.ClientIDMutation):
+    """
+    Creates many debits at once. Inputs are validated together, the valid
+    ones are created in a single transaction and the invalid ones reported
+    per input.
+    """
+
+    class Input:
+        debits = List(NonNull(DebitInput), required=True)
+
+    results = List(DebitBulkCreateResult)
+    created = Int()
+    failed = Int()
+
+    @classmethod
+    def mutate_and_get_payload(cls, root, info, **input):
+        items = input.get("debits")
+        if len(items) > int(settings.DEBIT_BULK_CREATE_LIMIT):
+            raise GraphQLError("At most {} debits can be created at once".format(
+                settings.DEBIT_BULK_CREATE_LIMIT))
+
+        user = info.context.user if info.context is not None else None
+        with history_backend(settings.DEBIT_BULK_HISTORY_BACKEND), \
+                transaction.atomic(), buffer_events():
+            results = create_debits(items, user)
+
+        return DebitBulkCreateMutation(
+            results=[
+                DebitBulkCreateResult(
+                    index=index,
+                    debit=None if errors else debit,
+                    errors=[
+                        FieldError(field=field, messages=messages)
+                        for field, messages in errors.items()])
+                for index, (debit, errors) in enumerate(results)],
+            created=sum(1 for _, errors in results if not errors),
+            failed=sum(1 for _, errors in results if errors))
+
+
 class Query(object):
     debit = relay.Node.Field(DebitNode)
-    debits = DjangoFilterConnectionField(DebitNode)
+    debits = KeysetConnectionField(DebitNode, default_order="created_at")
 
     def resolve_debits(self, info, **args):
+        queryset = select_related_for(Debit.objects.all(), info)
         if info.context is not None:
             if info.context.user.is_authenticated:
-                return DebitFilter(args, queryset=Debit.objects.all()).qs
+                return DebitFilter(args, queryset=queryset).qs
             else:
                 return Debit.objects.none()
         else:  # Not a HTTP request - no permissions testing currently
-            return DebitFilter(args, queryset=Debit.objects.all()).qs
+            return DebitFilter(args, queryset=queryset).qs
 
 
 class Mutation(object):
     debit_mutate = DebitMutation.Field()
+    debit_bulk_create = DebitBulkCreateMutation.Field()
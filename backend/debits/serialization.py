@@ -0,0 +1,20 @@
+"""
+The JSON representation of a debit, shared by its model.created Event, its
+callbacks and the admin export (see maguire.serialization). The changes in
+model.updated Events and the history are serialized the same way.
+
+"""
+from maguire.serialization import RowSerializer
+
+from .models import Debit
+
+
+DEBIT_FIELDS = [
+    "id", "client", "downstream_reference", "callback_url", "account_name",
+    "account_number", "branch_code", "account_type", "status", "amount",
+    "reference", "provider", "provider_reference", "provider_status",
+    "scheduled_at", "loaded_at", "load_attempts", "last_error",
+    "created_at", "created_by", "updated_at", "updated_by",
+]
+
+debit_serializer = RowSerializer(Debit, DEBIT_FIELDS)
@@ -1,17 +1,177 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import importlib
+from itertools import islice
+import threading
 
 from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
 
 from celery import Task
 from celery.utils.log import get_task_logger
 
 from maguire.celery import app
+from .callbacks import deliver_callbacks
 from .models import Debit
 
 
 tl = get_task_logger(__name__)
 
 
+def get_provider():
+    """
+    Returns the configured and set up debit provider named in settings
+    """
+    debit_provider = settings.DEBIT_PROVIDER
+    debit_package = settings.DEBIT_PACKAGE
+    module = importlib.import_module(debit_provider, debit_package)
+    provider = getattr(module, debit_package)()
+    provider.config = settings.DEBIT_CONFIG
+    provider.setup_provider()
+    return provider
+
+
+def chunked(iterable, size):
+    """
+    Yields lists of up to size items from iterable without materialising it
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def process_chunk(action, number, chunk, close_connections=False):
+    """
+    Runs action (e.g. provider.check_statuses) on one chunk of debit ids.
+    No transaction is held open around it, the action sends its requests
+    first and writes their outcome in a transaction of its own. Returns the
+    number of debits in the chunk and whether it was processed.
+    """
+    tl.info(". Processing chunk %s (%s debits)" % (number, len(chunk)))
+    try:
+        results = action(chunk)
+    except Exception:
+        tl.exception(". Chunk %s failed" % (number,))
+        return len(chunk), False
+    finally:
+        if close_connections:
+            # worker threads get their own connections, don't leak them
+            connections.close_all()
+    tl.info(". Chunk %s: %s" % (number, results))
+    return len(chunk), True
+
+
+def process_chunks(action, debits, chunk_size, concurrency):
+    """
+    Streams the ids of debits with a server-side cursor and runs action on
+    chunks of them, each chunk committing its outcome on its own.
+    With a concurrency above 1 chunks are run from a bounded thread pool.
+    Returns the number of debits processed and the number that failed.
+    """
+    debit_ids = debits.values_list('id', flat=True).iterator(chunk_size=chunk_size)
+    chunks = enumerate(chunked(debit_ids, chunk_size), start=1)
+    outcomes = []
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            running = set()
+            for number, chunk in chunks:
+                if len(running) >= concurrency:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    outcomes.extend(future.result() for future in done)
+                running.add(pool.submit(process_chunk, action, number, chunk, True))
+            outcomes.extend(future.result() for future in wait(running).done)
+    else:
+        outcomes = [process_chunk(action, number, chunk) for number, chunk in chunks]
+
+    processed = sum(size for size, ok in outcomes if ok)
+    failed = sum(size for size, ok in outcomes if not ok)
+    return processed, failed
+
+
+class ClaimBudget:
+    """
+    Shared state of the workers claiming debits in one run: how many debits
+    may still be claimed, the chunk numbers and the debits whose chunk failed
+    (those put back to pending must not be claimed again in this run).
+    """
+
+    def __init__(self, limit):
+        self.lock = threading.Lock()
+        self.remaining = limit
+        self.chunks = 0
+        self.failed_ids = set()
+
+    def take(self, size):
+        with self.lock:
+            size = min(size, self.remaining)
+            self.remaining -= size
+            return size
+
+    def give_back(self, size):
+        with self.lock:
+            self.remaining += size
+
+    def next_number(self):
+        with self.lock:
+            self.chunks += 1
+            return self.chunks
+
+    def excluded(self):
+        with self.lock:
+            return list(self.failed_ids)
+
+    def fail(self, ids):
+        with self.lock:
+            self.failed_ids.update(ids)
+
+
+def claim_chunks(claim, action, debits, chunk_size, budget, close_connections=False):
+    """
+    Claims chunks of debits with SELECT ... FOR UPDATE SKIP LOCKED, so any
+    other worker, in this run or an overlapping one, skips them, and runs
+    claim (e.g. provider.claim_debits) on each in the transaction that
+    locked it. Once the claim has committed action (e.g.
+    provider.submit_debits) is run on the claimed debits with no
+    transaction open. Stops when nothing due is left or the budget is used
+    up. Returns the number of debits processed and the number that failed.
+    """
+    processed = 0
+    failed = 0
+    try:
+        while True:
+            size = budget.take(chunk_size)
+            if not size:
+                break
+            with transaction.atomic():
+                chunk = list(debits.exclude(id__in=budget.excluded()).select_for_update(
+                    skip_locked=True).values_list('id', flat=True)[:size])
+                claimed = claim(chunk) if chunk else []
+            budget.give_back(size - len(claimed))
+            if not chunk:
+                break
+            if not claimed:
+                continue
+            number = budget.next_number()
+            tl.info(". Processing chunk %s (%s debits)" % (number, len(claimed)))
+            try:
+                results = action(claimed)
+            except Exception:
+                tl.exception(". Chunk %s failed" % (number,))
+                budget.fail(chunk)
+                failed += len(claimed)
+            else:
+                tl.info(". Chunk %s: %s" % (number, results))
+                processed += len(claimed)
+    finally:
+        if close_connections:
+            # worker threads get their own connections, don't leak them
+            connections.close_all()
+    return processed, failed
+
+
 class TQueuePending(Task):
     """
     Task that queues pending debits on provider
@@ -22,27 +182,119 @@ class TQueuePending(Task):
         tl.info("Queue pending debits")
 
         tl.info(". Setting up provider")
-        debit_provider = settings.DEBIT_PROVIDER
-        debit_package = settings.DEBIT_PACKAGE
-        module = importlib.import_module(debit_provider, debit_package)
-        provider = getattr(module, debit_package)()
-        provider.config = settings.DEBIT_CONFIG
-        provider.setup_provider()
+        provider = get_provider()
+        try:
+            return self.queue_pending(provider)
+        finally:
+            provider.teardown_provider()
 
+    def queue_pending(self, provider):
+        """
+        Submits the pending debits whose scheduled_at has passed to the
+        (already set up) provider. Debits are claimed chunk by chunk with
+        row locks, so overlapping runs never submit the same debit twice,
+        and stay processing if submitting them fails once they may have
+        been sent.
+        """
         tl.info(". Preparing the debits list")
+        # only debits that are due, earliest first, up to the per run limit
+        budget = ClaimBudget(
+            int(provider.config.get("queue_limit", settings.DEBIT_QUEUE_LIMIT)))
         debits = Debit.objects.filter(
             status="pending",
-            load_attempts__lt=int(settings.DEBIT_LOAD_ATTEMPTS)
-        )
-
-        debits_list = list(debits.values_list('id', flat=True))
+            load_attempts__lt=int(settings.DEBIT_LOAD_ATTEMPTS),
+            scheduled_at__lte=timezone.now()
+        ).order_by("scheduled_at")
 
-        tl.info(". Loading debits")
-        results = provider.load_debits(debits_list)
-        tl.info(". %s" % (results,))
+        chunk_size = int(provider.config.get("chunk_size", settings.DEBIT_CHUNK_SIZE))
+        concurrency = int(provider.config.get("concurrency", settings.DEBIT_CONCURRENCY))
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = [future.result() for future in [
+                    pool.submit(
+                        claim_chunks, provider.claim_debits, provider.submit_debits,
+                        debits, chunk_size, budget, True)
+                    for _ in range(concurrency)]]
+        else:
+            outcomes = [claim_chunks(
+                provider.claim_debits, provider.submit_debits, debits, chunk_size, budget)]
+        queued = sum(processed for processed, _ in outcomes)
+        failed = sum(failed for _, failed in outcomes)
 
-        return "Queued {} pending debit(s)".format(len(debits_list))
+        if failed:
+            return "Queued {} pending debit(s). Failed to queue {} debit(s)".format(
+                queued, failed)
+        return "Queued {} pending debit(s)".format(queued)
 
 
 app.register_task(TQueuePending)
 t_queue_pending = TQueuePending()
+
+
+class TCheckLoaded(Task):
+    """
+    Task that checks the status of loaded debits on provider, in batches of
+    the provider's status_batch_size
+    """
+    name = "maguire.debits.tasks.t_check_loaded"
+
+    def run(self):
+        tl.info("Check loaded debits")
+
+        tl.info(". Setting up provider")
+        provider = get_provider()
+        try:
+            return self.check_loaded(provider)
+        finally:
+            provider.teardown_provider()
+
+    def check_loaded(self, provider):
+        """
+        Checks the loaded debits whose action date has passed
+        """
+        tl.info(". Preparing the debits list")
+        debits = Debit.objects.filter(
+            status="loaded",
+            scheduled_at__lte=timezone.now()
+        )
+
+        checked, failed = process_chunks(
+            provider.check_statuses, debits,
+            chunk_size=int(provider.config.get(
+                "status_batch_size", settings.DEBIT_STATUS_BATCH_SIZE)),
+            concurrency=int(provider.config.get("concurrency", settings.DEBIT_CONCURRENCY)))
+
+        if failed:
+            return "Checked {} loaded debit(s). Failed to check {} debit(s)".format(
+                checked, failed)
+        return "Checked {} loaded debit(s)".format(checked)
+
+
+app.register_task(TCheckLoaded)
+t_check_loaded = TCheckLoaded()
+
+
+class TDeliverCallbacks(Task):
+    """
+    Task that delivers due debit callbacks, batch by batch
+    """
+    name = "maguire.debits.tasks.t_deliver_callbacks"
+
+    def run(self):
+        tl.info("Deliver debit callbacks")
+        delivered = 0
+        failed = 0
+        while True:
+            batch_delivered, batch_failed = deliver_callbacks()
+            if batch_delivered + batch_failed == 0:
+                break
+            tl.info(". Delivered %s, failed %s" % (batch_delivered, batch_failed))
+            delivered += batch_delivered
+            failed += batch_failed
+
+        return "Delivered {} callback(s). {} delivery attempt(s) failed".format(
+            delivered, failed)
+
+
+app.register_task(TDeliverCallbacks)
+t_deliver_callbacks = TDeliverCallbacks()
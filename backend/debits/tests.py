@@ -1,17 +1,50 @@
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
+from collections import OrderedDict
+import io
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import tempfile
+import threading
+import time
+import types
+from unittest import mock
 from freezegun import freeze_time
 
+import requests
+import reversion
 import responses
 
 from django.conf import settings
-from django.test import TestCase
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from django.contrib.auth.models import User
+from django.contrib.auth.models import AnonymousUser, User
 from rest_framework.test import APIClient
 from rest_framework.authtoken.models import Token
+from reversion.models import Version
+from rolepermissions.roles import assign_role
 
-from debits.models import Debit
+from debits.admin import DebitResource
+from debits.history import history_backend
+from debits.models import Debit, DebitCallback, DebitChange
+from debits.serialization import DEBIT_FIELDS, debit_serializer
+from debits.transitions import transition_debits
+from events.models import Event
+from events.writer import write_event
+from maguire import persisted
+from maguire.loaders import load_related, prime_related
+from maguire.persisted import document_cache, query_hash
+from maguire.response_cache import get_versions
 from maguire.schema import schema
+from maguire.serialization import dumps
+from maguire.utils import CountableConnection
+from debits.providers.base import Provider
 from debits.providers.easydebit.provider import EasyDebitProvider
 
 try:
@@ -80,6 +113,72 @@ class TestDebitModel(TestCase):
         # Check again
         self.assertEqual(Debit.objects.count(), 2)
 
+    def test_model_creation_content_type_cached(self):
+        """Test that the model.created Event doesn't look up the ContentType each save"""
+        ContentType.objects.clear_cache()
+        Debit.objects.create(
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            amount="100.00",
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            Debit.objects.create(
+                account_name="Bobby Ninetoes",
+                account_number="123412341234",
+                branch_code="632005",
+                amount="100.00",
+            )
+
+        self.assertEqual(Event.objects.filter(event_type="model.created").count(), 2)
+        self.assertFalse(any(
+            '"django_content_type"."app_label"' in query["sql"]
+            for query in queries.captured_queries))
+
+    def test_model_save_update_fields_validates_only_those(self):
+        # Setup
+        user = make_user(username="saver")
+        debit = Debit.objects.create(
+            downstream_reference="ref-1",
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            amount="100.00",
+            created_by=user,
+        )
+        debit = Debit.objects.get(id=debit.id)
+
+        # Execute
+        debit.status = "loaded"
+        with CaptureQueriesContext(connection) as queries:
+            debit.save(update_fields=["status", "updated_at"])
+
+        # Check
+        # . no unique check of downstream_reference nor created_by lookup
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]["sql"].startswith("UPDATE"))
+        debit.status = "bogus"
+        with self.assertRaises(ValidationError):
+            debit.save(update_fields=["status", "updated_at"])
+
+    def test_model_save_skips_loaded_foreign_key_lookup(self):
+        # Setup
+        user = make_user(username="saver")
+
+        # Execute
+        with CaptureQueriesContext(connection) as queries:
+            Debit.objects.create(
+                account_name="Bobby Ninetoes",
+                account_number="123412341234",
+                branch_code="632005",
+                amount="100.00",
+                created_by=user,
+            )
+
+        # Check
+        self.assertFalse(any('FROM "auth_user"' in query["sql"] for query in queries))
+
     @freeze_time("2016-10-30 12:00:01")
     def test_debit_graphql(self):
         # Setup
@@ -218,252 +317,1561 @@ class TestDebitModel(TestCase):
         self.assertEqual(rd['loadAttempts'], 0)
         self.assertEqual(rd['lastError'], None)
 
-
-class TestDebitTasks(TestCase):
-
-    @responses.activate
-    def test_t_queue_pending_01(self):
-        """Test if there are no pending debits"""
-
+    def test_debit_mutation_update_http_writes_changes_only(self):
         # Setup
-        from .tasks import t_queue_pending
+        debit = Debit.objects.create(
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            amount="100.00",
+            updated_by=self.adm_user,
+        )
+        mutation = '''
+            mutation MutateDebit {
+                debitMutate(input: {id: "%s", accountName: "Remote", amount: "100.00"}) {
+                    debit { accountName amount }
+                }
+            }
+        ''' % (debit.node_id, )
 
         # Execute
-        result = t_queue_pending.run()
+        with CaptureQueriesContext(connection) as queries:
+            result = self.adm_client.post(self._url_string(query=mutation))
 
         # Check
-        self.assertEqual(result, "Queued 0 pending debit(s)")
-
-    @responses.activate
-    def test_t_queue_pending_02(self):
-        """Test if there are three pending debits - one with too many load_attempts"""
+        self.assertEqual(result.json()["data"]["debitMutate"]["debit"],
+                         {"accountName": "Remote", "amount": "100.00"})
+        updates = [query["sql"] for query in queries.captured_queries
+                   if query["sql"].startswith('UPDATE "debits_debit"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"account_name"', updates[0])
+        self.assertNotIn('"amount"', updates[0])
+        self.assertNotIn('"last_error"', updates[0])
+        event = Event.objects.get(source_id=debit.id, event_type="model.updated")
+        self.assertEqual(event.event_data, {"account_name": "Remote"})
 
+    def test_model_save_writes_dirty_fields(self):
         # Setup
-        from .tasks import t_queue_pending
-
-        # create debits
-        Debit.objects.create(
-            client="bobby was here",
-            downstream_reference=None,
-            callback_url=None,
+        debit = Debit.objects.create(
             account_name="Bobby Ninetoes",
             account_number="123412341234",
             branch_code="632005",
-            account_type="current",
-            status="pending",
-            amount="13500.00",
-            reference="111222111",
-            provider=None,
-            provider_reference=None,
-            provider_status=None,
-            scheduled_at=timezone.now() + timedelta(hours=48),
-            loaded_at=None,
-            load_attempts=0,
-            last_error=None
+            amount="100.00",
         )
+        debit = Debit.objects.get(id=debit.id)
+
+        # Execute
+        debit.status = "loaded"
+        debit.last_error = None
+        with CaptureQueriesContext(connection) as queries:
+            debit.save()
 
+        # Check
+        self.assertEqual(debit.dirty_fields(), [])
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]["sql"]
+        self.assertTrue(sql.startswith("UPDATE"))
+        self.assertEqual(sql.split(" WHERE ")[0].count(" = "), 2)  # status, updated_at
+        self.assertEqual(Debit.objects.get(id=debit.id).status, "loaded")
+
+    def test_only_debits_track_dirty_fields(self):
+        # Setup
         Debit.objects.create(
-            client="bobby was here",
-            downstream_reference=None,
-            callback_url=None,
             account_name="Bobby Ninetoes",
             account_number="123412341234",
             branch_code="632005",
-            account_type="current",
-            status="pending",
-            amount="13500.00",
-            reference="222333222",
-            provider=None,
-            provider_reference=None,
-            provider_status=None,
-            scheduled_at=timezone.now() - timedelta(hours=48),
-            loaded_at=None,
-            load_attempts=1,
-            last_error="PMT-AD-0000001"
+            amount="100.00",
         )
+        write_event(event_type="client.terminated", event_data={"large": ["value"] * 100})
+
+        # Execute
+        debit = Debit.objects.get()
+        event = Event.objects.get(event_type="client.terminated")
+
+        # Check
+        self.assertIsNotNone(getattr(debit, "_loaded_values", None))
+        # . loading an Event takes no snapshot of its event_data
+        self.assertIsNone(getattr(event, "_loaded_values", None))
+        self.assertIn("event_data", event.dirty_fields())
 
+    def test_debit_bulk_create_http(self):
+        # Setup
         Debit.objects.create(
-            client="bobby was here",
-            downstream_reference=None,
-            callback_url=None,
+            downstream_reference="taken",
             account_name="Bobby Ninetoes",
             account_number="123412341234",
             branch_code="632005",
-            account_type="current",
-            status="pending",
             amount="13500.00",
-            reference="333444333",
-            provider=None,
-            provider_reference=None,
-            provider_status=None,
-            scheduled_at=timezone.now() - timedelta(hours=48),
-            loaded_at=None,
-            load_attempts=4,
-            last_error=None
-        )
-
-        # setup response
-        xml_body = """
-            <SRP xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
-                <EL>
-                    <E>
-                        <CI>222333222</CI>
-                        <CL>
-                            <C>PMT-AD-000003</C>
-                        </CL>
-                    </E>
-                </EL>
-            </SRP>
-        """
-        responses.add(
-            responses.POST,
-            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
-            body=xml_body, status=200, content_type='application/xml'
         )
-
+        mutation = '''
+            mutation BulkCreateDebits {
+                debitBulkCreate(
+                    input: {
+                        debits: [
+                            {
+                                downstreamReference: "first",
+                                accountName: "Remote",
+                                accountNumber: "5432154321",
+                                branchCode: "632001",
+                                accountType: "current",
+                                amount: "100000.10",
+                                scheduledAt: "2016-11-30T12:00:01+00:00"
+                            },
+                            {
+                                accountName: "Remote",
+                                accountNumber: "5432154321",
+                                branchCode: "632001",
+                                amount: "not an amount"
+                            },
+                            {
+                                downstreamReference: "taken",
+                                accountName: "Remote",
+                                accountNumber: "5432154321",
+                                branchCode: "632001",
+                                amount: "10.00"
+                            },
+                            {
+                                downstreamReference: "first",
+                                accountName: "Remote",
+                                accountNumber: "5432154321",
+                                branchCode: "632001",
+                                amount: "10.00"
+                            },
+                            {
+                                accountName: "Remote too",
+                                accountNumber: "5432154322",
+                                branchCode: "632001",
+                                amount: "20.00"
+                            }
+                        ]
+                    }
+                ) {
+                    created
+                    failed
+                    results {
+                        index
+                        debit {
+                            downstreamReference
+                            reference
+                            status
+                            amount
+                        }
+                        errors {
+                            field
+                            messages
+                        }
+                    }
+                }
+            }
+        '''
         # Execute
-        result = t_queue_pending.run()
+        result = self.adm_client.post(self._url_string(query=mutation))
 
         # Check
-        self.assertEqual(result, "Queued 2 pending debit(s)")
+        self.assertEqual(result.status_code, 200)
+        rd = result.json()["data"]["debitBulkCreate"]
+        self.assertEqual(rd["created"], 2)
+        self.assertEqual(rd["failed"], 3)
+        results = rd["results"]
+        self.assertEqual([r["index"] for r in results], [0, 1, 2, 3, 4])
+        self.assertEqual(results[0]["debit"]["downstreamReference"], "first")
+        self.assertEqual(results[0]["debit"]["status"], "PENDING")
+        self.assertEqual(results[0]["errors"], [])
+        self.assertEqual(results[1]["debit"], None)
+        self.assertEqual(results[1]["errors"][0]["field"], "amount")
+        self.assertEqual(results[2]["errors"][0]["field"], "downstream_reference")
+        self.assertEqual(results[3]["errors"][0]["field"], "downstream_reference")
+        self.assertEqual(results[4]["debit"]["amount"], "20.00")
+        # . references are allocated and the debits and their events saved
+        references = {results[0]["debit"]["reference"], results[4]["debit"]["reference"]}
+        self.assertEqual(len(references), 2)
+        debits = Debit.objects.filter(reference__in=references)
+        self.assertEqual(debits.count(), 2)
+        self.assertEqual(set(debits.values_list("created_by", flat=True)), {self.adm_user.id})
+        events = Event.objects.filter(
+            event_type="model.created", source_id__in=debits.values("id"))
+        self.assertEqual(events.count(), 2)
+        self.assertEqual(
+            {event.event_data["reference"] for event in events}, references)
 
+    def test_debit_bulk_create_query_count(self):
+        """Test that the queries needed don't grow with the number of debits"""
+        from .bulk import create_debits
 
-class TestProviderEasyDebit(TestCase):
+        def items(count, prefix):
+            return [{
+                "downstream_reference": "%s-%s" % (prefix, i),
+                "account_name": "Bobby Ninetoes",
+                "account_number": "123412341234",
+                "branch_code": "632005",
+                "amount": "100.00",
+            } for i in range(count)]
 
-    @freeze_time("2018-02-13 12:30:00")
-    @responses.activate
-    def test_load_debits_succesful(self):
-        # Setup
-        # setup easydebit provider
-        provider = EasyDebitProvider()
-        provider.config = settings.DEBIT_CONFIG
-        provider.setup_provider()
+        ContentType.objects.get_for_model(Debit)
+        with CaptureQueriesContext(connection) as small:
+            create_debits(items(2, "small"), self.adm_user)
+        with CaptureQueriesContext(connection) as large:
+            results = create_debits(items(50, "large"), self.adm_user)
 
-        # setup response
-        xml_body = """
-            <SRP xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
-                <EL/>
-            </SRP>
-        """
-        responses.add(
-            responses.POST,
-            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
-            body=xml_body, status=200, content_type='application/xml'
-        )
+        self.assertEqual(len(small), len(large))
+        self.assertTrue(all(not errors for _, errors in results))
+        self.assertEqual(Debit.objects.count(), 52)
 
-        debit = Debit.objects.create(
-            client="bobby was here",
-            downstream_reference=None,
-            callback_url=None,
-            account_name="Bobby Ninetoes",
-            account_number="123412341234",
-            branch_code="632005",
-            account_type="current",
-            status="pending",
-            amount="13500.00",
-            reference="111222111",
-            provider=None,
-            provider_reference=None,
-            provider_status=None,
-            scheduled_at=timezone.now() + timedelta(hours=48),
-            loaded_at=None,
-            load_attempts=0,
-            last_error=None
-        )
 
+class TestDebitPagination(TestCase):
+
+    def setUp(self):
+        # five debits, one per day, the last one without a scheduled_at
+        self.debits = []
+        for day in range(5):
+            with freeze_time("2018-02-%02d 12:00:00" % (day + 1, )):
+                self.debits.append(Debit.objects.create(
+                    account_name="Bobby Ninetoes",
+                    account_number="123412341234",
+                    branch_code="632005",
+                    amount="%s.00" % (day + 1, ),
+                    scheduled_at=timezone.now() if day < 4 else None,
+                ))
+
+    def page(self, arguments, fields="totalCount"):
+        result = schema.execute('''
+            query Debits {
+                debits(%s) {
+                    %s
+                    pageInfo { hasNextPage hasPreviousPage endCursor startCursor }
+                    edges { cursor node { amount } }
+                }
+            }
+        ''' % (arguments, fields))
+        self.assertEqual(result.errors, None)
+        rd = result.data["debits"]
+        return [edge["node"]["amount"] for edge in rd["edges"]], rd
+
+    def test_keyset_pages_forward(self):
         # Execute
-        result = provider.load_debits(ids=[str(debit.id)])
+        first, rd = self.page("first: 2")
+        second, rd = self.page('first: 2, after: "%s"' % rd["pageInfo"]["endCursor"])
+        third, rd = self.page('first: 2, after: "%s"' % rd["pageInfo"]["endCursor"])
 
         # Check
-        self.assertEqual(result, "Successfully loaded 1 debits. Failed to load 0 debits.")
+        self.assertEqual([first, second, third], [["1.00", "2.00"], ["3.00", "4.00"], ["5.00"]])
+        self.assertEqual(rd["totalCount"], 5)
+        self.assertFalse(rd["pageInfo"]["hasNextPage"])
+        self.assertTrue(rd["pageInfo"]["hasPreviousPage"])
 
-        debit.refresh_from_db()
-        self.assertEqual(debit.status, "loaded")
-        self.assertEqual(debit.load_attempts, 1)
-        self.assertEqual(debit.last_error, None)
-        self.assertEqual(debit.scheduled_at, timezone.now() + timedelta(hours=48))
+    def test_keyset_pages_backward(self):
+        # Execute
+        last, rd = self.page("last: 2")
+        before, rd = self.page('last: 2, before: "%s"' % rd["pageInfo"]["startCursor"])
 
-    @freeze_time("2018-02-13 12:30:00")
-    @responses.activate
-    def test_load_debits_fail_should_retry(self):
-        # Setup
-        # setup easydebit provider
-        provider = EasyDebitProvider()
-        provider.config = settings.DEBIT_CONFIG
-        provider.setup_provider()
+        # Check
+        self.assertEqual([last, before], [["4.00", "5.00"], ["2.00", "3.00"]])
+        self.assertTrue(rd["pageInfo"]["hasPreviousPage"])
+        self.assertTrue(rd["pageInfo"]["hasNextPage"])
 
-        # setup response
-        xml_body = """
-            <SRP xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
-                <EL>
-                    <E>
-                        <CI>222333222</CI>
-                        <CL>
-                            <C>PMT-AD-000003</C>
-                        </CL>
-                    </E>
-                </EL>
-            </SRP>
-        """
-        responses.add(
-            responses.POST,
-            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
-            body=xml_body, status=200, content_type='application/xml'
-        )
+    def test_keyset_pages_nullable_order(self):
+        # Execute
+        pages = []
+        after = ""
+        while True:
+            amounts, rd = self.page('first: 2, orderBy: "-scheduled_at"%s' % after)
+            pages.append(amounts)
+            if not rd["pageInfo"]["hasNextPage"]:
+                break
+            after = ', after: "%s"' % rd["pageInfo"]["endCursor"]
 
-        debit = Debit.objects.create(
-            client="bobby was here",
-            downstream_reference=None,
-            callback_url=None,
-            account_name="Bobby Ninetoes",
-            account_number="123412341234",
-            branch_code="632005",
-            account_type="current",
-            status="pending",
-            amount="13500.00",
-            reference="222333222",
-            provider=None,
-            provider_reference=None,
-            provider_status=None,
-            scheduled_at=timezone.now() - timedelta(hours=48),
-            loaded_at=None,
-            load_attempts=1,
-            last_error="PMT-AD-0000001"
-        )
+        # Check
+        # . NULLs come first in descending order
+        self.assertEqual(pages, [["5.00", "4.00"], ["3.00", "2.00"], ["1.00"]])
 
+    def test_keyset_pages_nullable_order_ascending(self):
         # Execute
-        result = provider.load_debits(ids=[str(debit.id)])
+        pages = []
+        after = ""
+        while True:
+            amounts, rd = self.page('first: 2, orderBy: "scheduled_at"%s' % after)
+            pages.append(amounts)
+            if not rd["pageInfo"]["hasNextPage"]:
+                break
+            after = ', after: "%s"' % rd["pageInfo"]["endCursor"]
 
         # Check
-        self.assertEqual(result, "Successfully loaded 0 debits. Failed to load 1 debits.")
+        # . NULLs come last in ascending order
+        self.assertEqual(pages, [["1.00", "2.00"], ["3.00", "4.00"], ["5.00"]])
 
-        debit.refresh_from_db()
-        self.assertEqual(debit.status, "pending")
-        self.assertEqual(debit.load_attempts, 2)
-        self.assertEqual(debit.last_error, "PMT-AD-000003")
-        self.assertEqual(debit.scheduled_at, timezone.now() + timedelta(hours=48))
+    def test_keyset_pages_nullable_order_backward(self):
+        # Execute
+        pages = []
+        before = ""
+        while True:
+            amounts, rd = self.page('last: 2, orderBy: "-scheduled_at"%s' % before)
+            pages.append(amounts)
+            if not rd["pageInfo"]["hasPreviousPage"]:
+                break
+            before = ', before: "%s"' % rd["pageInfo"]["startCursor"]
 
-    @freeze_time("2018-02-13 12:30:00")
-    @responses.activate
-    def test_load_debits_fail_should_not_retry(self):
-        # Setup
-        # setup easydebit provider
-        provider = EasyDebitProvider()
-        provider.config = settings.DEBIT_CONFIG
-        provider.setup_provider()
+        # Check
+        self.assertEqual(pages, [["2.00", "1.00"], ["4.00", "3.00"], ["5.00"]])
 
-        # setup response
-        xml_body = """
+    def test_keyset_total_count_only_when_selected(self):
+        # Execute
+        with CaptureQueriesContext(connection) as queries:
+            amounts, rd = self.page("first: 2", fields="")
+
+        # Check
+        self.assertEqual(amounts, ["1.00", "2.00"])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("COUNT", queries[0]["sql"])
+        self.assertNotIn("OFFSET", queries[0]["sql"])
+
+    def test_keyset_rejects_foreign_cursor(self):
+        # Execute
+        result = schema.execute('''
+            query Debits {
+                debits(first: 2, after: "YXJyYXljb25uZWN0aW9uOjE=") { edges { cursor } }
+            }
+        ''')
+
+        # Check
+        self.assertIn("Invalid cursor", result.errors[0].message)
+
+
+class TestDebitRelatedLoading(TestCase):
+
+    def setUp(self):
+        self.users = [make_user(username="user%s" % (i, )) for i in range(2)]
+        for i in range(4):
+            Debit.objects.create(
+                account_name="Bobby Ninetoes",
+                account_number="123412341234",
+                branch_code="632005",
+                amount="%s.00" % (i + 1, ),
+                created_by=self.users[i % 2],
+                updated_by=self.users[0],
+            )
+        self.context = types.SimpleNamespace(user=self.users[0])
+
+    def test_user_relations_not_exposed(self):
+        # Execute
+        result = schema.execute('''
+            query Debits {
+                debits(first: 4) { edges { node { amount createdBy { username } } } }
+            }
+        ''', context_value=self.context)
+
+        # Check
+        self.assertIn("Cannot query field 'createdBy'", result.errors[0].message)
+
+    def test_loaders_batch_related_objects(self):
+        # Setup
+        debits = list(Debit.objects.order_by("created_at"))
+        info = types.SimpleNamespace(context=self.context)
+
+        # Execute
+        with CaptureQueriesContext(connection) as queries:
+            prime_related(self.context, debits)
+            created_by = [load_related(info, debit, "created_by") for debit in debits]
+            updated_by = [load_related(info, debit, "updated_by") for debit in debits]
+
+        # Check
+        self.assertEqual(created_by, [self.users[0], self.users[1]] * 2)
+        self.assertEqual(updated_by, [self.users[0]] * 4)
+        # . one query for all the users of the page
+        self.assertEqual(len(queries), 1)
+
+
+class TestGraphQLPersistedQueries(TestCase):
+
+    query = "query Debits { debits(first: 1) { edges { node { amount } } } }"
+
+    def setUp(self):
+        self.adm_client = APIClient()
+        self.adm_user = make_user(username="testadm", password="testpass",
+                                  email="testadm@example.com", role="admin")
+        adm_token = Token.objects.create(user=self.adm_user)
+        self.adm_client.credentials(HTTP_AUTHORIZATION='Token ' + adm_token.key)
+        cache.clear()
+        document_cache.clear()
+        Debit.objects.create(
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            amount="100.00",
+        )
+
+    def post(self, query=None, sha256=None):
+        data = {}
+        if query is not None:
+            data["query"] = query
+        if sha256 is not None:
+            data["extensions"] = {"persistedQuery": {"version": 1, "sha256Hash": sha256}}
+        response = self.adm_client.post('/graphql', json.dumps(data),
+                                        content_type='application/json')
+        return response.json()
+
+    def test_persisted_query_registered_then_sent_by_hash(self):
+        # Setup
+        sha256 = query_hash(self.query)
+
+        # Execute
+        unknown = self.post(sha256=sha256)
+        registered = self.post(self.query, sha256)
+        by_hash = self.post(sha256=sha256)
+
+        # Check
+        self.assertEqual(unknown["errors"][0]["message"], "PersistedQueryNotFound")
+        self.assertEqual(unknown["errors"][0]["extensions"]["code"], "PERSISTED_QUERY_NOT_FOUND")
+        expected = {"debits": {"edges": [{"node": {"amount": "100.00"}}]}}
+        self.assertEqual(registered["data"], expected)
+        self.assertEqual(by_hash["data"], expected)
+
+    def test_persisted_query_hash_mismatch_rejected(self):
+        # Execute
+        result = self.post(self.query, query_hash("query { debits { totalCount } }"))
+
+        # Check
+        self.assertEqual(result["errors"][0]["message"], "provided sha does not match query")
+
+    def test_documents_parsed_once(self):
+        # Execute
+        with mock.patch("maguire.persisted.parse", wraps=persisted.parse) as parse:
+            first = self.post(self.query)
+            second = self.post(self.query)
+
+        # Check
+        self.assertEqual(first, second)
+        self.assertEqual(parse.call_count, 1)
+
+    def test_invalid_documents_not_cached(self):
+        # Execute
+        results = [self.post("query { debits { nope } }") for _ in range(2)]
+
+        # Check
+        for result in results:
+            self.assertIn("nope", result["errors"][0]["message"])
+        self.assertEqual(document_cache.documents, OrderedDict())
+
+    def test_allow_list_only(self):
+        # Setup
+        allowed = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+        self.addCleanup(os.remove, allowed.name)
+        json.dump([self.query], allowed)
+        allowed.close()
+
+        # Execute
+        with override_settings(GRAPHQL_PERSISTED_QUERIES=allowed.name,
+                               GRAPHQL_PERSISTED_QUERIES_ONLY=True):
+            by_hash = self.post(sha256=query_hash(self.query))
+            in_full = self.post(self.query)
+            other = self.post("query { debits { totalCount } }")
+
+        # Check
+        self.assertEqual(by_hash["data"]["debits"]["edges"][0]["node"]["amount"], "100.00")
+        self.assertEqual(in_full, by_hash)
+        self.assertEqual(other["errors"][0]["message"], "PersistedQueryNotAllowed")
+
+
+@override_settings(GRAPHQL_RESPONSE_CACHE_TTL="60")
+class TestGraphQLResponseCache(TestCase):
+
+    query = '''
+        query Debits($status: String) {
+            debits(status: $status) { edges { node { amount status } } }
+        }
+    '''
+
+    def setUp(self):
+        self.adm_client = APIClient()
+        self.adm_user = make_user(username="testadm", password="testpass",
+                                  email="testadm@example.com", role="admin")
+        assign_role(self.adm_user, "admin")
+        adm_token = Token.objects.create(user=self.adm_user)
+        self.adm_client.credentials(HTTP_AUTHORIZATION='Token ' + adm_token.key)
+        cache.clear()
+        self.debit = Debit.objects.create(
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            amount="100.00",
+        )
+
+    def post(self, query=None, variables=None):
+        response = self.adm_client.post(
+            '/graphql', json.dumps({"query": query or self.query, "variables": variables}),
+            content_type='application/json')
+        return response.json()
+
+    def debit_queries(self, queries):
+        return [query for query in queries.captured_queries if "debits_debit" in query["sql"]]
+
+    def test_repeated_query_served_from_cache(self):
+        # Execute
+        first = self.post(variables={"status": "pending"})
+        with CaptureQueriesContext(connection) as queries:
+            second = self.post(
+                # same document, formatted differently
+                " ".join(self.query.split()), variables={"status": "pending"})
+            other = self.post(variables={"status": "loaded"})
+
+        # Check
+        self.assertEqual(first, second)
+        self.assertEqual(first["data"]["debits"]["edges"][0]["node"]["amount"], "100.00")
+        self.assertEqual(other["data"]["debits"]["edges"], [])
+        # . only the query with new variables ran
+        self.assertEqual(len(self.debit_queries(queries)), 1)
+
+    def test_debit_change_invalidates_cached_results(self):
+        # Setup
+        first = self.post()
+
+        # Execute
+        with self.captureOnCommitCallbacks(execute=True):
+            transition_debits([self.debit], "loaded")
+        second = self.post()
+
+        # Check
+        self.assertEqual(first["data"]["debits"]["edges"][0]["node"]["status"], "PENDING")
+        self.assertEqual(second["data"]["debits"]["edges"][0]["node"]["status"], "LOADED")
+
+    def test_new_events_invalidate_cached_events(self):
+        # Setup
+        version = get_versions(["events.event"])
+
+        # Execute
+        with self.captureOnCommitCallbacks(execute=True):
+            write_event(event_type="debit.batch_completed", event_at=timezone.now())
+
+        # Check
+        self.assertNotEqual(get_versions(["events.event"]), version)
+
+    def test_admin_save_invalidates_cached_results(self):
+        # Setup
+        first = self.post()
+        self.debit.amount = "200.00"
+
+        # Execute
+        with self.captureOnCommitCallbacks(execute=True):
+            # as AppModelAdmin saves, no model.updated Event is written
+            self.debit.save(validate=False)
+        second = self.post()
+
+        # Check
+        self.assertEqual(first["data"]["debits"]["edges"][0]["node"]["amount"], "100.00")
+        self.assertEqual(second["data"]["debits"]["edges"][0]["node"]["amount"], "200.00")
+
+    def test_cache_outage_does_not_fail_writes(self):
+        # Execute
+        with mock.patch("maguire.response_cache.bump_versions",
+                        side_effect=ConnectionError("cache down")):
+            with self.captureOnCommitCallbacks(execute=True):
+                transition_debits([self.debit], "loaded")
+
+        # Check
+        self.assertEqual(Debit.objects.get(id=self.debit.id).status, "loaded")
+
+    @override_settings(GRAPHQL_RESPONSE_CACHE_TTL="0")
+    def test_no_invalidation_when_cache_off(self):
+        # Execute
+        with mock.patch("maguire.response_cache.bump_versions") as bump_versions:
+            with self.captureOnCommitCallbacks(execute=True):
+                transition_debits([self.debit], "loaded")
+                self.debit.save()
+
+        # Check
+        bump_versions.assert_not_called()
+
+    def test_errors_and_other_fields_not_cached(self):
+        # Execute
+        self.post("query { debits { nope } }")
+        self.post("query { __typename }")
+
+        # Check
+        self.assertEqual(
+            [key for key in cache._cache if "maguire.graphql.response" in key], [])
+
+
+class TestDebitHistory(TestCase):
+
+    def setUp(self):
+        self.user = make_user(username="historian")
+        self.debit = Debit.objects.create(
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            amount="100.00",
+        )
+        self.debit = Debit.objects.get(id=self.debit.id)
+
+    def change(self):
+        with reversion.create_revision():
+            transition_debits([self.debit], "loaded", user=self.user)
+            self.debit.last_error = "checked"
+            self.debit.save()
+
+    def test_reversion_backend_snapshots(self):
+        # Execute
+        self.change()
+
+        # Check
+        self.assertEqual(Version.objects.get_for_object(self.debit).count(), 1)
+        self.assertEqual(DebitChange.objects.count(), 0)
+
+    def test_events_backend_writes_events_only(self):
+        # Execute
+        with history_backend("events"):
+            self.change()
+
+        # Check
+        self.assertEqual(Version.objects.count(), 0)
+        self.assertEqual(DebitChange.objects.count(), 0)
+        self.assertEqual(Event.objects.filter(
+            source_id=self.debit.id, event_type="model.updated").count(), 1)
+
+    def test_diff_backend_writes_changed_fields(self):
+        # Execute
+        with history_backend("diff"):
+            self.change()
+
+        # Check
+        self.assertEqual(Version.objects.count(), 0)
+        changes = list(DebitChange.objects.filter(debit=self.debit).order_by("id"))
+        self.assertEqual(changes[0].changes, {"status": "loaded"})
+        self.assertEqual(changes[0].changed_by, self.user)
+        self.assertEqual(changes[1].changes, {"last_error": "checked"})
+
+    def test_diff_backend_save_loads_no_user(self):
+        # Setup
+        Debit.objects.filter(id=self.debit.id).update(updated_by=self.user)
+        debit = Debit.objects.get(id=self.debit.id)
+        debit.last_error = "checked"
+
+        # Execute
+        with history_backend("diff"):
+            with CaptureQueriesContext(connection) as queries:
+                debit.save()
+
+        # Check
+        self.assertFalse([query for query in queries.captured_queries
+                          if "auth_user" in query["sql"]])
+        self.assertEqual(DebitChange.objects.get().changed_by_id, self.user.id)
+
+    def test_unknown_backend_rejected(self):
+        with self.assertRaises(ValueError):
+            with history_backend("nope"):
+                pass
+
+
+class TestDebitSerialization(TestCase):
+
+    def setUp(self):
+        self.user = make_user(username="serializer")
+        for day in range(3):
+            Debit.objects.create(
+                account_name="Bobby Ninetoes",
+                account_number="123412341234",
+                branch_code="632005",
+                amount="13500.00",
+                scheduled_at=datetime(2018, 2, day + 1, 12, tzinfo=dt_timezone.utc),
+                created_by=self.user,
+            )
+
+    def test_as_json_reads_no_related_objects(self):
+        # Setup
+        debit = Debit.objects.order_by("created_at").first()
+
+        # Execute
+        with CaptureQueriesContext(connection) as queries:
+            data = debit.as_json()
+
+        # Check
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(data["created_by"], self.user.id)
+        self.assertEqual(data["amount"], "13500.00")
+        # . scheduled_at is set even though the debit isn't loaded yet
+        self.assertEqual(data["scheduled_at"], "2018-02-01T12:00:00+00:00")
+        self.assertEqual(data["loaded_at"], None)
+
+    def test_rows_and_instances_serialize_alike(self):
+        # Execute
+        rows = list(debit_serializer.iter_data(Debit.objects.order_by("created_at")))
+
+        # Check
+        self.assertEqual(
+            rows, [debit.as_json() for debit in Debit.objects.order_by("created_at")])
+        self.assertEqual(list(rows[0]), DEBIT_FIELDS)
+        self.assertEqual(json.loads(dumps(rows)), rows)
+
+    def test_changes_serialize_like_debits(self):
+        # Setup
+        debit = Debit.objects.order_by("created_at").first()
+
+        # Execute
+        with history_backend("diff"):
+            transition_debits(
+                [debit], "loaded", user=self.user, loaded_at=timezone.now(),
+                provider_reference="TBC")
+
+        # Check
+        data = debit.as_json()
+        event = Event.objects.get(source_id=debit.id, event_type="model.updated")
+        change = DebitChange.objects.get(debit=debit)
+        for changes in [event.event_data, change.changes]:
+            self.assertEqual(changes, {field: data[field] for field in changes})
+
+    def test_admin_export_from_rows(self):
+        # Execute
+        with CaptureQueriesContext(connection) as queries:
+            dataset = DebitResource().export(Debit.objects.order_by("created_at"))
+
+        # Check
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(dataset.headers, DEBIT_FIELDS)
+        self.assertEqual([row["scheduled_at"] for row in dataset.dict], [
+            "2018-02-0%sT12:00:00+00:00" % (day + 1, ) for day in range(3)])
+
+
+class TestDebitImports(TestCase):
+
+    def setUp(self):
+        super(TestCase, self).setUp()
+        self.adm_client = APIClient()
+        self.adm_user = make_user(username="testadm", password="testpass",
+                                  email="testadm@example.com", role="admin")
+        assign_role(self.adm_user, "admin")
+        adm_token = Token.objects.create(user=self.adm_user)
+        self.adm_client.credentials(HTTP_AUTHORIZATION='Token ' + adm_token.key)
+
+    def test_import_csv_http(self):
+        # Setup
+        upload = io.BytesIO(
+            b"downstream_reference,account_name,account_number,branch_code,amount,client\n"
+            b"one,Bobby Ninetoes,123412341234,632005,100.00,\n"
+            b"two,Bobby Ninetoes,123412341234,632005,lots,\n"
+            b"three,Bobby Ninetoes,123412341234,1234567,100.00,bobby\n"
+            b"four,Bobby Ninetoes,123412341234,632005,200.50,bobby\n")
+        upload.name = "debits.csv"
+
+        # Execute
+        with mock.patch("debits.views.default_storage") as storage:
+            storage.save.return_value = "debits/imports/rejects.ndjson"
+            storage.url.return_value = "https://example.com/rejects.ndjson"
+            result = self.adm_client.post(
+                "/api/v1/debits/import/", {"file": upload}, format="multipart")
+
+        # Check
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json(), {
+            "imported": 2,
+            "rejected": 2,
+            "rejects_url": "https://example.com/rejects.ndjson",
+        })
+        self.assertEqual(
+            set(Debit.objects.values_list("downstream_reference", flat=True)), {"one", "four"})
+        self.assertEqual(Debit.objects.get(downstream_reference="one").client, None)
+        self.assertEqual(Event.objects.filter(event_type="model.created").count(), 2)
+
+    def test_import_requires_create_permission(self):
+        # Setup
+        client = APIClient()
+        user = make_user(username="readonly", password="testpass",
+                         email="readonly@example.com", role="read_only")
+        assign_role(user, "read_only")
+        client.credentials(
+            HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        upload = io.BytesIO(b"account_name\n")
+        upload.name = "debits.csv"
+
+        # Execute
+        result = client.post("/api/v1/debits/import/", {"file": upload}, format="multipart")
+
+        # Check
+        self.assertEqual(result.status_code, 403)
+
+    def test_import_debits_command(self):
+        # Setup
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "debits.ndjson")
+        rejects_path = os.path.join(directory, "rejects.ndjson")
+        with open(path, "w") as f:
+            for i in range(5):
+                f.write(json.dumps({
+                    "downstream_reference": "ref-%s" % (i, ),
+                    "account_name": "Bobby Ninetoes",
+                    "account_number": "123412341234",
+                    "branch_code": "632005",
+                    "amount": "10.00",
+                    "scheduled_at": "2018-02-13T12:30:00+00:00",
+                }) + "\n")
+            f.write("not json\n")
+            f.write(json.dumps({"downstream_reference": "ref-0", "account_name": "Dup",
+                                "account_number": "1", "branch_code": "1",
+                                "amount": "1.00"}) + "\n")
+        out = io.StringIO()
+
+        # Execute
+        call_command("import_debits", path, rejects=rejects_path, batch_size=2,
+                     user="testadm", stdout=out)
+
+        # Check
+        self.assertIn("Imported 5 debit(s), rejected 2 row(s)", out.getvalue())
+        self.assertEqual(Debit.objects.filter(created_by=self.adm_user).count(), 5)
+        with open(rejects_path) as f:
+            rejects = [json.loads(line) for line in f]
+        self.assertEqual([reject["line"] for reject in rejects], [6, 7])
+        self.assertIn("__all__", rejects[0]["errors"])
+        self.assertIn("downstream_reference", rejects[1]["errors"])
+
+
+class TestDebitImportsTransactions(TransactionTestCase):
+
+    @override_settings(DEBIT_IMPORT_BATCH_SIZE="2")
+    def test_import_http_commits_each_batch(self):
+        # Setup
+        client = APIClient()
+        user = make_user(username="testadm", password="testpass",
+                         email="testadm@example.com", role="admin")
+        assign_role(user, "admin")
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        upload = io.BytesIO(
+            b"downstream_reference,account_name,account_number,branch_code,amount\n" +
+            b"".join(b"ref-%d,Bobby Ninetoes,123412341234,632005,100.00\n" % (i, )
+                     for i in range(5)))
+        upload.name = "debits.csv"
+
+        from debits import imports
+        import_batch = imports._import_batch
+        outer_transaction = []
+
+        def check_import_batch(*args):
+            outer_transaction.append(connection.in_atomic_block)
+            return import_batch(*args)
+
+        # Execute
+        with mock.patch("debits.imports._import_batch", side_effect=check_import_batch):
+            result = client.post(
+                "/api/v1/debits/import/", {"file": upload}, format="multipart")
+
+        # Check
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json()["imported"], 5)
+        # . no request transaction, each batch commits on its own
+        self.assertEqual(outer_transaction, [False, False, False])
+        # . and no reversion snapshots held for the whole upload
+        self.assertEqual(Version.objects.count(), 0)
+        self.assertEqual(Event.objects.filter(event_type="model.created").count(), 5)
+
+
+class TestDebitTasks(TestCase):
+
+    @responses.activate
+    def test_t_queue_pending_01(self):
+        """Test if there are no pending debits"""
+
+        # Setup
+        from .tasks import t_queue_pending
+
+        # Execute
+        result = t_queue_pending.run()
+
+        # Check
+        self.assertEqual(result, "Queued 0 pending debit(s)")
+
+    @responses.activate
+    def test_t_queue_pending_02(self):
+        """Test if there are three pending debits - one not due yet and one with too many
+        load_attempts"""
+
+        # Setup
+        from .tasks import t_queue_pending
+
+        # create debits
+        Debit.objects.create(
+            client="bobby was here",
+            downstream_reference=None,
+            callback_url=None,
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            account_type="current",
+            status="pending",
+            amount="13500.00",
+            reference="111222111",
+            provider=None,
+            provider_reference=None,
+            provider_status=None,
+            scheduled_at=timezone.now() + timedelta(hours=48),
+            loaded_at=None,
+            load_attempts=0,
+            last_error=None
+        )
+
+        Debit.objects.create(
+            client="bobby was here",
+            downstream_reference=None,
+            callback_url=None,
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            account_type="current",
+            status="pending",
+            amount="13500.00",
+            reference="222333222",
+            provider=None,
+            provider_reference=None,
+            provider_status=None,
+            scheduled_at=timezone.now() - timedelta(hours=48),
+            loaded_at=None,
+            load_attempts=1,
+            last_error="PMT-AD-0000001"
+        )
+
+        Debit.objects.create(
+            client="bobby was here",
+            downstream_reference=None,
+            callback_url=None,
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            account_type="current",
+            status="pending",
+            amount="13500.00",
+            reference="333444333",
+            provider=None,
+            provider_reference=None,
+            provider_status=None,
+            scheduled_at=timezone.now() - timedelta(hours=48),
+            loaded_at=None,
+            load_attempts=4,
+            last_error=None
+        )
+
+        # setup response
+        xml_body = """
+            <SRP xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
+                <EL>
+                    <E>
+                        <CI>222333222</CI>
+                        <CL>
+                            <C>PMT-AD-000003</C>
+                        </CL>
+                    </E>
+                </EL>
+            </SRP>
+        """
+        responses.add(
+            responses.POST,
+            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
+            body=xml_body, status=200, content_type='application/xml'
+        )
+
+        # Execute
+        result = t_queue_pending.run()
+
+        # Check
+        # the first debit is not due yet, the third has run out of attempts
+        self.assertEqual(result, "Queued 1 pending debit(s)")
+
+    @override_settings(DEBIT_CHUNK_SIZE="2")
+    @responses.activate
+    def test_t_queue_pending_chunks(self):
+        """Test that pending debits are submitted in chunks of DEBIT_CHUNK_SIZE"""
+
+        # Setup
+        from .tasks import t_queue_pending
+
+        for reference in ["111222111", "222333222", "333444333"]:
+            Debit.objects.create(
+                account_name="Bobby Ninetoes",
+                account_number="123412341234",
+                branch_code="632005",
+                account_type="current",
+                amount="13500.00",
+                reference=reference,
+                scheduled_at=timezone.now() - timedelta(hours=48),
+            )
+
+        responses.add(
+            responses.POST,
+            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
+            body="<SRP><EL/></SRP>", status=200, content_type='application/xml'
+        )
+
+        # Execute
+        result = t_queue_pending.run()
+
+        # Check
+        self.assertEqual(result, "Queued 3 pending debit(s)")
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(Debit.objects.filter(status="loaded").count(), 3)
+
+    @override_settings(DEBIT_CHUNK_SIZE="2")
+    @responses.activate
+    def test_t_queue_pending_failed_chunk(self):
+        """Test that a chunk failing once it may have been sent stays claimed"""
+
+        # Setup
+        from .tasks import t_queue_pending
+
+        for reference in ["111222111", "222333222", "333444333"]:
+            Debit.objects.create(
+                account_name="Bobby Ninetoes",
+                account_number="123412341234",
+                branch_code="632005",
+                account_type="current",
+                amount="13500.00",
+                reference=reference,
+                scheduled_at=timezone.now() - timedelta(hours=48),
+            )
+
+        url = 'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments'  # noqa
+        responses.add(responses.POST, url, body=ConnectionError("upstream timeout"))
+        responses.add(
+            responses.POST, url,
+            body="<SRP><EL/></SRP>", status=200, content_type='application/xml'
+        )
+
+        # Execute
+        result = t_queue_pending.run()
+
+        # Check
+        self.assertEqual(result, "Queued 1 pending debit(s). Failed to queue 2 debit(s)")
+        self.assertEqual(Debit.objects.filter(status="loaded").count(), 1)
+        # not resubmitted by the next run, the provider may have them
+        self.assertEqual(
+            Debit.objects.filter(status="processing", load_attempts=1).count(), 2)
+
+    @override_settings(DEBIT_LOAD_ATTEMPTS="2")
+    @responses.activate
+    def test_t_queue_pending_stops_at_load_attempts(self):
+        """Test that a debit that was never sent is retried up to DEBIT_LOAD_ATTEMPTS"""
+
+        # Setup
+        from .tasks import t_queue_pending
+
+        debit = Debit.objects.create(
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            account_type="current",
+            amount="13500.00",
+            reference="111222111",
+            scheduled_at=timezone.now() - timedelta(hours=48),
+        )
+
+        responses.add(
+            responses.POST,
+            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
+            body=requests.ConnectTimeout("connect timeout"))
+
+        # Execute
+        results = [t_queue_pending.run() for _ in range(3)]
+
+        # Check
+        self.assertEqual(results, [
+            "Queued 0 pending debit(s). Failed to queue 1 debit(s)",
+            "Queued 0 pending debit(s). Failed to queue 1 debit(s)",
+            "Queued 0 pending debit(s)",
+        ])
+        self.assertEqual(len(responses.calls), 2)
+        debit.refresh_from_db()
+        self.assertEqual(debit.status, "pending")
+        self.assertEqual(debit.load_attempts, 2)
+
+    @override_settings(DEBIT_STATUS_BATCH_SIZE="2")
+    @responses.activate
+    def test_t_check_loaded(self):
+        """Test that loaded debits past their action date are checked in batches"""
+
+        # Setup
+        from .tasks import t_check_loaded
+
+        for reference in ["111222111", "222333222", "333444333"]:
+            Debit.objects.create(
+                account_name="Bobby Ninetoes",
+                account_number="123412341234",
+                branch_code="632005",
+                account_type="current",
+                amount="13500.00",
+                reference=reference,
+                status="loaded",
+                scheduled_at=timezone.now() - timedelta(hours=48),
+            )
+        # not checked, action date still in the future
+        Debit.objects.create(
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            account_type="current",
+            amount="13500.00",
+            reference="444555444",
+            status="loaded",
+            scheduled_at=timezone.now() + timedelta(hours=48),
+        )
+
+        responses.add(
+            responses.POST,
+            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/GetPaymentStatus',  # noqa
+            body="<SRP><SL/><EL/></SRP>", status=200, content_type='application/xml'
+        )
+
+        # Execute
+        result = t_check_loaded.run()
+
+        # Check
+        self.assertEqual(result, "Checked 3 loaded debit(s)")
+        self.assertEqual(len(responses.calls), 2)
+
+    @override_settings(DEBIT_QUEUE_LIMIT="2")
+    @responses.activate
+    def test_t_queue_pending_due_order_and_limit(self):
+        """Test that the earliest due debits are queued first, up to DEBIT_QUEUE_LIMIT"""
+
+        # Setup
+        from .tasks import t_queue_pending
+
+        debits = [Debit.objects.create(
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            account_type="current",
+            amount="13500.00",
+            scheduled_at=timezone.now() - timedelta(hours=hours),
+        ) for hours in [1, 3, 2]]
+
+        responses.add(
+            responses.POST,
+            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
+            body="<SRP><EL/></SRP>", status=200, content_type='application/xml'
+        )
+
+        # Execute
+        result = t_queue_pending.run()
+
+        # Check
+        self.assertEqual(result, "Queued 2 pending debit(s)")
+        self.assertEqual(
+            set(Debit.objects.filter(status="loaded").values_list("id", flat=True)),
+            {debits[1].id, debits[2].id})
+
+
+class TestDebitTasksConcurrent(TransactionTestCase):
+
+    @responses.activate
+    def test_t_queue_pending_concurrent_chunks(self):
+        """Test that chunks are submitted from a worker pool when concurrency > 1"""
+
+        # Setup
+        from .tasks import t_queue_pending
+
+        for reference in ["111222111", "222333222", "333444333"]:
+            Debit.objects.create(
+                account_name="Bobby Ninetoes",
+                account_number="123412341234",
+                branch_code="632005",
+                account_type="current",
+                amount="13500.00",
+                reference=reference,
+                scheduled_at=timezone.now() - timedelta(hours=48),
+            )
+
+        responses.add(
+            responses.POST,
+            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
+            body="<SRP><EL/></SRP>", status=200, content_type='application/xml'
+        )
+
+        # Execute
+        with override_settings(DEBIT_CONFIG=dict(
+                settings.DEBIT_CONFIG, chunk_size=1, concurrency=2)):
+            result = t_queue_pending.run()
+
+        # Check
+        self.assertEqual(result, "Queued 3 pending debit(s)")
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(Debit.objects.filter(status="loaded").count(), 3)
+
+    @responses.activate
+    def test_t_queue_pending_skips_claimed_debits(self):
+        """Test that debits locked by an overlapping run are skipped, not submitted twice"""
+
+        # Setup
+        from .tasks import t_queue_pending
+
+        debits = [Debit.objects.create(
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            account_type="current",
+            amount="13500.00",
+            reference=reference,
+            scheduled_at=timezone.now() - timedelta(hours=48),
+        ) for reference in ["111222111", "222333222", "333444333"]]
+
+        responses.add(
+            responses.POST,
+            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
+            body="<SRP><EL/></SRP>", status=200, content_type='application/xml'
+        )
+
+        # another worker holds the claim on the first debit
+        claimed = threading.Event()
+        release = threading.Event()
+
+        def other_worker():
+            try:
+                with transaction.atomic():
+                    list(Debit.objects.select_for_update().filter(id=debits[0].id))
+                    claimed.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        worker = threading.Thread(target=other_worker)
+        worker.start()
+        claimed.wait(10)
+
+        # Execute
+        try:
+            result = t_queue_pending.run()
+        finally:
+            release.set()
+            worker.join()
+
+        # Check
+        self.assertEqual(result, "Queued 2 pending debit(s)")
+        self.assertEqual(Debit.objects.get(id=debits[0].id).status, "pending")
+        self.assertEqual(Debit.objects.filter(status="loaded").count(), 2)
+
+
+class TestProviderEasyDebit(TestCase):
+
+    @freeze_time("2018-02-13 12:30:00")
+    @responses.activate
+    def test_load_debits_succesful(self):
+        # Setup
+        # setup easydebit provider
+        provider = EasyDebitProvider()
+        provider.config = settings.DEBIT_CONFIG
+        provider.setup_provider()
+
+        # setup response
+        xml_body = """
+            <SRP xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
+                <EL/>
+            </SRP>
+        """
+        responses.add(
+            responses.POST,
+            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
+            body=xml_body, status=200, content_type='application/xml'
+        )
+
+        debit = Debit.objects.create(
+            client="bobby was here",
+            downstream_reference=None,
+            callback_url=None,
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            account_type="current",
+            status="pending",
+            amount="13500.00",
+            reference="111222111",
+            provider=None,
+            provider_reference=None,
+            provider_status=None,
+            scheduled_at=timezone.now() + timedelta(hours=48),
+            loaded_at=None,
+            load_attempts=0,
+            last_error=None
+        )
+
+        # Execute
+        result = provider.load_debits(ids=[str(debit.id)])
+
+        # Check
+        self.assertEqual(result, "Successfully loaded 1 debits. Failed to load 0 debits.")
+
+        debit.refresh_from_db()
+        self.assertEqual(debit.status, "loaded")
+        self.assertEqual(debit.load_attempts, 1)
+        self.assertEqual(debit.last_error, None)
+        self.assertEqual(debit.scheduled_at, timezone.now() + timedelta(hours=48))
+
+    @freeze_time("2018-02-13 12:30:00")
+    @responses.activate
+    def test_load_debits_fail_should_retry(self):
+        # Setup
+        # setup easydebit provider
+        provider = EasyDebitProvider()
+        provider.config = settings.DEBIT_CONFIG
+        provider.setup_provider()
+
+        # setup response
+        xml_body = """
+            <SRP xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
+                <EL>
+                    <E>
+                        <CI>222333222</CI>
+                        <CL>
+                            <C>PMT-AD-000003</C>
+                        </CL>
+                    </E>
+                </EL>
+            </SRP>
+        """
+        responses.add(
+            responses.POST,
+            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
+            body=xml_body, status=200, content_type='application/xml'
+        )
+
+        debit = Debit.objects.create(
+            client="bobby was here",
+            downstream_reference=None,
+            callback_url=None,
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            account_type="current",
+            status="pending",
+            amount="13500.00",
+            reference="222333222",
+            provider=None,
+            provider_reference=None,
+            provider_status=None,
+            scheduled_at=timezone.now() - timedelta(hours=48),
+            loaded_at=None,
+            load_attempts=1,
+            last_error="PMT-AD-0000001"
+        )
+
+        # Execute
+        result = provider.load_debits(ids=[str(debit.id)])
+
+        # Check
+        self.assertEqual(result, "Successfully loaded 0 debits. Failed to load 1 debits.")
+
+        debit.refresh_from_db()
+        self.assertEqual(debit.status, "pending")
+        self.assertEqual(debit.load_attempts, 2)
+        self.assertEqual(debit.last_error, "PMT-AD-000003")
+        self.assertEqual(debit.scheduled_at, timezone.now() + timedelta(hours=48))
+
+    @freeze_time("2018-02-13 12:30:00")
+    @responses.activate
+    def test_load_debits_fail_should_not_retry(self):
+        # Setup
+        # setup easydebit provider
+        provider = EasyDebitProvider()
+        provider.config = settings.DEBIT_CONFIG
+        provider.setup_provider()
+
+        # setup response
+        xml_body = """
+            <SRP xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
+                <EL>
+                    <E>
+                        <CI>222333222</CI>
+                        <CL>
+                            <C>UNKNOWN-ERROR-CODE-01</C>
+                            <C>UNKNOWN-ERROR-CODE-02</C>
+                        </CL>
+                    </E>
+                </EL>
+            </SRP>
+        """
+        responses.add(
+            responses.POST,
+            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
+            body=xml_body, status=200, content_type='application/xml'
+        )
+
+        debit = Debit.objects.create(
+            client="bobby was here",
+            downstream_reference=None,
+            callback_url=None,
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            account_type="current",
+            status="pending",
+            amount="13500.00",
+            reference="222333222",
+            provider=None,
+            provider_reference=None,
+            provider_status=None,
+            scheduled_at=timezone.now() - timedelta(hours=48),
+            loaded_at=None,
+            load_attempts=1,
+            last_error="PMT-AD-0000001"
+        )
+
+        # Execute
+        result = provider.load_debits(ids=[str(debit.id)])
+
+        # Check
+        self.assertEqual(result, "Successfully loaded 0 debits. Failed to load 1 debits.")
+
+        debit.refresh_from_db()
+        self.assertEqual(debit.status, "failed")
+        self.assertEqual(debit.load_attempts, 2)
+        self.assertEqual(debit.last_error, "UNKNOWN-ERROR-CODE-01, UNKNOWN-ERROR-CODE-02")
+        self.assertEqual(debit.scheduled_at, timezone.now() - timedelta(hours=48))
+
+    @freeze_time("2018-02-13 12:30:00")
+    @responses.activate
+    def test_load_debits_success_and_fail(self):
+        # Setup
+        # setup easydebit provider
+        provider = EasyDebitProvider()
+        provider.config = settings.DEBIT_CONFIG
+        provider.setup_provider()
+
+        # setup response
+        xml_body = """
+            <SRP xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
+                <EL>
+                    <E>
+                        <CI>222333222</CI>
+                        <CL>
+                            <C>PMT-AD-000003</C>
+                        </CL>
+                    </E>
+                </EL>
+            </SRP>
+        """
+        responses.add(
+            responses.POST,
+            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
+            body=xml_body, status=200, content_type='application/xml'
+        )
+
+        debit1 = Debit.objects.create(
+            client="bobby was here",
+            downstream_reference=None,
+            callback_url=None,
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            account_type="current",
+            status="pending",
+            amount="13500.00",
+            reference="111222111",
+            provider=None,
+            provider_reference=None,
+            provider_status=None,
+            scheduled_at=timezone.now() + timedelta(hours=48),
+            loaded_at=None,
+            load_attempts=0,
+            last_error=None
+        )
+
+        debit2 = Debit.objects.create(
+            client="bobby was here",
+            downstream_reference=None,
+            callback_url=None,
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            account_type="current",
+            status="pending",
+            amount="13500.00",
+            reference="222333222",
+            provider=None,
+            provider_reference=None,
+            provider_status=None,
+            scheduled_at=timezone.now() - timedelta(hours=48),
+            loaded_at=None,
+            load_attempts=1,
+            last_error="PMT-AD-0000001"
+        )
+
+        # Execute
+        result = provider.load_debits(ids=[str(debit1.id), str(debit2.id)])
+
+        # Check
+        self.assertEqual(result, "Successfully loaded 1 debits. Failed to load 1 debits.")
+
+        debit1.refresh_from_db()
+        self.assertEqual(debit1.status, "loaded")
+        self.assertEqual(debit1.load_attempts, 1)
+        self.assertEqual(debit1.last_error, None)
+        self.assertEqual(debit1.scheduled_at, timezone.now() + timedelta(hours=48))
+
+        debit2.refresh_from_db()
+        self.assertEqual(debit2.status, "pending")
+        self.assertEqual(debit2.load_attempts, 2)
+        self.assertEqual(debit2.last_error, "PMT-AD-000003")
+        self.assertEqual(debit2.scheduled_at, timezone.now() + timedelta(hours=48))
+
+    @freeze_time("2018-02-13 12:30:00")
+    @responses.activate
+    def test_load_debits_query_count_independent_of_batch_size(self):
+        # Setup
+        # setup easydebit provider
+        provider = EasyDebitProvider()
+        provider.config = settings.DEBIT_CONFIG
+        provider.setup_provider()
+
+        # setup response
+        xml_body = """
+            <SRP xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
+                <EL>
+                    <E>
+                        <CI>100000000</CI>
+                        <CL>
+                            <C>PMT-AD-000003</C>
+                        </CL>
+                    </E>
+                </EL>
+            </SRP>
+        """
+        responses.add(
+            responses.POST,
+            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
+            body=xml_body, status=200, content_type='application/xml'
+        )
+
+        def create_debits(count):
+            return [str(Debit.objects.create(
+                account_name="Bobby Ninetoes",
+                account_number="123412341234",
+                branch_code="632005",
+                account_type="current",
+                amount="13500.00",
+                reference="1%08d" % i,
+                scheduled_at=timezone.now() + timedelta(hours=48),
+            ).id) for i in range(count)]
+
+        small_batch = create_debits(2)
+        large_batch = create_debits(25)
+        ContentType.objects.get_for_model(Debit)  # warm the content type cache
+
+        # Execute
+        with CaptureQueriesContext(connection) as small_queries:
+            provider.load_debits(ids=small_batch)
+        with CaptureQueriesContext(connection) as large_queries:
+            result = provider.load_debits(ids=large_batch)
+
+        # Check
+        self.assertEqual(len(small_queries), len(large_queries))
+        self.assertEqual(result, "Successfully loaded 24 debits. Failed to load 1 debits.")
+        self.assertEqual(Debit.objects.filter(id__in=large_batch, status="loaded").count(), 24)
+
+    @freeze_time("2018-02-13 12:30:00")
+    @responses.activate
+    def test_load_debits_records_events(self):
+        # Setup
+        # setup easydebit provider
+        provider = EasyDebitProvider()
+        provider.config = settings.DEBIT_CONFIG
+        provider.setup_provider()
+
+        # setup response
+        xml_body = """
             <SRP xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
-                <EL>
-                    <E>
-                        <CI>222333222</CI>
-                        <CL>
-                            <C>UNKNOWN-ERROR-CODE-01</C>
-                            <C>UNKNOWN-ERROR-CODE-02</C>
-                        </CL>
-                    </E>
-                </EL>
+                <EL/>
             </SRP>
         """
         responses.add(
@@ -473,40 +1881,29 @@ class TestProviderEasyDebit(TestCase):
         )
 
         debit = Debit.objects.create(
-            client="bobby was here",
-            downstream_reference=None,
-            callback_url=None,
             account_name="Bobby Ninetoes",
             account_number="123412341234",
             branch_code="632005",
             account_type="current",
-            status="pending",
             amount="13500.00",
-            reference="222333222",
-            provider=None,
-            provider_reference=None,
-            provider_status=None,
-            scheduled_at=timezone.now() - timedelta(hours=48),
-            loaded_at=None,
-            load_attempts=1,
-            last_error="PMT-AD-0000001"
+            reference="111222111",
+            scheduled_at=timezone.now() + timedelta(hours=48),
         )
 
         # Execute
-        result = provider.load_debits(ids=[str(debit.id)])
+        provider.load_debits(ids=[str(debit.id)])
 
         # Check
-        self.assertEqual(result, "Successfully loaded 0 debits. Failed to load 1 debits.")
-
-        debit.refresh_from_db()
-        self.assertEqual(debit.status, "failed")
-        self.assertEqual(debit.load_attempts, 2)
-        self.assertEqual(debit.last_error, "UNKNOWN-ERROR-CODE-01, UNKNOWN-ERROR-CODE-02")
-        self.assertEqual(debit.scheduled_at, timezone.now() - timedelta(hours=48))
+        events = Event.objects.filter(
+            source_id=debit.id, event_type="model.updated").order_by("created_at")
+        self.assertEqual(
+            [event.event_data["status"] for event in events], ["processing", "loaded"])
+        self.assertEqual(events[0].event_data["load_attempts"], 1)
+        self.assertEqual(events[1].event_data["loaded_at"], timezone.now().isoformat())
 
     @freeze_time("2018-02-13 12:30:00")
     @responses.activate
-    def test_load_debits_success_and_fail(self):
+    def test_check_statuses(self):
         # Setup
         # setup easydebit provider
         provider = EasyDebitProvider()
@@ -516,76 +1913,531 @@ class TestProviderEasyDebit(TestCase):
         # setup response
         xml_body = """
             <SRP xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
-                <EL>
-                    <E>
+                <SL>
+                    <S>
+                        <CI>111222111</CI>
+                        <ST>PAID</ST>
+                    </S>
+                    <S>
                         <CI>222333222</CI>
-                        <CL>
-                            <C>PMT-AD-000003</C>
-                        </CL>
-                    </E>
-                </EL>
+                        <ST>UNPAID</ST>
+                        <D>Insufficient funds</D>
+                    </S>
+                    <S>
+                        <CI>333444333</CI>
+                        <ST>PROCESSING</ST>
+                    </S>
+                </SL>
+                <EL/>
             </SRP>
         """
         responses.add(
             responses.POST,
-            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/SaveOnceOffPayments',  # noqa
+            'https://www.slowdebit.co.za:8888/Services/PaymentService.svc/PartnerServices/GetPaymentStatus',  # noqa
             body=xml_body, status=200, content_type='application/xml'
         )
 
-        debit1 = Debit.objects.create(
-            client="bobby was here",
-            downstream_reference=None,
-            callback_url=None,
+        debits = [Debit.objects.create(
             account_name="Bobby Ninetoes",
             account_number="123412341234",
             branch_code="632005",
             account_type="current",
-            status="pending",
             amount="13500.00",
-            reference="111222111",
-            provider=None,
-            provider_reference=None,
-            provider_status=None,
-            scheduled_at=timezone.now() + timedelta(hours=48),
-            loaded_at=None,
-            load_attempts=0,
-            last_error=None
-        )
+            reference=reference,
+            status="loaded",
+            scheduled_at=timezone.now() - timedelta(hours=48),
+        ) for reference in ["111222111", "222333222", "333444333", "444555444"]]
 
-        debit2 = Debit.objects.create(
-            client="bobby was here",
-            downstream_reference=None,
-            callback_url=None,
+        # Execute
+        result = provider.check_statuses([str(debit.id) for debit in debits])
+
+        # Check
+        self.assertEqual(result, "Checked 4 debits. 1 successful, 1 failed.")
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(responses.calls[0].request.body.count(b"<CI>"), 4)
+
+        for debit in debits:
+            debit.refresh_from_db()
+        self.assertEqual(debits[0].status, "successful")
+        self.assertEqual(debits[0].provider_status, "PAID")
+        self.assertEqual(debits[1].status, "failed")
+        self.assertEqual(debits[1].provider_status, "UNPAID")
+        self.assertEqual(debits[1].last_error, "Insufficient funds")
+        self.assertEqual(debits[2].status, "loaded")
+        self.assertEqual(debits[2].provider_status, "PROCESSING")
+        self.assertEqual(debits[3].status, "loaded")
+        self.assertEqual(debits[3].provider_status, None)
+
+
+class TestSRQWriter(TestCase):
+
+    def test_matches_minidom_pretty_print(self):
+        # Setup
+        from xml.dom import minidom
+        from xml.etree.ElementTree import Element, SubElement, tostring
+        from debits.providers.easydebit.payload import SRQWriter
+
+        fields = [
+            ("CI", "111222111"),
+            ("CR", 'Bobby "Ninetoes" <Smith> & Sons'),
+            ("AT", None),
+            ("IT", None),
+        ]
+        e_root = Element('SRQ')
+        e_credentials = SubElement(e_root, 'CR')
+        SubElement(e_credentials, 'U').text = "uname"
+        SubElement(e_credentials, 'P').text = "hash"
+        se_paymentlist = SubElement(e_root, 'PL')
+        for _ in range(2):
+            e_paymentitem = SubElement(se_paymentlist, 'PI')
+            for tag, text in fields:
+                SubElement(e_paymentitem, tag).text = text
+        expected = minidom.parseString(tostring(e_root, encoding='utf-8')).toprettyxml(
+            indent="  ", encoding="utf-8")
+
+        # Execute
+        writer = SRQWriter("uname", "hash")
+        for _ in range(2):
+            writer.write_payment(fields)
+
+        # Check
+        self.assertEqual(writer.getvalue(), expected)
+
+
+class StubProviderHandler(BaseHTTPRequestHandler):
+    """
+    Local stub of a provider API. Answers 503 to the first `failures` requests
+    and sleeps for `delay` seconds before answering.
+    """
+    protocol_version = "HTTP/1.1"
+    failures = 0
+    delay = 0
+    requests = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        StubProviderHandler.requests.append((self.client_address, body))
+        time.sleep(self.delay)
+        if len(StubProviderHandler.requests) <= self.failures:
+            status, reply = 503, b"unavailable"
+        else:
+            status, reply = 200, b"<SRP><EL/></SRP>"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestProviderSession(TestCase):
+
+    def setUp(self):
+        StubProviderHandler.requests = []
+        StubProviderHandler.failures = 0
+        StubProviderHandler.delay = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubProviderHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:%s/SaveOnceOffPayments" % self.server.server_port
+
+        self.provider = Provider()
+        self.provider.config = {"retries": 2, "retry_backoff": 0, "read_timeout": 1}
+        self.provider.setup_provider()
+
+    def tearDown(self):
+        self.provider.teardown_provider()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_kept_alive(self):
+        # Execute
+        for _ in range(3):
+            self.provider.request("POST", self.url, data=b"<SRQ/>")
+
+        # Check
+        clients = set(client for client, body in StubProviderHandler.requests)
+        self.assertEqual(len(StubProviderHandler.requests), 3)
+        self.assertEqual(len(clients), 1)
+
+    def test_idempotent_requests_are_retried(self):
+        # Setup
+        StubProviderHandler.failures = 2
+
+        # Execute
+        response = self.provider.request("POST", self.url, idempotent=True, data=b"<SRQ/>")
+
+        # Check
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(StubProviderHandler.requests), 3)
+
+    def test_retry_budget_is_bounded(self):
+        # Setup
+        StubProviderHandler.failures = 5
+
+        # Execute
+        response = self.provider.request("POST", self.url, idempotent=True, data=b"<SRQ/>")
+
+        # Check
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(StubProviderHandler.requests), 3)
+
+    def test_non_idempotent_requests_are_not_retried(self):
+        # Setup
+        StubProviderHandler.failures = 1
+
+        # Execute
+        response = self.provider.request("POST", self.url, data=b"<SRQ/>")
+
+        # Check
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(StubProviderHandler.requests), 1)
+
+    def test_read_timeout(self):
+        # Setup
+        StubProviderHandler.delay = 0.5
+        self.provider.config["read_timeout"] = 0.1
+
+        # Execute / Check
+        with self.assertRaises(requests.Timeout):
+            self.provider.request("POST", self.url, data=b"<SRQ/>")
+        self.assertEqual(len(StubProviderHandler.requests), 1)
+
+
+class TestDebitCallbacks(TestCase):
+
+    def make_debit(self, **kwargs):
+        return Debit.objects.create(**dict(dict(
             account_name="Bobby Ninetoes",
             account_number="123412341234",
             branch_code="632005",
             account_type="current",
-            status="pending",
             amount="13500.00",
-            reference="222333222",
-            provider=None,
-            provider_reference=None,
-            provider_status=None,
+            status="loaded",
             scheduled_at=timezone.now() - timedelta(hours=48),
-            loaded_at=None,
-            load_attempts=1,
-            last_error="PMT-AD-0000001"
+        ), **kwargs))
+
+    def test_final_status_queues_callback_once(self):
+        # Setup
+        from .transitions import transition_debits
+        debit = self.make_debit(callback_url="https://client.example.com/hook")
+        no_callback = self.make_debit()
+
+        # Execute
+        transition_debits([debit, no_callback], "successful")
+        transition_debits([debit], "successful")
+
+        # Check
+        callback = DebitCallback.objects.get()
+        self.assertEqual(callback.debit, debit)
+        self.assertEqual(callback.debit_status, "successful")
+        self.assertEqual(callback.url, "https://client.example.com/hook")
+        self.assertEqual(callback.status, "pending")
+
+    @override_settings(CALLBACK_TOKEN_DEBITS="sekret", DEBIT_CALLBACK_BACKOFF="60")
+    @freeze_time("2018-02-13 12:30:00")
+    @responses.activate
+    def test_deliver_callbacks(self):
+        # Setup
+        from .callbacks import deliver_callbacks
+        from .transitions import transition_debits
+        ok = self.make_debit(callback_url="https://ok.example.com/hook")
+        broken = self.make_debit(callback_url="https://broken.example.com/hook")
+        transition_debits([ok, broken], "failed")
+
+        responses.add(responses.POST, "https://ok.example.com/hook", status=200)
+        responses.add(responses.POST, "https://broken.example.com/hook", status=500)
+
+        # Execute
+        result = deliver_callbacks()
+
+        # Check
+        self.assertEqual(result, (1, 1))
+        self.assertEqual(len(responses.calls), 2)
+        request = [call.request for call in responses.calls
+                   if call.request.url == "https://ok.example.com/hook"][0]
+        self.assertEqual(request.headers["Authorization"], "Token sekret")
+        self.assertEqual(json.loads(request.body)["status"], "failed")
+        self.assertEqual(json.loads(request.body)["id"], str(ok.id))
+
+        delivered = DebitCallback.objects.get(debit=ok)
+        self.assertEqual(delivered.status, "delivered")
+        self.assertEqual(delivered.attempts, 1)
+        self.assertEqual(delivered.delivered_at, timezone.now())
+
+        retry = DebitCallback.objects.get(debit=broken)
+        self.assertEqual(retry.status, "pending")
+        self.assertEqual(retry.attempts, 1)
+        self.assertEqual(retry.next_attempt_at, timezone.now() + timedelta(seconds=60))
+
+        # nothing is due again until the backoff has passed
+        self.assertEqual(deliver_callbacks(), (0, 0))
+        self.assertEqual(len(responses.calls), 2)
+
+    @override_settings(DEBIT_CALLBACK_TIMEOUT="10")
+    @freeze_time("2018-02-13 12:30:00")
+    def test_deliver_callbacks_leases_without_transaction(self):
+        # Setup
+        from .callbacks import deliver_callbacks
+        from .transitions import transition_debits
+        debit = self.make_debit(callback_url="https://client.example.com/hook")
+        transition_debits([debit], "successful")
+        main_connection = transaction.get_connection()
+        depth = len(main_connection.atomic_blocks)
+        depths = []
+
+        def crash(deliveries, timeout):
+            depths.append(len(main_connection.atomic_blocks))
+            raise RuntimeError("worker lost")
+
+        # Execute
+        with mock.patch("debits.callbacks._deliver_host", side_effect=crash):
+            with self.assertRaises(RuntimeError):
+                deliver_callbacks()
+
+        # Check
+        # . the claim was committed before delivering
+        self.assertEqual(depths, [depth])
+        # . and leases the callback until its delivery must have ended
+        callback = DebitCallback.objects.get()
+        self.assertEqual(callback.status, "pending")
+        self.assertEqual(callback.next_attempt_at, timezone.now() + timedelta(seconds=20))
+        self.assertEqual(deliver_callbacks(), (0, 0))
+
+    @override_settings(DEBIT_CALLBACK_ATTEMPTS="2", DEBIT_CALLBACK_BACKOFF="0")
+    @responses.activate
+    def test_deliver_callbacks_gives_up(self):
+        # Setup
+        from .tasks import t_deliver_callbacks
+        from .transitions import transition_debits
+        debit = self.make_debit(callback_url="https://broken.example.com/hook")
+        transition_debits([debit], "successful")
+        responses.add(responses.POST, "https://broken.example.com/hook", status=503)
+
+        # Execute
+        result = t_deliver_callbacks.run()
+
+        # Check
+        self.assertEqual(result, "Delivered 0 callback(s). 2 delivery attempt(s) failed")
+        callback = DebitCallback.objects.get()
+        self.assertEqual(callback.status, "failed")
+        self.assertEqual(callback.attempts, 2)
+
+
+class TestDebitReferences(TestCase):
+
+    def test_allocate_debit_references(self):
+        # Setup
+        from debits.models import allocate_debit_references
+        from maguire.utils import luhn_checksum
+
+        # Execute
+        references = allocate_debit_references(500)
+
+        # Check
+        self.assertEqual(len(set(references)), 500)
+        for reference in references:
+            self.assertEqual(len(reference), 9)
+            self.assertEqual(luhn_checksum(reference), 0)
+
+    def test_allocate_skips_existing_references(self):
+        # Setup
+        from debits.models import _reference_from_sequence, allocate_debit_references
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT last_value, is_called FROM debits_debit_reference_seq")
+            last_value, is_called = cursor.fetchone()
+        next_reference = _reference_from_sequence(last_value + 1 if is_called else last_value)
+        existing = Debit.objects.create(
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            amount="13500.00",
+            reference=next_reference,
         )
 
         # Execute
-        result = provider.load_debits(ids=[str(debit1.id), str(debit2.id)])
+        references = allocate_debit_references(3)
 
         # Check
-        self.assertEqual(result, "Successfully loaded 1 debits. Failed to load 1 debits.")
+        self.assertEqual(len(set(references)), 3)
+        self.assertNotIn(existing.reference, references)
 
-        debit1.refresh_from_db()
-        self.assertEqual(debit1.status, "loaded")
-        self.assertEqual(debit1.load_attempts, 1)
-        self.assertEqual(debit1.last_error, None)
-        self.assertEqual(debit1.scheduled_at, timezone.now() + timedelta(hours=48))
+    def test_save_allocates_reference(self):
+        # Execute
+        debit = Debit.objects.create(
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            amount="13500.00",
+        )
 
-        debit2.refresh_from_db()
-        self.assertEqual(debit2.status, "pending")
-        self.assertEqual(debit2.load_attempts, 2)
-        self.assertEqual(debit2.last_error, "PMT-AD-000003")
-        self.assertEqual(debit2.scheduled_at, timezone.now() + timedelta(hours=48))
+        # Check
+        self.assertEqual(len(debit.reference), 9)
+
+
+class TestDebitIndexes(TestCase):
+    """
+    Query plan regression tests, sequential scans are disabled so the planner
+    picks an index whenever one can serve the query even on a tiny table
+    """
+
+    def setUp(self):
+        Debit.objects.create(
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            amount="13500.00",
+            scheduled_at=timezone.now(),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def test_pending_scan_uses_partial_index(self):
+        # Execute
+        plan = Debit.objects.filter(
+            status="pending",
+            load_attempts__lt=int(settings.DEBIT_LOAD_ATTEMPTS),
+            scheduled_at__lte=timezone.now(),
+        ).order_by("scheduled_at")[:100].explain()
+
+        # Check
+        self.assertIn("debit_pending_scheduled_idx", plan)
+
+    def test_loaded_scan_uses_partial_index(self):
+        # Execute
+        plan = Debit.objects.filter(
+            status="loaded",
+            scheduled_at__lte=timezone.now(),
+        ).values("id").explain()
+
+        # Check
+        self.assertIn("debit_loaded_scheduled_idx", plan)
+
+    def test_callback_scan_uses_partial_index(self):
+        # Execute
+        plan = DebitCallback.objects.filter(
+            status="pending", next_attempt_at__lte=timezone.now(),
+        ).order_by("next_attempt_at")[:100].explain()
+
+        # Check
+        self.assertIn("callback_pending_due_idx", plan)
+
+    def test_substring_filters_use_trigram_indexes(self):
+        # Setup
+        from debits.schema import DebitFilter
+
+        for field, index in [
+                ("account_number", "debit_acc_number_trgm_idx"),
+                ("account_name", "debit_acc_name_trgm_idx"),
+                ("reference", "debit_reference_trgm_idx"),
+                ("provider_reference", "debit_prov_ref_trgm_idx"),
+                ("downstream_reference", "debit_down_ref_trgm_idx")]:
+            for lookup in ["icontains", "istartswith"]:
+                # Execute
+                qs = DebitFilter(
+                    {"%s__%s" % (field, lookup): "bob1"}, queryset=Debit.objects.all()).qs
+
+                # Check
+                self.assertIn(index, qs.explain(), "%s__%s" % (field, lookup))
+
+    def test_keyset_pages_use_order_indexes(self):
+        # Setup
+        from maguire.pagination import keyset_filter
+        debit = Debit.objects.get()
+
+        for order, index in [
+                ("created_at", "debit_created_id_idx"),
+                ("-created_at", "debit_created_id_idx"),
+                ("scheduled_at", "debit_scheduled_id_idx")]:
+            name, desc = order.lstrip("-"), order.startswith("-")
+            # Execute
+            qs = Debit.objects.filter(keyset_filter(
+                Debit, [(name, desc), ("id", desc)], [getattr(debit, name), debit.id]
+            )).order_by(order, "-id" if desc else "id")[:10]
+            plan = qs.explain()
+
+            # Check
+            self.assertIn(index, plan, order)
+
+
+class TestDebitCounts(TestCase):
+
+    def setUp(self):
+        for amount in ["1.00", "2.00", "3.00"]:
+            Debit.objects.create(
+                account_name="Bobby Ninetoes",
+                account_number="123412341234",
+                branch_code="632005",
+                amount=amount,
+            )
+
+    def total_count(self, arguments="", strategy=None):
+        result = schema.execute('''
+            query Debits {
+                debits(first: 1%s) {
+                    totalCount%s
+                }
+            }
+        ''' % (", " + arguments if arguments else "",
+               "(strategy: %s)" % (strategy, ) if strategy else ""))
+        self.assertEqual(result.errors, None)
+        return result.data["debits"]["totalCount"]
+
+    def test_total_count_exact(self):
+        self.assertEqual(self.total_count(), 3)
+        self.assertEqual(self.total_count('amount_Gt: "1.00"', "EXACT"), 2)
+
+    def test_total_count_estimate(self):
+        # Setup
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE debits_debit")
+
+        # Execute
+        with CaptureQueriesContext(connection) as queries:
+            unfiltered = self.total_count(strategy="ESTIMATE")
+        filtered = self.total_count('amount_Gt: "1.00"', "ESTIMATE")
+
+        # Check
+        self.assertEqual(unfiltered, 3)
+        self.assertFalse(any("COUNT(*)" in query["sql"] for query in queries.captured_queries))
+        self.assertGreaterEqual(filtered, 1)
+
+    def test_total_count_without_permission(self):
+        # Setup
+        request = types.SimpleNamespace(user=AnonymousUser())
+
+        # Execute
+        for strategy in ["EXACT", "ESTIMATE", "CACHED"]:
+            result = schema.execute(
+                "query { debits(first: 1) { totalCount(strategy: %s) } }" % (strategy, ),
+                context_value=request)
+
+            # Check
+            self.assertEqual(result.errors, None)
+            self.assertEqual(result.data["debits"]["totalCount"], 0)
+
+    def test_total_count_of_list(self):
+        # Execute
+        root = types.SimpleNamespace(iterable=list(Debit.objects.all()))
+
+        # Check
+        self.assertEqual(CountableConnection.resolve_total_count(root, None), 3)
+
+    def test_total_count_cached(self):
+        # Setup
+        from django.core.cache import cache
+        cache.clear()
+        self.assertEqual(self.total_count(strategy="CACHED"), 3)
+        Debit.objects.create(
+            account_name="Bobby Ninetoes",
+            account_number="123412341234",
+            branch_code="632005",
+            amount="4.00",
+        )
+
+        # Execute / Check
+        # . the cached count is reused, other filters are counted separately
+        self.assertEqual(self.total_count(strategy="CACHED"), 3)
+        self.assertEqual(self.total_count('amount_Gt: "1.00"', "CACHED"), 3)
+        self.assertEqual(self.total_count(strategy="EXACT"), 4)
@@ -0,0 +1,96 @@
+"""
+Set-based status transitions for debits
+
+Moves whole sets of debits between statuses with a handful of queries rather
+than a ``save()`` per debit, while still writing the ``model.updated`` Events
+(and the history, see debits.history) that a save would.
+
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from events.models import Event
+from events.writer import write_events
+from maguire.serialization import RowSerializer
+
+from .callbacks import queue_callbacks
+from .history import record_history
+from .models import Debit
+
+
+BATCH_SIZE = 1000
+
+
+def _record_transitions(debits, fields, user=None):
+    """
+    Writes one model.updated Event per debit containing the new values of
+    fields, records the change with the history backend and queues
+    callbacks for debits that reached a final status.
+    """
+    source_model = ContentType.objects.get_for_model(Debit)
+    event_at = timezone.now()
+    serializer = RowSerializer(Debit, fields)
+    write_events([
+        Event(
+            source_model=source_model,
+            source_id=debit.id,
+            event_at=event_at,
+            event_type="model.updated",
+            event_data=serializer.instance_data(debit),
+            created_by=user,
+        ) for debit in debits
+    ])
+
+    for debit in debits:
+        # a later save() needn't write them again
+        debit.mark_clean(list(fields) + ["updated_at"])
+    record_history(debits, fields, getattr(user, "pk", None))
+
+    if "status" in fields:
+        queue_callbacks(debits)
+
+
+def transition_debits(debits, status, increment_attempts=False, user=None, **fields):
+    """
+    Moves debits to status, setting the same value for every keyword field,
+    with a single UPDATE. The in-memory instances are updated to match.
+    """
+    debits = list(debits)
+    if not debits:
+        return 0
+
+    values = dict(fields, status=status, updated_at=timezone.now())
+    for debit in debits:
+        for field, value in values.items():
+            setattr(debit, field, value)
+        if increment_attempts:
+            debit.load_attempts = debit.load_attempts + 1
+    if increment_attempts:
+        values["load_attempts"] = F("load_attempts") + 1
+
+    with transaction.atomic():
+        updated = Debit.objects.filter(id__in=[debit.id for debit in debits]).update(**values)
+        _record_transitions(debits, [field for field in values if field != "updated_at"], user)
+    return updated
+
+
+def apply_debit_transitions(debits, fields, user=None):
+    """
+    Writes fields for debits whose values were already set per instance (e.g.
+    a different status or last_error on each) using bulk_update.
+    """
+    debits = list(debits)
+    if not debits:
+        return 0
+
+    updated_at = timezone.now()
+    for debit in debits:
+        debit.updated_at = updated_at
+
+    with transaction.atomic():
+        updated = Debit.objects.bulk_update(
+            debits, list(fields) + ["updated_at"], batch_size=BATCH_SIZE)
+        _record_transitions(debits, fields, user)
+    return updated
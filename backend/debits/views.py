@@ -1 +1,63 @@
-# Create your views here.
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from rest_framework import status
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rolepermissions.checkers import has_permission
+
+from .history import EVENTS, REVERSION
+from .imports import FORMATS, guess_format, import_debits
+
+
+class DebitImportView(APIView):
+    """
+    Imports an uploaded CSV or NDJSON debit file, posted as the multipart
+    field "file". The format is taken from the "format" field or the file
+    extension. Rejected rows are saved to storage and linked in the response.
+
+    The request isn't wrapped in a revision, so each batch commits on its
+    own, and reversion snapshots, which would be held in memory until the
+    upload is done, are replaced by the Events.
+    """
+    parser_classes = (MultiPartParser, )
+    creates_revision = False
+
+    def post(self, request):
+        if not (has_permission(request.user, 'create_all') or
+                has_permission(request.user, 'create_debit')):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"file": ["No file was submitted."]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        format = request.data.get("format") or guess_format(upload.name)
+        if format not in FORMATS:
+            return Response({"format": ["Expected one of %s." % (", ".join(FORMATS), )]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        history = settings.DEBIT_BULK_HISTORY_BACKEND
+        if history == REVERSION:
+            history = EVENTS
+
+        with tempfile.TemporaryFile(mode="w+") as rejects:
+            imported, rejected = import_debits(
+                upload.file, format, user=request.user, rejects=rejects, history=history)
+            rejects_url = None
+            if rejected:
+                rejects.seek(0)
+                name = default_storage.save(
+                    "debits/imports/rejects-%s.ndjson" % (uuid.uuid4(), ), File(rejects))
+                rejects_url = default_storage.url(name)
+
+        return Response({
+            "imported": imported,
+            "rejected": rejected,
+            "rejects_url": rejects_url,
+        })
@@ -1,9 +1,12 @@
 from django.contrib import admin
+
+from maguire.admin import AppModelAdmin
+
 from .models import Event
 
 
 @admin.register(Event)
-class EventAdmin(admin.ModelAdmin):
+class EventAdmin(AppModelAdmin):
     list_display = [
         "id", "source_model", "source_id", "event_at", "event_type",
         "created_at", "updated_at",
@@ -16,6 +19,8 @@ class EventAdmin(admin.ModelAdmin):
     search_fields = [
         "source_id", "event_at"
     ]
+    # event_at is the partition key, ordering by it lets PostgreSQL read
+    # the newest partitions first and stop early
     ordering = [
-        "-created_at"
+        "-event_at"
     ]
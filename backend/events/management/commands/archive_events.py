@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from events.partitions import archive_partitions
+from maguire.utils import load_s3_client
+
+
+class Command(BaseCommand):
+    help = ("Archives monthly events partitions older than the retention period to S3 "
+            "as gzipped NDJSON, then drops them")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retention-months", type=int,
+            help="Months of events to keep, EVENTS_RETENTION_MONTHS by default")
+        parser.add_argument(
+            "--bucket", help="S3 bucket, EVENTS_ARCHIVE_BUCKET by default")
+        parser.add_argument(
+            "--prefix", help="S3 key prefix, EVENTS_ARCHIVE_PREFIX by default")
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Only list the partitions that would be archived")
+
+    def handle(self, *args, **options):
+        retention_months = options["retention_months"]
+        if retention_months is None:
+            retention_months = int(settings.EVENTS_RETENTION_MONTHS)
+        archived = archive_partitions(
+            None if options["dry_run"] else load_s3_client(),
+            options["bucket"] or settings.EVENTS_ARCHIVE_BUCKET,
+            options["prefix"] or settings.EVENTS_ARCHIVE_PREFIX,
+            retention_months,
+            dry_run=options["dry_run"])
+        for name, rows in archived:
+            self.stdout.write("%s %s (%s events)" % (
+                "Would archive" if options["dry_run"] else "Archived", name, rows))
+        self.stdout.write("%s %s partition(s)" % (
+            "Would archive" if options["dry_run"] else "Archived", len(archived)))
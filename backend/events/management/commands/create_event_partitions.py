@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from events.partitions import ensure_partitions
+
+
+class Command(BaseCommand):
+    help = "Creates the monthly events partitions for this month and the next few"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months-ahead", type=int,
+            help="Months after this one to create, EVENTS_PARTITION_MONTHS_AHEAD by default")
+
+    def handle(self, *args, **options):
+        months_ahead = options["months_ahead"]
+        if months_ahead is None:
+            months_ahead = int(settings.EVENTS_PARTITION_MONTHS_AHEAD)
+        created = ensure_partitions(months_ahead)
+        for name in created:
+            self.stdout.write("Created %s" % (name, ))
+        self.stdout.write("Created %s partition(s)" % (len(created), ))
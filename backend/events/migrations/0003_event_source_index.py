@@ -0,0 +1,17 @@
+# Generated by Django 4.2.21 on 2026-10-17 22:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0002_alter_event_event_data'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['source_model', 'source_id', 'event_at'], name='event_source_idx'),
+        ),
+    ]
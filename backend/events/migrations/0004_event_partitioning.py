@@ -0,0 +1,102 @@
+# Generated by Django 4.2.21 on 2026-10-17 22:28
+
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+
+from events.partitions import add_months, create_partition, month_start
+
+
+MONTHS_AHEAD = 3
+
+# Indexes and foreign keys of events_event, named as Django created them
+INDEXES = [
+    ("event_source_idx", "(source_model_id, source_id, event_at)"),
+    ("events_event_created_by_id_2c28ea90", "(created_by_id)"),
+    ("events_event_source_model_id_34b2dc38", "(source_model_id)"),
+    ("events_event_updated_by_id_32549284", "(updated_by_id)"),
+]
+FOREIGN_KEYS = [
+    ("events_event_created_by_id_2c28ea90_fk_auth_user_id",
+     "created_by_id", "auth_user"),
+    ("events_event_source_model_id_34b2dc38_fk_django_content_type_id",
+     "source_model_id", "django_content_type"),
+    ("events_event_updated_by_id_32549284_fk_auth_user_id",
+     "updated_by_id", "auth_user"),
+]
+
+
+def _replace_table(cursor, old_name, partitioned):
+    """
+    Renames events_event to old_name and creates a new events_event, with
+    the same columns, indexes and foreign keys, partitioned or not
+    """
+    cursor.execute("ALTER TABLE events_event RENAME TO %s" % (old_name, ))
+    cursor.execute("ALTER TABLE %s RENAME CONSTRAINT events_event_pkey TO %s_pkey" % (
+        old_name, old_name))
+    for name, _ in INDEXES:
+        cursor.execute("ALTER INDEX %s RENAME TO %s_%s" % (name, old_name, name[-8:]))
+
+    if partitioned:
+        cursor.execute(
+            "CREATE TABLE events_event (LIKE %s INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (event_at)" % (old_name, ))
+        # a partitioned table's primary key must include the partition key
+        cursor.execute(
+            "ALTER TABLE events_event ADD CONSTRAINT events_event_pkey "
+            "PRIMARY KEY (id, event_at)")
+    else:
+        cursor.execute("CREATE TABLE events_event (LIKE %s INCLUDING DEFAULTS)" % (old_name, ))
+        cursor.execute(
+            "ALTER TABLE events_event ADD CONSTRAINT events_event_pkey PRIMARY KEY (id)")
+    for name, columns in INDEXES:
+        cursor.execute("CREATE INDEX %s ON events_event %s" % (name, columns))
+    for name, column, table in FOREIGN_KEYS:
+        cursor.execute(
+            "ALTER TABLE events_event ADD CONSTRAINT %s FOREIGN KEY (%s) REFERENCES %s (id) "
+            "DEFERRABLE INITIALLY DEFERRED" % (name, column, table))
+
+
+def partition_events(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        _replace_table(cursor, "events_event_unpartitioned", partitioned=True)
+        cursor.execute("CREATE TABLE events_event_default PARTITION OF events_event DEFAULT")
+
+        # monthly partitions from the first event up to a few months ahead
+        cursor.execute("SELECT min(event_at) FROM events_event_unpartitioned")
+        now = datetime.now(timezone.utc)
+        first_event_at = cursor.fetchone()[0] or now
+        month = month_start(first_event_at)
+        last = add_months(month_start(now), MONTHS_AHEAD)
+        while month <= last:
+            create_partition(cursor, month)
+            month = add_months(month, 1)
+
+        cursor.execute("INSERT INTO events_event SELECT * FROM events_event_unpartitioned")
+        # check the deferred foreign keys now, later DDL can't run with them pending
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        cursor.execute("DROP TABLE events_event_unpartitioned")
+
+
+def unpartition_events(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        _replace_table(cursor, "events_event_partitioned", partitioned=False)
+        cursor.execute("INSERT INTO events_event SELECT * FROM events_event_partitioned")
+        # check the deferred foreign keys now, later DDL can't run with them pending
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        cursor.execute("DROP TABLE events_event_partitioned CASCADE")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0003_event_source_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_events, unpartition_events),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['-event_at'], name='event_at_idx'),
+        ),
+    ]
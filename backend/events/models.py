@@ -3,7 +3,7 @@ from django.utils.timezone import now
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models, transaction
+from django.db import models
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
@@ -43,6 +43,19 @@ class Event(AppModel):
         on_delete=models.CASCADE)
     user = property(lambda self: self.created_by)
 
+    class Meta:
+        # The table is partitioned by month of event_at at the database level
+        # (events/partitions.py), its primary key there is (id, event_at)
+        indexes = [
+            # recent events first, e.g. the admin changelist and the events
+            # connection's keyset pagination
+            models.Index(fields=["-event_at", "-id"], name="event_at_id_idx"),
+            # event history of an object, e.g. EventFilter source_model + source_id
+            models.Index(
+                fields=["source_model", "source_id", "event_at"],
+                name="event_source_idx"),
+        ]
+
     @property
     def node_id(self):
         from maguire.utils import b64_from_uuid
@@ -52,18 +65,8 @@ class Event(AppModel):
         """
         Prepares this Event for JSON serialization
         """
-        return {
-            'id': str(self.id),
-            'source_model': self.source_model.id if self.source_model else None,  # noqa
-            'source_id': str(self.source_id) if self.source_id else None,
-            'event_at': self.event_at.isoformat(),
-            'event_type': self.event_type,
-            'event_data': self.event_data,
-            'created_at': self.created_at.isoformat(),
-            'created_by': self.created_by.id if self.created_by else None,
-            'updated_at': self.updated_at.isoformat(),
-            'updated_by': self.updated_by.id if self.updated_by else None,
-        }
+        from events.serialization import event_serializer
+        return event_serializer.instance_data(self)
 
     def __str__(self):
         return str(self.id)
@@ -71,14 +74,12 @@ class Event(AppModel):
 
 @receiver(post_save, sender=Event)
 def event_post_save(sender, instance, created, **kwargs):
-    """ Post save hook that fires tasks based on the created event type
+    """ Post save hook that fires tasks based on the created event type and
+    invalidates cached GraphQL results. Events written with events.writer
+    are handled in batches there.
     """
-    from events import tasks
+    from events.writer import dispatch_event_tasks
+    from maguire.response_cache import invalidate_responses
     if created:
-        def run_task_event_type():
-            try:
-                getattr(tasks, instance.event_type.replace(".", "_")
-                        ).apply_async(kwargs={"event_id": instance.id})
-            except Exception:
-                pass
-        transaction.on_commit(run_task_event_type)
+        dispatch_event_tasks([instance])
+        invalidate_responses([instance])
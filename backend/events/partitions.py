@@ -0,0 +1,172 @@
+"""
+Monthly partitions of the events table
+
+events_event is partitioned by range of event_at, one partition per calendar
+month (events_event_pYYYYMM, UTC) plus a default partition that catches
+events outside the months created so far. Partitions are created ahead of
+time and, once older than the retention period, archived to S3 as gzipped
+NDJSON and dropped, which keeps the hot table small.
+
+Only plain SQL is used here (no models) so migrations can use it too.
+
+"""
+from datetime import date, datetime, timezone as dt_timezone
+import gzip
+import re
+import tempfile
+
+from django.db import connection, transaction
+
+
+EVENT_TABLE = "events_event"
+DEFAULT_PARTITION = "events_event_default"
+PARTITION_NAME = re.compile(r"^events_event_p(\d{4})(\d{2})$")
+ARCHIVE_FETCH_SIZE = 2000
+
+
+def month_start(value):
+    """
+    Returns the first day of value's month, in UTC for datetimes
+    """
+    if isinstance(value, datetime):
+        value = value.astimezone(dt_timezone.utc)
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return "events_event_p%04d%02d" % (month.year, month.month)
+
+
+def _bound(month):
+    # the partition bounds are literals, DDL can't take parameters
+    return "'%s 00:00:00+00'" % (month.isoformat(), )
+
+
+def list_partitions(cursor):
+    """
+    Returns (month, name) for each monthly partition, oldest first
+    """
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass", [EVENT_TABLE])
+    partitions = []
+    for (name, ) in cursor.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((date(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(partitions)
+
+
+def create_partition(cursor, month):
+    """
+    Creates the partition for month, unless it exists, moving any of the
+    month's events out of the default partition into it. Returns whether a
+    partition was created.
+    """
+    name = partition_name(month)
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    if cursor.fetchone()[0] is not None:
+        return False
+    start, end = _bound(month), _bound(add_months(month, 1))
+    cursor.execute('CREATE TABLE "%s" (LIKE %s INCLUDING DEFAULTS)' % (name, EVENT_TABLE))
+    cursor.execute(
+        'WITH moved AS (DELETE FROM %s WHERE event_at >= %s AND event_at < %s RETURNING *) '
+        'INSERT INTO "%s" SELECT * FROM moved' % (DEFAULT_PARTITION, start, end, name))
+    cursor.execute('ALTER TABLE %s ATTACH PARTITION "%s" FOR VALUES FROM (%s) TO (%s)' % (
+        EVENT_TABLE, name, start, end))
+    return True
+
+
+def ensure_partitions(months_ahead, now=None):
+    """
+    Creates the partitions for the current month and the months_ahead
+    months after it. Returns the names of the partitions created.
+    """
+    first = month_start(now or datetime.now(dt_timezone.utc))
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for months in range(months_ahead + 1):
+            month = add_months(first, months)
+            if create_partition(cursor, month):
+                created.append(partition_name(month))
+    return created
+
+
+def archive_key(prefix, name):
+    return "%s%s.ndjson.gz" % (prefix, name)
+
+
+def export_partition(name, fileobj):
+    """
+    Streams the rows of partition name into fileobj as gzipped NDJSON, one
+    JSON object per event, with a server-side cursor. Returns the number of
+    rows written.
+    """
+    rows = 0
+    with gzip.GzipFile(fileobj=fileobj, mode="wb") as archive:
+        with transaction.atomic(), connection.chunked_cursor() as cursor:
+            cursor.execute('SELECT row_to_json(e)::text FROM "%s" e ORDER BY event_at' % (name, ))
+            while True:
+                batch = cursor.fetchmany(ARCHIVE_FETCH_SIZE)
+                if not batch:
+                    break
+                for (line, ) in batch:
+                    archive.write(line.encode("utf-8") + b"\n")
+                rows += len(batch)
+    return rows
+
+
+def drop_partition(name, expected_rows=None):
+    """
+    Detaches partition name from the events table and drops it. With
+    expected_rows the partition is only dropped if it still holds exactly
+    that many rows, i.e. nothing was written to it after it was archived.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        # DDL can't run while deferred foreign key checks are pending
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        if expected_rows is not None:
+            cursor.execute('LOCK TABLE "%s" IN ACCESS EXCLUSIVE MODE' % (name, ))
+            cursor.execute('SELECT count(*) FROM "%s"' % (name, ))
+            rows = cursor.fetchone()[0]
+            if rows != expected_rows:
+                raise ValueError("%s holds %s rows but %s were archived, not dropping it" % (
+                    name, rows, expected_rows))
+        cursor.execute('ALTER TABLE %s DETACH PARTITION "%s"' % (EVENT_TABLE, name))
+        cursor.execute('DROP TABLE "%s"' % (name, ))
+
+
+def archive_partitions(s3, bucket, prefix, retention_months, now=None, dry_run=False):
+    """
+    Archives every monthly partition that ended more than retention_months
+    months ago to s3://bucket/prefix<name>.ndjson.gz and then drops it. A
+    partition is only dropped once its archive is uploaded. Returns
+    (name, rows) for each partition archived.
+    """
+    cutoff = add_months(month_start(now or datetime.now(dt_timezone.utc)), -retention_months)
+    with connection.cursor() as cursor:
+        partitions = [name for month, name in list_partitions(cursor) if month < cutoff]
+
+    archived = []
+    for name in partitions:
+        if dry_run:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT count(*) FROM "%s"' % (name, ))
+                archived.append((name, cursor.fetchone()[0]))
+            continue
+        with tempfile.TemporaryFile() as fileobj:
+            rows = export_partition(name, fileobj)
+            fileobj.seek(0)
+            s3.upload_fileobj(fileobj, bucket, archive_key(prefix, name), ExtraArgs={
+                "ContentType": "application/x-ndjson",
+                "ContentEncoding": "gzip",
+                "Metadata": {"rows": str(rows)},
+            })
+        drop_partition(name, expected_rows=rows)
+        archived.append((name, rows))
+    return archived
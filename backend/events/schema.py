@@ -4,13 +4,14 @@ from graphene import relay, String, Field, Int
 from graphene.types.datetime import DateTime
 from graphene.types.json import JSONString
 from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField
 from django_filters import OrderingFilter
-from rolepermissions.verifications import has_permission
+from rolepermissions.checkers import has_permission
 
 from .models import Event
 
-from maguire.utils import get_node_with_permission, schema_get_mutation_data
+from maguire.loaders import select_related_for
+from maguire.pagination import KeysetConnectionField
+from maguire.utils import CountableConnection, get_node_with_permission, schema_get_mutation_data
 
 
 class EventFilter(django_filters.FilterSet):
@@ -23,7 +24,7 @@ class EventFilter(django_filters.FilterSet):
             'event_type': ['exact'],
         }
 
-    order_by = OrderingFilter(fields=['created_at'])
+    order_by = OrderingFilter(fields=['created_at', 'event_at'])
 
 
 class EventNode(DjangoObjectType):
@@ -31,6 +32,7 @@ class EventNode(DjangoObjectType):
         model = Event
         filterset_class = EventFilter
         interfaces = (relay.Node, )
+        connection_class = CountableConnection
 
     @classmethod
     def get_node(cls, info, id):
@@ -50,7 +52,7 @@ class EventMutation(relay.ClientIDMutation):
     event = Field(EventNode)
 
     @classmethod
-    def mutate_and_get_payload(cls, input, context, info):
+    def mutate_and_get_payload(cls, root, info, **input):
         fk_fields = ["source_model"]
         non_fk_fields = ["source_id", "event_at", "event_type", "event_data"]
 
@@ -59,7 +61,7 @@ class EventMutation(relay.ClientIDMutation):
         else:  # create new
             # Gather mutation data
             mutation_data = schema_get_mutation_data(
-                fk_fields, non_fk_fields, input, context, update=False)
+                fk_fields, non_fk_fields, input, info.context, update=False)
             # Create the model
             event = Event.objects.create(**mutation_data)
         return EventMutation(event=event)
@@ -67,18 +69,20 @@ class EventMutation(relay.ClientIDMutation):
 
 class Query(object):
     event = relay.Node.Field(EventNode)
-    events = DjangoFilterConnectionField(EventNode)
+    # newest first by default, event_at is the partition key
+    events = KeysetConnectionField(EventNode, default_order="-event_at")
 
     def resolve_events(self, info, **args):
+        queryset = select_related_for(Event.objects.all(), info)
         if info.context is not None:
             if info.context.user.is_authenticated and (
                     has_permission(info.context.user, 'list_all') or
                     has_permission(info.context.user, 'list_events')):
-                return EventFilter(args, queryset=Event.objects.all()).qs
+                return EventFilter(args, queryset=queryset).qs
             else:
                 return Event.objects.none()
         else:  # Not a HTTP request - no permissions testing currently
-            return EventFilter(args, queryset=Event.objects.all()).qs
+            return EventFilter(args, queryset=queryset).qs
 
 
 class Mutation(object):
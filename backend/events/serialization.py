@@ -0,0 +1,15 @@
+"""
+The JSON representation of an event (see maguire.serialization)
+
+"""
+from maguire.serialization import RowSerializer
+
+from .models import Event
+
+
+EVENT_FIELDS = [
+    "id", "source_model", "source_id", "event_at", "event_type", "event_data",
+    "created_at", "created_by", "updated_at", "updated_by",
+]
+
+event_serializer = RowSerializer(Event, EVENT_FIELDS)
@@ -1,7 +1,11 @@
+from django.conf import settings
+
 from celery import Task
 from celery.utils.log import get_task_logger
 
 from maguire.celery import app
+from maguire.utils import load_s3_client
+from .partitions import archive_partitions, ensure_partitions
 
 
 class DebitBatchCompleted(Task):
@@ -10,10 +14,35 @@ class DebitBatchCompleted(Task):
     name = "maguire.events.tasks.debit_batch_completed"
     tl = get_task_logger(__name__)
 
-    def run(self, event_id, **kwargs):
+    def run(self, event_ids=None, event_id=None, **kwargs):
+        # event_ids holds every debit.batch_completed Event of one batch,
+        # event_id is still accepted from tasks queued before batching
         # trigger hook
         return "debit_batch_completed fired"
 
 
 app.register_task(DebitBatchCompleted)
 debit_batch_completed = DebitBatchCompleted()
+
+
+class MaintainEventPartitions(Task):
+    """
+    Task that creates the upcoming monthly events partitions and archives
+    (to S3) and drops the ones past the retention period
+    """
+    name = "maguire.events.tasks.maintain_event_partitions"
+    tl = get_task_logger(__name__)
+
+    def run(self, **kwargs):
+        created = ensure_partitions(int(settings.EVENTS_PARTITION_MONTHS_AHEAD))
+        self.tl.info(". Created partitions %s" % (created, ))
+        archived = archive_partitions(
+            load_s3_client(), settings.EVENTS_ARCHIVE_BUCKET, settings.EVENTS_ARCHIVE_PREFIX,
+            int(settings.EVENTS_RETENTION_MONTHS))
+        self.tl.info(". Archived partitions %s" % (archived, ))
+        return "Created {} partition(s). Archived {} partition(s)".format(
+            len(created), len(archived))
+
+
+app.register_task(MaintainEventPartitions)
+maintain_event_partitions = MaintainEventPartitions()
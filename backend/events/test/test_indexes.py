@@ -0,0 +1,33 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase
+
+from events.models import Event
+
+
+class TestEventIndexes(TestCase):
+    """
+    Query plan regression tests, sequential scans are disabled so the planner
+    picks an index whenever one can serve the query even on a tiny table
+    """
+
+    def setUp(self):
+        self.source_model = ContentType.objects.get(app_label='debits', model='debit')
+        self.event = Event.objects.create(
+            source_model=self.source_model,
+            event_type="model.created",
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def test_source_history_uses_source_index(self):
+        # Execute
+        plan = Event.objects.filter(
+            source_model=self.source_model,
+            source_id=self.event.id,
+        ).order_by("event_at").explain()
+
+        # Check
+        # each monthly partition has its own copy of event_source_idx
+        self.assertIn("source_model_id_source_id_event_at_idx", plan)
+        self.assertNotIn("Seq Scan", plan)
@@ -0,0 +1,100 @@
+from datetime import date, datetime, timezone
+import gzip
+import io
+import json
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+
+from events.models import Event
+from events.partitions import (
+    archive_partitions, create_partition, ensure_partitions, list_partitions
+)
+
+
+def partition_of(event):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT tableoid::regclass::text FROM events_event WHERE id = %s", [event.id])
+        return cursor.fetchone()[0]
+
+
+class TestEventPartitions(TestCase):
+
+    def test_events_stored_in_month_partition(self):
+        # Setup
+        ensure_partitions(0)
+
+        # Execute
+        event = Event.objects.create(event_type="client.terminated")
+
+        # Check
+        self.assertEqual(partition_of(event), "events_event_p%s" % (
+            event.event_at.astimezone(timezone.utc).strftime("%Y%m"), ))
+
+    def test_ensure_partitions_moves_events_from_default(self):
+        # Setup
+        event = Event.objects.create(
+            event_type="client.terminated",
+            event_at=datetime(2031, 2, 14, 9, 0, tzinfo=timezone.utc))
+        self.assertEqual(partition_of(event), "events_event_default")
+
+        # Execute
+        created = ensure_partitions(2, now=datetime(2031, 1, 20, tzinfo=timezone.utc))
+
+        # Check
+        self.assertEqual(
+            created, ["events_event_p203101", "events_event_p203102", "events_event_p203103"])
+        self.assertEqual(partition_of(event), "events_event_p203102")
+        # . creating them again does nothing
+        self.assertEqual(ensure_partitions(2, now=datetime(2031, 1, 20, tzinfo=timezone.utc)), [])
+
+    def test_archive_partitions(self):
+        # Setup
+        with connection.cursor() as cursor:
+            create_partition(cursor, date(2020, 1, 1))
+        old = [Event.objects.create(
+            event_type="client.terminated", event_data={"i": i},
+            event_at=datetime(2020, 1, 10 + i, tzinfo=timezone.utc)) for i in range(3)]
+        recent = Event.objects.create(event_type="client.terminated")
+        uploads = {}
+        s3 = mock.Mock()
+        s3.upload_fileobj.side_effect = lambda fileobj, bucket, key, ExtraArgs: uploads.update(
+            {(bucket, key): fileobj.read()})
+
+        # Execute
+        archived = archive_partitions(
+            s3, "archive-bucket", "events/archive/", 12,
+            now=datetime(2021, 3, 1, tzinfo=timezone.utc))
+
+        # Check
+        self.assertEqual(archived, [("events_event_p202001", 3)])
+        lines = gzip.decompress(
+            uploads[("archive-bucket", "events/archive/events_event_p202001.ndjson.gz")]
+        ).decode("utf-8").splitlines()
+        self.assertEqual(
+            [json.loads(line)["id"] for line in lines], [str(event.id) for event in old])
+        self.assertEqual([json.loads(line)["event_data"] for line in lines],
+                         [{"i": 0}, {"i": 1}, {"i": 2}])
+        # . the partition and its events are gone, the rest are untouched
+        with connection.cursor() as cursor:
+            self.assertNotIn(
+                "events_event_p202001", [name for _, name in list_partitions(cursor)])
+        self.assertEqual(list(Event.objects.values_list("id", flat=True)), [recent.id])
+
+    def test_archive_events_dry_run(self):
+        # Setup
+        with connection.cursor() as cursor:
+            create_partition(cursor, date(2020, 1, 1))
+        Event.objects.create(
+            event_type="client.terminated", event_at=datetime(2020, 1, 10, tzinfo=timezone.utc))
+        out = io.StringIO()
+
+        # Execute
+        call_command("archive_events", dry_run=True, stdout=out)
+
+        # Check
+        self.assertIn("Would archive events_event_p202001 (1 events)", out.getvalue())
+        self.assertEqual(Event.objects.count(), 1)
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta, timezone
+
+import graphene
+from django.db import connection
+from django.test import TestCase
+
+import events.schema
+from events.models import Event
+from maguire.pagination import estimate_count
+
+
+class Query(events.schema.Query, graphene.ObjectType):
+    pass
+
+
+schema = graphene.Schema(query=Query)
+
+
+class TestEventsConnection(TestCase):
+
+    def setUp(self):
+        start = datetime(2018, 2, 1, tzinfo=timezone.utc)
+        for day in range(3):
+            Event.objects.create(
+                event_type="client.terminated", event_data={"day": day},
+                event_at=start + timedelta(days=day))
+
+    def page(self, arguments):
+        result = schema.execute('''
+            query Events {
+                events(%s) {
+                    totalCount
+                    pageInfo { hasNextPage endCursor }
+                    edges { node { eventData } }
+                }
+            }
+        ''' % (arguments, ))
+        self.assertEqual(result.errors, None)
+        return result.data["events"]
+
+    def test_events_newest_first_by_keyset(self):
+        # Execute
+        first = self.page("first: 2")
+        second = self.page('first: 2, after: "%s"' % first["pageInfo"]["endCursor"])
+
+        # Check
+        self.assertEqual(first["totalCount"], 3)
+        self.assertTrue(first["pageInfo"]["hasNextPage"])
+        self.assertEqual(
+            [edge["node"]["eventData"] for edge in first["edges"] + second["edges"]],
+            ['{"day": 2}', '{"day": 1}', '{"day": 0}'])
+        self.assertFalse(second["pageInfo"]["hasNextPage"])
+
+    def test_events_estimate_counts_partitions_once(self):
+        # Setup
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE events_event")
+
+        # Execute
+        count = estimate_count(Event.objects.all())
+
+        # Check
+        # . the partitioned parent's reltuples isn't added to its partitions'
+        self.assertEqual(count, 3)
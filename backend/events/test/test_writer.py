@@ -0,0 +1,68 @@
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from events.models import Event
+from events.writer import buffer_events, write_event
+
+
+class TestEventWriter(TestCase):
+
+    def test_write_event_outside_buffer(self):
+        # Execute
+        event = write_event(event_type="client.terminated")
+
+        # Check
+        self.assertTrue(Event.objects.filter(id=event.id).exists())
+
+    def test_buffered_events_saved_together(self):
+        # Execute
+        with CaptureQueriesContext(connection) as queries:
+            with buffer_events():
+                for i in range(5):
+                    write_event(event_type="client.terminated", event_data={"i": i})
+                # . nothing is written until the block ends
+                self.assertEqual(Event.objects.count(), 0)
+
+        # Check
+        self.assertEqual(Event.objects.count(), 5)
+        inserts = [q for q in queries.captured_queries if q["sql"].startswith("INSERT")]
+        self.assertEqual(len(inserts), 1)
+
+    def test_nested_buffers_saved_by_outer(self):
+        # Execute
+        with buffer_events():
+            with buffer_events():
+                write_event(event_type="client.terminated")
+            self.assertEqual(Event.objects.count(), 0)
+
+        # Check
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_buffered_events_discarded_on_error(self):
+        # Execute
+        with self.assertRaises(ValueError):
+            with transaction.atomic(), buffer_events():
+                write_event(event_type="client.terminated")
+                raise ValueError("rolled back")
+
+        # Check
+        self.assertEqual(Event.objects.count(), 0)
+        # . the next write is not buffered
+        write_event(event_type="client.terminated")
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_task_dispatch_coalesced(self):
+        # Execute
+        with mock.patch("events.tasks.debit_batch_completed.apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                with buffer_events():
+                    events = [write_event(event_type="debit.batch_completed")
+                              for _ in range(3)]
+                    write_event(event_type="client.terminated")
+
+        # Check
+        apply_async.assert_called_once_with(
+            kwargs={"event_ids": [str(event.id) for event in events]})
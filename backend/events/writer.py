@@ -0,0 +1,97 @@
+"""
+Batched writing of Events
+
+write_events saves Events with bulk_create. Inside a buffer_events block the
+Events are held and saved together with one bulk_create when the block ends,
+still inside the caller's transaction, so they commit (or roll back) with
+the changes they describe. The task for each event type is dispatched once
+per batch, after commit, with the ids of all that batch's Events of the type,
+and cached GraphQL results about the models they changed are invalidated.
+
+"""
+from contextlib import contextmanager
+import threading
+
+from django.db import transaction
+
+from maguire.response_cache import invalidate_responses
+
+from .models import Event
+
+
+EVENT_BATCH_SIZE = 1000
+
+_local = threading.local()
+
+
+def _buffers():
+    if not hasattr(_local, "buffers"):
+        _local.buffers = []
+    return _local.buffers
+
+
+def dispatch_event_tasks(events):
+    """
+    After commit, calls the task named after each event type (e.g.
+    debit.batch_completed -> debit_batch_completed) once with the ids of all
+    events of that type
+    """
+    event_ids = {}
+    for event in events:
+        event_ids.setdefault(event.event_type, []).append(str(event.id))
+
+    def run_tasks_event_type():
+        from events import tasks
+        for event_type, ids in event_ids.items():
+            try:
+                getattr(tasks, event_type.replace(".", "_")
+                        ).apply_async(kwargs={"event_ids": ids})
+            except Exception:
+                pass
+    transaction.on_commit(run_tasks_event_type)
+
+
+def _save_events(events):
+    Event.objects.bulk_create(events, batch_size=EVENT_BATCH_SIZE)
+    dispatch_event_tasks(events)
+    invalidate_responses(events)
+
+
+def write_events(events):
+    """
+    Saves unsaved Event instances, or holds them until the enclosing
+    buffer_events block ends. Returns the events.
+    """
+    events = list(events)
+    if not events:
+        return events
+    buffers = _buffers()
+    if buffers:
+        buffers[-1].extend(events)
+    else:
+        _save_events(events)
+    return events
+
+
+def write_event(**fields):
+    """
+    Saves (or buffers) a single Event built from fields and returns it
+    """
+    return write_events([Event(**fields)])[0]
+
+
+@contextmanager
+def buffer_events():
+    """
+    Holds the Events written in the block and saves them in one batch when
+    it ends. If the block raises they are discarded, like the transaction
+    they belong to. Blocks can be nested, an inner block hands its Events
+    to the outer one.
+    """
+    buffer = []
+    _buffers().append(buffer)
+    try:
+        yield buffer
+    finally:
+        _buffers().pop()
+    write_events(buffer)
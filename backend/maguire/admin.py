@@ -0,0 +1,11 @@
+from django.contrib import admin
+
+
+class AppModelAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin for AppModels. The admin form has validated the instance
+    already, so it is saved without validating it again.
+    """
+
+    def save_model(self, request, obj, form, change):
+        obj.save(validate=False)
@@ -0,0 +1,152 @@
+"""
+Request scoped batching of related object lookups for GraphQL
+
+Resolving a foreign key per node costs a query per node. Two things avoid
+that:
+
+- select_related_for looks at the GraphQL selection of a connection and
+  joins in the foreign keys its nodes select, so the page query brings them.
+- Loaders (one set per request, see maguire.views.GraphQLView) cache related
+  objects by primary key. When a connection page is resolved the foreign key
+  ids of its nodes are queued (prime), the first lookup then fetches all of
+  them with one query per related model.
+
+"""
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+
+class ModelLoader:
+    """
+    Cache of model instances by primary key. Ids queued with prime are
+    fetched together by the next load of an uncached id.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.cache = {}
+        self.queue = set()
+
+    def prime(self, ids):
+        self.queue.update(id for id in ids if id is not None and id not in self.cache)
+
+    def load(self, id):
+        if id is None:
+            return None
+        if id not in self.cache:
+            self.queue.add(id)
+            self.cache.update({
+                instance.pk: instance
+                for instance in self.model._default_manager.filter(pk__in=self.queue)})
+            for missing in self.queue:
+                self.cache.setdefault(missing, None)
+            self.queue = set()
+        return self.cache[id]
+
+
+class Loaders:
+    """
+    The ModelLoaders of one request
+    """
+
+    def __init__(self):
+        self.loaders = {}
+
+    def for_model(self, model):
+        if model not in self.loaders:
+            self.loaders[model] = ModelLoader(model)
+        return self.loaders[model]
+
+
+def get_loaders(context):
+    """
+    Returns the loaders of the request (the GraphQL context), creating them
+    when the view didn't. Without a context nothing is shared.
+    """
+    if context is None:
+        return Loaders()
+    loaders = getattr(context, "loaders", None)
+    if loaders is None:
+        loaders = Loaders()
+        context.loaders = loaders
+    return loaders
+
+
+def _foreign_keys(model):
+    return [field for field in model._meta.concrete_fields
+            if field.is_relation and field.many_to_one]
+
+
+def prime_related(context, instances):
+    """
+    Queues the foreign key ids of instances, whose related objects weren't
+    joined in, with the request's loaders
+    """
+    if not instances:
+        return
+    loaders = get_loaders(context)
+    for field in _foreign_keys(type(instances[0])):
+        loaders.for_model(field.related_model).prime(
+            getattr(instance, field.attname) for instance in instances
+            if not field.is_cached(instance))
+
+
+def load_related(info, instance, name):
+    """
+    Returns the object instance's foreign key name points to, from the
+    instance if it was joined in, otherwise through the request's loaders
+    """
+    field = instance._meta.get_field(name)
+    if field.is_cached(instance):
+        return getattr(instance, name)
+    related = get_loaders(info.context).for_model(field.related_model).load(
+        getattr(instance, field.attname))
+    field.set_cached_value(instance, related)
+    return related
+
+
+def _selected_fields(selection_set, fragments):
+    """
+    Yields the FieldNodes of selection_set, looking into fragments
+    """
+    if selection_set is None:
+        return
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection
+        elif isinstance(selection, InlineFragmentNode):
+            yield from _selected_fields(selection.selection_set, fragments)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = fragments.get(selection.name.value)
+            if fragment is not None:
+                yield from _selected_fields(fragment.selection_set, fragments)
+
+
+def selected_node_fields(info):
+    """
+    Returns the names (snake_case) of the fields selected on the nodes of
+    the connection being resolved, i.e. under edges { node { ... } }
+    """
+    names = set()
+    for connection_field in info.field_nodes:
+        for edges in _selected_fields(connection_field.selection_set, info.fragments):
+            if edges.name.value != "edges":
+                continue
+            for node in _selected_fields(edges.selection_set, info.fragments):
+                if node.name.value != "node":
+                    continue
+                names.update(
+                    to_snake_case(field.name.value)
+                    for field in _selected_fields(node.selection_set, info.fragments))
+    return names
+
+
+def select_related_for(queryset, info):
+    """
+    Joins in the foreign keys that the connection's nodes select
+    """
+    selected = selected_node_fields(info)
+    related = [field.name for field in _foreign_keys(queryset.model) if field.name in selected]
+    if related:
+        queryset = queryset.select_related(*related)
+    return queryset
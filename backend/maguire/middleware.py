@@ -0,0 +1,20 @@
+from django.urls import Resolver404, resolve
+from reversion.middleware import RevisionMiddleware as BaseRevisionMiddleware
+
+
+class RevisionMiddleware(BaseRevisionMiddleware):
+    """
+    RevisionMiddleware that leaves out views with creates_revision = False,
+    e.g. imports, which manage their own transactions and history rather
+    than running in one revision (and transaction) for the whole request
+    """
+
+    def request_creates_revision(self, request):
+        if not super().request_creates_revision(request):
+            return False
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return True
+        view = getattr(match.func, "view_class", match.func)
+        return getattr(view, "creates_revision", True)
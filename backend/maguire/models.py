@@ -1,8 +1,27 @@
+import copy
 import uuid
 
+from django.core.exceptions import ValidationError
 from django.db import models
 
 
+def _copy_value(value):
+    # JSON values can be changed in place, the others are replaced
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    return value
+
+
+def _changed(field, loaded, value):
+    if loaded == value:
+        return False
+    # e.g. "10.00" set on a DecimalField that holds Decimal("10.00")
+    try:
+        return loaded != field.to_python(value)
+    except ValidationError:
+        return True
+
+
 class AppQuerySet(models.QuerySet):
     pass
 
@@ -23,9 +42,88 @@ class AppModel(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     objects = AppManager()
 
+    # Models that remember their loaded values, so that save() only writes
+    # the dirty fields. Off by default, the snapshot is a cost on every
+    # instance loaded, e.g. each row of a list or an export.
+    track_dirty_fields = False
+
     class Meta:
         abstract = True
 
-    def save(self, *args, **kwargs):
-        self.full_clean()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(AppModel, cls).from_db(db, field_names, values)
+        instance.mark_clean()
+        return instance
+
+    def mark_clean(self, fields=None):
+        """
+        Remembers the values of fields (all the loaded ones by default) as
+        they are in the database, if the model tracks dirty fields
+        """
+        if not self.track_dirty_fields:
+            return
+        if fields is None or getattr(self, "_loaded_values", None) is None:
+            self._loaded_values = {}
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (
+                    fields is None or field.name in fields or field.attname in fields):
+                self._loaded_values[field.attname] = _copy_value(self.__dict__[field.attname])
+
+    def dirty_fields(self):
+        """
+        Returns the names of the fields changed since the instance was loaded
+        or saved. Every loaded field of an instance that wasn't loaded from
+        the database, or of a model that doesn't track dirty fields, is dirty.
+        """
+        loaded = getattr(self, "_loaded_values", None) or {}
+        return [field.name for field in self._meta.concrete_fields
+                if field.attname in self.__dict__ and (
+                    field.attname not in loaded
+                    or _changed(field, loaded[field.attname], self.__dict__[field.attname]))]
+
+    def save(self, *args, validate=True, **kwargs):
+        """
+        Validates the instance and saves it. Trusted internal saves, of
+        values already validated at the API boundary, pass validate=False.
+
+        An instance of a model that tracks dirty fields, loaded from the
+        database, only writes its dirty fields (and auto_now fields), unless
+        update_fields is given. With
+        update_fields only those fields are validated and checked for
+        uniqueness.
+        """
+        if not args and kwargs.get("update_fields") is None \
+                and not kwargs.get("force_insert") and not self._state.adding \
+                and getattr(self, "_loaded_values", None) is not None:
+            kwargs["update_fields"] = self.dirty_fields() + [
+                field.name for field in self._meta.concrete_fields
+                if getattr(field, "auto_now", False)]
+        if validate:
+            self.full_clean(exclude=self.clean_exclude(kwargs.get("update_fields")))
         super(AppModel, self).save(*args, **kwargs)
+        self.mark_clean(kwargs.get("update_fields"))
+
+    def refresh_from_db(self, using=None, fields=None):
+        super(AppModel, self).refresh_from_db(using=using, fields=fields)
+        self.mark_clean(fields)
+
+    def clean_exclude(self, update_fields=None):
+        """
+        Returns the fields full_clean needn't validate when saving
+        update_fields, i.e. all the others
+        """
+        if update_fields is None:
+            return None
+        return [field.name for field in self._meta.concrete_fields
+                if field.name not in update_fields and field.attname not in update_fields]
+
+    def clean_fields(self, exclude=None):
+        # A foreign key set to a related instance, which was loaded from the
+        # database, needn't be queried for to check it exists
+        exclude = set(exclude or ())
+        for field in self._meta.concrete_fields:
+            if field.many_to_one and field.is_cached(self) \
+                    and getattr(self, field.name) is not None:
+                exclude.add(field.name)
+        super(AppModel, self).clean_fields(exclude=exclude)
@@ -0,0 +1,274 @@
+"""
+Keyset (cursor) pagination for GraphQL connections
+
+KeysetConnectionField pages through a filtered queryset by the values of its
+ordering fields instead of by OFFSET. A cursor holds the ordering values and
+the id of an edge, the next page is the rows ordered after that key, so any
+page costs an index range scan however deep it is. totalCount is only
+counted when it is selected, exactly, from the planner's estimate or from a
+short lived cache (see count_queryset).
+
+"""
+import base64
+import hashlib
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F, Field, Func, Q, Value
+from django.db.models.lookups import GreaterThan, LessThan
+from graphene import Enum
+from graphene.relay import PageInfo
+from graphene_django.filter import DjangoFilterConnectionField
+from graphql import GraphQLError
+
+from maguire.loaders import prime_related
+
+
+class CountStrategy(Enum):
+    """
+    How totalCount is counted
+    """
+    EXACT = "exact"
+    ESTIMATE = "estimate"
+    CACHED = "cached"
+
+    @property
+    def description(self):
+        return {
+            CountStrategy.EXACT: "COUNT(*) of the filtered rows",
+            CountStrategy.ESTIMATE: "The query planner's estimate, cheap but approximate",
+            CountStrategy.CACHED: "An exact count cached for GRAPHQL_COUNT_CACHE_TTL seconds",
+        }.get(self)
+
+
+def estimate_count(queryset):
+    """
+    Returns the planner's estimate of the number of rows in queryset: the
+    table statistics (pg_class.reltuples, summed over the partitions of a
+    partitioned table, leaving out the parent's, which ANALYZE also sets) when it
+    isn't filtered, otherwise the row estimate of its query plan. Falls
+    back to an exact count when the table was never analyzed.
+    """
+    if not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT sum(c.reltuples) FROM pg_class c WHERE (c.oid = %s::regclass "
+                "OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)) "
+                "AND c.relkind <> 'p' AND c.reltuples >= 0", [queryset.model._meta.db_table] * 2)
+            reltuples = cursor.fetchone()[0]
+        if reltuples is not None:
+            return int(reltuples)
+        return queryset.count()
+    plan = json.loads(queryset.order_by().explain(format="json"))
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def cached_count(queryset):
+    """
+    Returns the exact count of queryset, cached for GRAPHQL_COUNT_CACHE_TTL
+    seconds under its SQL, i.e. its model and normalized filters
+    """
+    sql, params = queryset.order_by().query.sql_with_params()
+    key = "maguire.count.%s" % (
+        hashlib.sha256(("%s|%r" % (sql, params)).encode("utf-8")).hexdigest(), )
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, int(settings.GRAPHQL_COUNT_CACHE_TTL))
+    return count
+
+
+def count_queryset(queryset, strategy=None):
+    """
+    Counts queryset with a CountStrategy (or its value), EXACT by default
+    """
+    if queryset.query.is_empty():
+        # e.g. none() for users without permission, there's no SQL to run
+        return 0
+    strategy = getattr(strategy, "value", strategy)
+    if strategy == CountStrategy.ESTIMATE.value:
+        return estimate_count(queryset)
+    if strategy == CountStrategy.CACHED.value:
+        return cached_count(queryset)
+    return queryset.count()
+
+
+class Row(Func):
+    """
+    SQL row value, e.g. ROW(created_at, id), for comparing composite keys
+    """
+    function = "ROW"
+    output_field = Field()
+
+
+def encode_cursor(values):
+    data = [value.isoformat() if isinstance(value, datetime) else
+            None if value is None else str(value) for value in values]
+    return base64.b64encode(json.dumps(data).encode("utf-8")).decode("utf-8")
+
+
+def decode_cursor(cursor, fields):
+    """
+    Returns the values in cursor converted for fields, a list of model
+    fields ending with the primary key
+    """
+    try:
+        data = json.loads(base64.b64decode(cursor))
+        if not isinstance(data, list) or len(data) != len(fields):
+            raise ValueError("Cursor doesn't match the ordering")
+        return [None if value is None else field.to_python(value)
+                for field, value in zip(fields, data)]
+    except Exception:
+        raise GraphQLError("Invalid cursor, cursors are only valid with the same orderBy")
+
+
+def get_ordering(queryset):
+    """
+    Returns the queryset's ordering as (field name, descending) pairs, with
+    the primary key appended as the tie breaker
+    """
+    ordering = []
+    for order in queryset.query.order_by:
+        if not isinstance(order, str):
+            raise GraphQLError("Only field orderings can be paginated")
+        ordering.append((order.lstrip("-"), order.startswith("-")))
+    pk_name = queryset.model._meta.pk.name
+    if pk_name not in [name for name, _ in ordering]:
+        ordering.append((pk_name, ordering[0][1] if ordering else False))
+    return ordering
+
+
+def _value(model, name, value):
+    return Value(value, output_field=model._meta.get_field(name))
+
+
+def keyset_filter(model, ordering, values):
+    """
+    Returns a Q selecting the rows ordered strictly after the key values.
+    NULLs sort last ascending and first descending, PostgreSQL's defaults.
+    """
+    names = [name for name, _ in ordering]
+    nullable = any(model._meta.get_field(name).null for name in names)
+    if len(set(desc for _, desc in ordering)) == 1 and not nullable:
+        # one direction and no nullable fields, a single row comparison (a
+        # row holding a NULL compares as NULL, which would drop those rows)
+        lookup = LessThan if ordering[0][1] else GreaterThan
+        return Q(lookup(Row(*[F(name) for name in names]),
+                        Row(*[_value(model, name, value) for name, value in zip(names, values)])))
+
+    q = None
+    for (name, desc), value in reversed(list(zip(ordering, values))):
+        nullable = model._meta.get_field(name).null
+        if value is None:
+            equal = Q(**{name + "__isnull": True})
+            after = Q(**{name + "__isnull": False}) if desc else None
+        else:
+            equal = Q(**{name: value})
+            after = Q(**{name + ("__lt" if desc else "__gt"): value})
+            if nullable and not desc:
+                after |= Q(**{name + "__isnull": True})
+        if q is None:
+            q = after
+        else:
+            tie = equal & q
+            q = tie if after is None else after | tie
+    return q
+
+
+def _order(name, desc):
+    return F(name).desc(nulls_first=True) if desc else F(name).asc(nulls_last=True)
+
+
+class KeysetConnectionField(DjangoFilterConnectionField):
+    """
+    DjangoFilterConnectionField paginated by keyset. The orderBy filter
+    chooses the ordering, default_order applies when it isn't given. Deep
+    pages stay cheap when there is an index on (order field, id).
+    """
+
+    def __init__(self, type_, default_order="created_at", *args, **kwargs):
+        self.default_order = default_order
+        super().__init__(type_, *args, **kwargs)
+
+    def get_queryset_resolver(self):
+        resolve_queryset = super().get_queryset_resolver()
+
+        def resolve_ordered_queryset(connection, iterable, info, args):
+            queryset = resolve_queryset(connection, iterable, info, args)
+            if not queryset.query.order_by:
+                queryset = queryset.order_by(self.default_order)
+            return queryset
+        return resolve_ordered_queryset
+
+    @classmethod
+    def connection_resolver(cls, resolver, connection, default_manager, queryset_resolver,
+                            max_limit, enforce_first_or_last, root, info, **args):
+        result = super().connection_resolver(
+            resolver, connection, default_manager, queryset_resolver, max_limit,
+            enforce_first_or_last, root, info, **args)
+        # related objects of the page's nodes are then loaded together
+        prime_related(info.context, [edge.node for edge in result.edges])
+        return result
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        if args.get("offset"):
+            raise GraphQLError("offset is not supported, page with after or before cursors")
+        first = args.get("first")
+        last = args.get("last")
+        if first is None and last is None:
+            first = max_limit
+
+        queryset = iterable
+        model = queryset.model
+        ordering = get_ordering(queryset)
+        fields = [model._meta.get_field(name) for name, _ in ordering]
+        reverse = [(name, not desc) for name, desc in ordering]
+
+        page = queryset
+        if args.get("after"):
+            page = page.filter(keyset_filter(
+                model, ordering, decode_cursor(args["after"], fields)))
+        if args.get("before"):
+            page = page.filter(keyset_filter(
+                model, reverse, decode_cursor(args["before"], fields)))
+
+        has_next = has_previous = False
+        if last is not None and first is None:
+            # the last rows are the first ones in reverse order
+            page = page.order_by(*[_order(name, desc) for name, desc in reverse])
+            rows = list(page[:last + 1])
+            has_previous = len(rows) > last
+            rows = rows[:last][::-1]
+            has_next = bool(args.get("before"))
+        else:
+            page = page.order_by(*[_order(name, desc) for name, desc in ordering])
+            rows = list(page[:first + 1]) if first is not None else list(page)
+            if first is not None:
+                has_next = len(rows) > first
+                rows = rows[:first]
+            if last is not None and len(rows) > last:
+                rows = rows[-last:]
+                has_previous = True
+            has_previous = has_previous or bool(args.get("after"))
+
+        edges = [
+            connection.Edge(
+                node=row,
+                cursor=encode_cursor([getattr(row, name) for name, _ in ordering]))
+            for row in rows
+        ]
+        result = connection(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_previous,
+                has_next_page=has_next,
+            ))
+        # counted by totalCount only if it is selected
+        result.iterable = queryset
+        return result
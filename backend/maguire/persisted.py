@@ -0,0 +1,142 @@
+"""
+Persisted GraphQL queries and a cache of parsed, validated documents
+
+Integrations send the same few documents over and over. A client can send
+the sha256 hash of a document instead of its text, following Apollo's
+automatic persisted queries protocol:
+
+    {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": "..."}}}
+
+An unknown hash gets a PersistedQueryNotFound error, the client then sends
+the hash together with the document, which registers it for
+GRAPHQL_PERSISTED_QUERY_TTL seconds. Documents listed in the
+GRAPHQL_PERSISTED_QUERIES file are always known. With
+GRAPHQL_PERSISTED_QUERIES_ONLY only those documents are run, whether sent
+by hash or in full.
+
+Whichever way a document arrives, it is parsed and validated once per
+worker: valid documents are kept in an LRU cache of
+GRAPHQL_DOCUMENT_CACHE_SIZE entries keyed by their hash.
+
+"""
+from collections import OrderedDict
+import functools
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLError, parse, validate
+
+
+REGISTRY_KEY = "maguire.graphql.query.%s"
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+class DocumentCache:
+    """
+    Thread safe LRU cache of parsed and validated documents, keyed by
+    schema and document hash
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.documents = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            document = self.documents.get(key)
+            if document is not None:
+                self.documents.move_to_end(key)
+            return document
+
+    def put(self, key, document):
+        size = int(settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
+        with self.lock:
+            self.documents[key] = document
+            self.documents.move_to_end(key)
+            while len(self.documents) > size:
+                self.documents.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+
+
+document_cache = DocumentCache()
+
+
+@functools.lru_cache(maxsize=None)
+def _load_persisted_queries(path):
+    with open(path) as f:
+        queries = json.load(f)
+    if isinstance(queries, dict):
+        queries = queries.values()
+    # keyed by the hash of the text, whatever the file's keys are
+    return {query_hash(query): query for query in queries}
+
+
+def persisted_queries():
+    """
+    Returns the documents of the GRAPHQL_PERSISTED_QUERIES file (a JSON
+    list, or object, of documents) by hash
+    """
+    if not settings.GRAPHQL_PERSISTED_QUERIES:
+        return {}
+    return _load_persisted_queries(settings.GRAPHQL_PERSISTED_QUERIES)
+
+
+def _error(message, code):
+    return GraphQLError(message, extensions={"code": code})
+
+
+def resolve_query(query, extensions):
+    """
+    Returns (hash, document text) for a request's query and extensions.
+    Raises GraphQLError when the document is unknown or not allowed. The
+    text is None when the request has neither a query nor a hash.
+    """
+    persisted = (extensions or {}).get("persistedQuery")
+    sha256 = persisted.get("sha256Hash") if isinstance(persisted, dict) else None
+    if sha256 is None:
+        if not query:
+            return None, None
+        sha256 = query_hash(query)
+    elif query and query_hash(query) != sha256:
+        raise _error("provided sha does not match query", "INVALID_PERSISTED_QUERY")
+
+    known = persisted_queries()
+    if sha256 in known:
+        return sha256, known[sha256]
+    if settings.GRAPHQL_PERSISTED_QUERIES_ONLY:
+        raise _error("PersistedQueryNotAllowed", "PERSISTED_QUERY_NOT_ALLOWED")
+    if not query:
+        query = cache.get(REGISTRY_KEY % (sha256, ))
+        if query is None:
+            raise _error("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+    elif persisted:
+        cache.set(REGISTRY_KEY % (sha256, ), query, int(settings.GRAPHQL_PERSISTED_QUERY_TTL))
+    return sha256, query
+
+
+def get_document(schema, sha256, query, validation_rules=None):
+    """
+    Returns (document, validation errors) for query, from the cache when it
+    was parsed and validated before. Raises GraphQLError when it doesn't
+    parse. Only valid documents are cached.
+    """
+    key = (schema, sha256)
+    document = document_cache.get(key)
+    if document is not None:
+        return document, []
+    document = parse(query)
+    errors = validate(
+        schema, document, validation_rules, graphene_settings.MAX_VALIDATION_ERRORS)
+    if not errors:
+        document_cache.put(key, document)
+    return document, errors
@@ -0,0 +1,180 @@
+"""
+Cache of GraphQL query results
+
+Reporting clients run the same debits queries over and over. The result of
+a query operation is cached when every root field of the operation returns
+a model's nodes (e.g. debits, debit), under a key made of:
+
+- the normalized document (printed from its AST) and operation name
+- the variables
+- the user's effective permissions, which decide what resolvers return
+- the version of each model the root fields return
+
+A model's version changes whenever a model.created or model.updated Event
+is written for it (see events.writer), or it is saved or deleted otherwise
+(see invalidate_models), and Event's version whenever any Event is
+written, after the transaction commits, so a result is never served once
+one of the rows it could contain has changed.
+Versions start at a time based value, so one that was evicted from the
+cache can't come back to an earlier value.
+
+GRAPHQL_RESPONSE_CACHE_TTL is how many seconds results are kept, 0 turns
+the cache off. The cache must be shared by all processes (see
+MAGUIRE_CACHE_URL) so that writes from the workers invalidate results
+cached by the web servers, without one it is off by default. Nothing is
+invalidated while the cache is off, and a cache that can't be reached is
+logged rather than failing the write that committed.
+
+"""
+import functools
+import hashlib
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from graphql import FieldNode, OperationType, get_named_type, get_operation_ast, parse, print_ast
+from rolepermissions.permissions import available_perm_names
+
+VERSION_KEY = "maguire.graphql.version.%s"
+RESPONSE_KEY = "maguire.graphql.response.%s"
+INVALIDATING_EVENTS = ("model.created", "model.updated")
+EVENT_LABEL = "events.event"
+
+logger = logging.getLogger(__name__)
+
+
+def _version_key(label):
+    return VERSION_KEY % (label, )
+
+
+def get_versions(labels):
+    """
+    Returns the current version of each model label, e.g. debits.debit
+    """
+    keys = [_version_key(label) for label in labels]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(labels):
+    for label in labels:
+        try:
+            cache.incr(_version_key(label))
+        except ValueError:
+            cache.add(_version_key(label), time.time_ns(), None)
+
+
+def _enabled():
+    return bool(int(settings.GRAPHQL_RESPONSE_CACHE_TTL))
+
+
+def invalidate_responses(events):
+    """
+    Changes the version of Event, and of the models the model.created and
+    model.updated events are about, once the transaction they are written
+    in commits
+    """
+    if not _enabled():
+        return
+    labels = set()
+    if events:
+        labels.add(EVENT_LABEL)
+    for event in events:
+        if event.event_type in INVALIDATING_EVENTS and event.source_model_id is not None:
+            content_type = ContentType.objects.get_for_id(event.source_model_id)
+            labels.add("%s.%s" % (content_type.app_label, content_type.model))
+    invalidate_models(labels)
+
+
+def invalidate_models(labels):
+    """
+    Changes the version of the model labels once the transaction commits,
+    for changes that write no Event (e.g. saves from the admin)
+    """
+    labels = sorted(labels)
+    if not labels or not _enabled():
+        return
+
+    def run_bump_versions():
+        try:
+            bump_versions(labels)
+        except Exception:
+            # the write has committed, a cache outage mustn't fail it
+            logger.exception("Could not invalidate cached GraphQL results of %s" % (
+                ", ".join(labels), ))
+    transaction.on_commit(run_bump_versions)
+
+
+def root_models(schema, document, operation_name):
+    """
+    Returns the models the root fields of a query operation return nodes
+    of, or None when the operation can't be cached
+    """
+    operation = get_operation_ast(document, operation_name)
+    if operation is None or operation.operation != OperationType.QUERY:
+        return None
+    models = set()
+    for selection in operation.selection_set.selections:
+        if not isinstance(selection, FieldNode):
+            return None
+        field = schema.query_type.fields.get(selection.name.value)
+        if field is None:
+            return None
+        graphene_type = getattr(get_named_type(field.type), "graphene_type", None)
+        # a connection's nodes, or a node
+        node = getattr(getattr(graphene_type, "_meta", None), "node", None) or graphene_type
+        model = getattr(getattr(node, "_meta", None), "model", None)
+        if model is None:
+            return None
+        models.add(model)
+    return models
+
+
+@functools.lru_cache(maxsize=1024)
+def _normalized_hash(query):
+    return hashlib.sha256(print_ast(parse(query)).encode("utf-8")).hexdigest()
+
+
+def _permissions(user):
+    if user is None or not user.is_authenticated:
+        return "anonymous"
+    if user.is_superuser:
+        return "superuser"
+    return ",".join(sorted(available_perm_names(user)))
+
+
+def response_key(schema, document, query, operation_name, variables, user):
+    """
+    Returns the cache key of the result of the operation, or None when it
+    can't be cached
+    """
+    if not _enabled():
+        return None
+    models = root_models(schema, document, operation_name)
+    if not models:
+        return None
+    labels = sorted(model._meta.label_lower for model in models)
+    key = json.dumps([
+        _normalized_hash(query),
+        operation_name,
+        variables,
+        _permissions(user),
+        list(zip(labels, get_versions(labels))),
+    ], sort_keys=True, default=str)
+    return RESPONSE_KEY % (hashlib.sha256(key.encode("utf-8")).hexdigest(), )
+
+
+def get_response(key):
+    return cache.get(key)
+
+
+def set_response(key, data):
+    cache.set(key, data, int(settings.GRAPHQL_RESPONSE_CACHE_TTL))
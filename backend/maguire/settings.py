@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     # 3rd party
     'rest_framework',
     'rest_framework.authtoken',
@@ -70,7 +71,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'reversion.middleware.RevisionMiddleware',
+    'maguire.middleware.RevisionMiddleware',
 ]
 
 ROOT_URLCONF = 'maguire.urls'
@@ -104,6 +105,17 @@ DATABASES = {
             'postgres://:@/maguire')),
 }
 
+# Cache shared by all processes, e.g. redis://localhost:6379/0. The GraphQL
+# response cache is only invalidated across processes with a shared cache.
+MAGUIRE_CACHE_URL = os.environ.get('MAGUIRE_CACHE_URL', None)
+if MAGUIRE_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': MAGUIRE_CACHE_URL,
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -174,6 +186,24 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ('django_filters.rest_framework.DjangoFilterBackend',)  # noqa
 }
 
+# Seconds a totalCount with strategy CACHED is reused for
+GRAPHQL_COUNT_CACHE_TTL = os.environ.get('GRAPHQL_COUNT_CACHE_TTL', '10')
+
+# Parsed and validated GraphQL documents kept per worker
+GRAPHQL_DOCUMENT_CACHE_SIZE = os.environ.get('GRAPHQL_DOCUMENT_CACHE_SIZE', '500')
+# Seconds a persisted query registered by a client is remembered
+GRAPHQL_PERSISTED_QUERY_TTL = os.environ.get('GRAPHQL_PERSISTED_QUERY_TTL', '86400')
+# JSON file listing the documents that are always known
+GRAPHQL_PERSISTED_QUERIES = os.environ.get('GRAPHQL_PERSISTED_QUERIES', None)
+# Only run the documents in GRAPHQL_PERSISTED_QUERIES
+GRAPHQL_PERSISTED_QUERIES_ONLY = os.environ.get(
+    'GRAPHQL_PERSISTED_QUERIES_ONLY', 'false').lower() == 'true'
+# Seconds GraphQL query results are cached, 0 turns the cache off. Off
+# unless the cache is shared, otherwise other processes' writes would never
+# invalidate them.
+GRAPHQL_RESPONSE_CACHE_TTL = os.environ.get(
+    'GRAPHQL_RESPONSE_CACHE_TTL', '60' if MAGUIRE_CACHE_URL else '0')
+
 # GRAPHENE = {
 #     'SCHEMA': 'maguire.schema.schema',
 #     'MIDDLEWARE': (
@@ -209,6 +239,15 @@ CELERY_ROUTES = {
     'maguire.debits.tasks.t_queue_pending': {
         'queue': 'maguire',
     },
+    'maguire.debits.tasks.t_check_loaded': {
+        'queue': 'maguire',
+    },
+    'maguire.debits.tasks.t_deliver_callbacks': {
+        'queue': 'maguire',
+    },
+    'maguire.events.tasks.maintain_event_partitions': {
+        'queue': 'mediumpriority',
+    },
 }
 
 CELERY_TASK_SERIALIZER = 'json'
@@ -235,14 +274,36 @@ AWS_STORAGE_BUCKET_NAME = os.environ.get('AWS_STORAGE_BUCKET_NAME', 'REPLACEME')
 AWS_DEFAULT_ACL = 'private'
 AWS_S3_ENCRYPTION = True
 
+# Events are partitioned by month, old partitions are archived to S3
+EVENTS_PARTITION_MONTHS_AHEAD = os.environ.get('EVENTS_PARTITION_MONTHS_AHEAD', '3')
+EVENTS_RETENTION_MONTHS = os.environ.get('EVENTS_RETENTION_MONTHS', '12')
+EVENTS_ARCHIVE_BUCKET = os.environ.get('EVENTS_ARCHIVE_BUCKET', AWS_STORAGE_BUCKET_NAME)
+EVENTS_ARCHIVE_PREFIX = os.environ.get('EVENTS_ARCHIVE_PREFIX', 'events/archive/')
+
 BASE_URL = os.environ.get('BASE_URL', 'REPLACEME')
 
 # These tokens are used when hitting callback URLs to secure them
 CALLBACK_TOKEN_DEBITS = os.environ.get('CALLBACK_TOKEN_DEBIT', None)
 CALLBACK_TOKEN_CREDITS = os.environ.get('CALLBACK_TOKEN_CREDITS', None)
+DEBIT_CALLBACK_BATCH_SIZE = os.environ.get('DEBIT_CALLBACK_BATCH_SIZE', '100')
+DEBIT_CALLBACK_CONCURRENCY = os.environ.get('DEBIT_CALLBACK_CONCURRENCY', '10')
+DEBIT_CALLBACK_ATTEMPTS = os.environ.get('DEBIT_CALLBACK_ATTEMPTS', '8')
+DEBIT_CALLBACK_BACKOFF = os.environ.get('DEBIT_CALLBACK_BACKOFF', '60')  # seconds
+DEBIT_CALLBACK_TIMEOUT = os.environ.get('DEBIT_CALLBACK_TIMEOUT', '10')  # seconds
 
 DEBIT_PROVIDER = os.environ.get('DEBIT_PROVIDER', 'debits.providers.easydebit')
 DEBIT_PACKAGE = os.environ.get('DEBIT_PACKAGE', 'EasyDebitProvider')
 DEBIT_CONFIG = json.loads(os.environ.get('DEBIT_CONFIG', '{}'))
 DEBIT_LOAD_ATTEMPTS = os.environ.get('DEBIT_LOAD_ATTEMPTS', '4')
 DEBIT_LEAD_TIME = os.environ.get('DEBIT_LEAD_TIME', '2')
+DEBIT_CHUNK_SIZE = os.environ.get('DEBIT_CHUNK_SIZE', '500')
+DEBIT_CONCURRENCY = os.environ.get('DEBIT_CONCURRENCY', '1')
+DEBIT_BULK_CREATE_LIMIT = os.environ.get('DEBIT_BULK_CREATE_LIMIT', '5000')
+DEBIT_IMPORT_BATCH_SIZE = os.environ.get('DEBIT_IMPORT_BATCH_SIZE', '1000')
+DEBIT_QUEUE_LIMIT = os.environ.get('DEBIT_QUEUE_LIMIT', '10000')
+DEBIT_STATUS_BATCH_SIZE = os.environ.get('DEBIT_STATUS_BATCH_SIZE', '100')
+# What records debit history next to the Events: reversion, events or diff,
+# see debits.history. Bulk creates and imports use DEBIT_BULK_HISTORY_BACKEND.
+DEBIT_HISTORY_BACKEND = os.environ.get('DEBIT_HISTORY_BACKEND', 'reversion')
+DEBIT_BULK_HISTORY_BACKEND = os.environ.get(
+    'DEBIT_BULK_HISTORY_BACKEND', DEBIT_HISTORY_BACKEND)
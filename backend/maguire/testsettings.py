@@ -29,6 +29,9 @@ EMAIL_DEVOPS = os.environ.get('EMAIL_DEVOPS', 'devops@example.com')
 
 BASE_URL = os.environ.get('BASE_URL', 'http://localhost:8000')
 
+# tests roll back without committing, which is when cached results are invalidated
+GRAPHQL_RESPONSE_CACHE_TTL = '0'
+
 DEBIT_CONFIG = json.loads(os.environ.get(
     'DEBIT_CONFIG',
     '{"base_url": "https://www.slowdebit.co.za:8888/Services/PaymentService.svc/'
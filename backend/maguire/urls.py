@@ -12,9 +12,9 @@ from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import authentication_classes, permission_classes, api_view
 
-from graphene_django.views import GraphQLView
-
+from debits.views import DebitImportView
 from maguire.schema import schema
+from maguire.views import GraphQLView
 
 admin.site.site_header = os.environ.get('MAGUIRE_TITLE', 'Maguire Admin')
 
@@ -33,5 +33,6 @@ urlpatterns = [
     re_path(r'^graphql', graphql_token_view()),
     re_path(r'^graphiql', staff_member_required(csrf_exempt(
         GraphQLView.as_view(schema=schema, graphiql=True)))),
+    re_path(r'^api/v1/debits/import/$', DebitImportView.as_view()),
     re_path(r'^api/rest-auth/', include('dj_rest_auth.urls')),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,4 +1,3 @@
-from datetime import datetime
 from decimal import Decimal, ROUND_DOWN
 import uuid
 import base64
@@ -7,6 +6,7 @@ import random
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import QuerySet
 from django.utils import timezone
 
 from rolepermissions.checkers import has_object_permission
@@ -14,26 +14,29 @@ from rolepermissions.checkers import has_object_permission
 import boto3
 from botocore.client import Config
 
-from graphene import relay, Int, ObjectType
+from graphene import relay, Int
 
-from events.models import Event
+from events.writer import write_event
+from maguire.pagination import CountStrategy, count_queryset
+from maguire.serialization import RowSerializer
 
 
-class TotalCountMixin(ObjectType):
-    @classmethod
-    def get_connection(cls):
-        class CountableConnection(relay.Connection):
-            total_count = Int()
-
-            class Meta:
-                name = '{}Connection'.format(cls._meta.name)
-                node = cls
+class CountableConnection(relay.Connection):
+    """
+    Connection with a totalCount field, set as a node's Meta.connection_class.
+    The client picks how it is counted with its strategy argument.
+    """
+    total_count = Int(strategy=CountStrategy(default_value=CountStrategy.EXACT.value))
 
-            @staticmethod
-            def resolve_total_count(root, args, context, info):
-                return root.length
+    class Meta:
+        abstract = True
 
-        return CountableConnection
+    @staticmethod
+    def resolve_total_count(root, info, strategy=CountStrategy.EXACT.value, **kwargs):
+        # only counted when totalCount is selected
+        if isinstance(root.iterable, QuerySet):
+            return count_queryset(root.iterable, strategy)
+        return len(root.iterable)
 
 
 def uuid_from_b64(encoded):
@@ -72,19 +75,21 @@ def parse_schema_non_fk_fields(mutation_data, non_fk_fields, input):
 
 
 def parse_schema_fk_fields(mutation_data, fk_fields, input):
+    # ContentTypes come from the ContentType manager's cache, which is
+    # cleared whenever content types are (re)created
     for field in fk_fields:
 
         if field == 'updated_by':
             pass  # handled in get_mutation_data
 
         if field == 'related_model' and 'related_model' in input:
-            related_model = ContentType.objects.get(
-                id=int_from_b64(input.get('related_model', None)))
+            related_model = ContentType.objects.get_for_id(
+                int_from_b64(input.get('related_model', None)))
             mutation_data["related_model"] = related_model
 
         if field == 'source_model' and 'source_model' in input:
-            source_model = ContentType.objects.get(
-                id=int_from_b64(input.get('source_model', None)))
+            source_model = ContentType.objects.get_for_id(
+                int_from_b64(input.get('source_model', None)))
             mutation_data["source_model"] = source_model
 
         # if field == 'modelname' and 'modelname' in input:
@@ -132,19 +137,19 @@ def schema_get_mutation_data(fk_fields, non_fk_fields, input, context, update):
     return mutation_data
 
 
-def schema_update_model(model_instance, mutation_data, fk_fields):
-    event_data = {}
+def schema_update_model(model_instance, mutation_data):
+    """
+    Sets mutation_data on model_instance and saves the fields that changed.
+    Returns the changed fields' new values, for the model.updated Event.
+    """
     for field, value in mutation_data.items():
         setattr(model_instance, field, value)
-        # update event data dict and update it to make it json serializable
-        if field in fk_fields:
-            # make fk json serializable
-            event_data[field] = str(value.id)
-        elif isinstance(value, datetime):
-            # make date json serializeable
-            event_data[field] = value.isoformat()
-        else:
-            event_data[field] = value
+    changed = model_instance.dirty_fields()
+
+    event_data = RowSerializer(
+        type(model_instance), [field for field in mutation_data if field in changed]
+    ).instance_data(model_instance)
+    # only the changed fields are validated and written
     model_instance.save()
     return event_data
 
@@ -158,7 +163,7 @@ def schema_define_user(context, username):
 
 
 def schema_create_updated_event(source_model, id, event_data, user):
-    Event.objects.create(**{
+    write_event(**{
         "source_model": source_model,
         "source_id": id,
         "event_at": timezone.now(),
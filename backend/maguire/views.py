@@ -0,0 +1,96 @@
+import json
+
+from django.db import connection, transaction
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView as BaseGraphQLView, HttpError
+from graphql import ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast
+
+from maguire.loaders import Loaders
+from maguire.persisted import get_document, resolve_query
+from maguire.response_cache import get_response, response_key, set_response
+
+
+class GraphQLView(BaseGraphQLView):
+    """
+    GraphQLView that
+    - gives each request its own loaders, shared by all the resolvers of the
+      request (see maguire.loaders)
+    - accepts persisted queries and reuses parsed and validated documents
+      (see maguire.persisted)
+    - caches query results (see maguire.response_cache)
+    """
+
+    def get_context(self, request):
+        request.loaders = Loaders()
+        return request
+
+    def execute_graphql_request(
+            self, request, data, query, variables, operation_name, show_graphiql=False):
+        extensions = data.get("extensions")
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        try:
+            sha256, query = resolve_query(query, extensions)
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e])
+        if not query:
+            return super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql)
+
+        schema = self.schema.graphql_schema
+        try:
+            document, validation_errors = get_document(
+                schema, sha256, query, self.validation_rules)
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e])
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if (request.method.lower() == "get" and operation_ast is not None
+                and operation_ast.operation != OperationType.QUERY):
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseNotAllowed(
+                ["POST"], "Can only perform a %s operation from a POST request." % (
+                    operation_ast.operation.value, )))
+
+        if validation_errors:
+            return ExecutionResult(data=None, errors=validation_errors)
+
+        try:
+            execute_options = {
+                "root_value": self.get_root_value(request),
+                "context_value": self.get_context(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "middleware": self.get_middleware(request),
+            }
+            if self.execution_context_class:
+                execute_options["execution_context_class"] = self.execution_context_class
+
+            if (operation_ast is not None
+                    and operation_ast.operation == OperationType.MUTATION
+                    and (graphene_settings.ATOMIC_MUTATIONS is True
+                         or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True)):
+                with transaction.atomic():
+                    result = execute(schema, document, **execute_options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+
+            key = response_key(schema, document, query, operation_name, variables,
+                               getattr(request, "user", None))
+            if key is not None:
+                data = get_response(key)
+                if data is not None:
+                    return ExecutionResult(data=data)
+            result = execute(schema, document, **execute_options)
+            if key is not None and not result.errors:
+                set_response(key, result.data)
+            return result
+        except Exception as e:
+            return ExecutionResult(errors=[e])